@@ -19,10 +19,19 @@
 #
 # Web-Site: http://webcamoid.github.io/
 
+import argparse
+
 import tools.utils
 
 
 if __name__ =='__main__':
+    parser = argparse.ArgumentParser(description='Create the Webcamoid packages.')
+    parser.add_argument('--full',
+                        action='store_true',
+                        help='remove the files kept from the previous '
+                             'deploy, ignore its results and rescan and '
+                             'copy everything again')
+    args = parser.parse_args()
     system = tools.utils.DeployToolsUtils().system
 
     while True:
@@ -34,6 +43,7 @@ if __name__ =='__main__':
             exit()
 
         if system == deploy.targetSystem:
+            deploy.fullDeploy = args.full
             deploy.run()
 
             exit()
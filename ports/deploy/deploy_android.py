@@ -20,7 +20,6 @@
 # Web-Site: http://webcamoid.github.io/
 
 import json
-import math
 import os
 import re
 import shutil
@@ -32,6 +31,7 @@ import zipfile
 import deploy_base
 import tools.android
 import tools.binary_elf
+import tools.copybackend
 import tools.qt5
 
 
@@ -60,6 +60,7 @@ class Deploy(deploy_base.DeployBase,
 
         self.binarySolver.sysBinsPath = self.detectBinPaths() + self.binarySolver.sysBinsPath
         self.binarySolver.libsSeachPaths = self.detectLibPaths()
+        self.binarySolver.ldCache = {}
         self.rootInstallDir = os.path.join(self.installDir, self.programName)
         self.libInstallDir = os.path.join(self.rootInstallDir,
                                           'libs',
@@ -77,6 +78,7 @@ class Deploy(deploy_base.DeployBase,
         self.detectMake()
         self.binarySolver.readExcludeList(os.path.join(self.rootDir, 'ports/deploy/exclude.android.txt'))
         self.binarySolver.libsSeachPaths += [self.qmakeQuery(var='QT_INSTALL_LIBS')]
+        self.binarySolver.ldLibraryPath.append(self.qmakeQuery(var='QT_INSTALL_LIBS'))
         self.packageConfig = os.path.join(self.rootDir, 'ports/deploy/package_info.conf')
         self.dependencies = []
 
@@ -153,18 +155,20 @@ class Deploy(deploy_base.DeployBase,
                     os.remove(os.path.join(root, f))
 
     def solvedepsLibs(self):
-        qtLibsPath = self.qmakeQuery(var='QT_INSTALL_LIBS')
-        self.binarySolver.ldLibraryPath.append(qtLibsPath)
         self.qtLibs = sorted(self.binarySolver.scanDependencies(self.rootInstallDir))
 
+        result = tools.copybackend.CopyResult()
+
         for dep in self.qtLibs:
             depPath = os.path.join(self.libInstallDir, os.path.basename(dep))
 
             if dep != depPath:
                 print('    {} -> {}'.format(dep, depPath))
-                self.copy(dep, depPath, True)
+                result.update(self.copy(dep, depPath, True))
                 self.dependencies.append(dep)
 
+        print('\n    ' + self.copySummary(result))
+
     def searchPackageFor(self, path):
         os.environ['LC_ALL'] = 'C'
         pacman = self.whereBin('pacman')
@@ -344,7 +348,7 @@ class Deploy(deploy_base.DeployBase,
 
         packages = set()
 
-        for dep in self.dependencies:
+        for dep in self.stagedDependencies():
             packageInfo = self.searchPackageFor(dep)
 
             if len(packageInfo) > 0:
@@ -357,28 +361,7 @@ class Deploy(deploy_base.DeployBase,
                 print('    ' + packge)
                 f.write(packge + '\n')
 
-    @staticmethod
-    def hrSize(size):
-        i = int(math.log(size) // math.log(1024))
-
-        if i < 1:
-            return '{} B'.format(size)
-
-        units = ['KiB', 'MiB', 'GiB', 'TiB']
-        sizeKiB = size / (1024 ** i)
-
-        return '{:.2f} {}'.format(sizeKiB, units[i - 1])
-
-    def printPackageInfo(self, path):
-        if os.path.exists(path):
-            print('   ',
-                  os.path.basename(path),
-                  self.hrSize(os.path.getsize(path)))
-            print('    sha256sum:', Deploy.sha256sum(path))
-        else:
-            print('   ',
-                  os.path.basename(path),
-                  'FAILED')
+        self.recordStaged(depsInfoFile)
 
     def alignPackage(self, package):
         deploymentSettingsPath = ''
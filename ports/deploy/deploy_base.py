@@ -23,7 +23,9 @@ import os
 import sys
 import platform
 import shutil
+import threading
 
+import tools.manifest
 import tools.utils
 
 class DeployBase(tools.utils.DeployToolsUtils):
@@ -36,8 +38,15 @@ class DeployBase(tools.utils.DeployToolsUtils):
         self.pkgsDir = os.path.join(self.rootDir,
                                     'ports/deploy/packages_auto',
                                     sys.platform if os.name == 'posix' else os.name)
+        self.cacheDir = os.path.join(self.buildDir, 'ports/deploy/cache')
+        self.reportsDir = os.path.join(self.buildDir, 'ports/deploy/reports')
+        self.programName = ''
         self.programVersion = ''
         self.qmake = ''
+        self.binarySolver = None
+        self.fullDeploy = False
+        self.packageDigests = {}
+        self.packageDigestsMutex = threading.Lock()
 
     def __str__(self):
         deployInfo = 'Python version: {}\n' \
@@ -73,8 +82,52 @@ class DeployBase(tools.utils.DeployToolsUtils):
         print('Deploy info\n')
         print(self)
         print('\nPreparing for software packaging\n')
+        deployManifest = os.path.join(self.cacheDir, 'deploy-manifest.json')
+        stagingManifest = os.path.join(self.cacheDir, 'staging-manifest.json')
+        self.skipUpToDate = not self.fullDeploy
+
+        # The staging directory always starts empty, so no file from a
+        # previous deploy gets packaged. The unchanged files are moved back
+        # from the mirror of the previous staging directory.
+        self.stagingDir = self.installDir
+        self.mirrorDir = os.path.join(self.cacheDir, 'staging')
+
+        if self.fullDeploy:
+            shutil.rmtree(self.mirrorDir, True)
+            shutil.rmtree(self.installDir, True)
+        else:
+            self.keepMirror()
+
+        self.stagingManifest = tools.manifest.StagingManifest(self.rootInstallDir,
+                                                              self.njobs)
+
+        if not self.fullDeploy:
+            self.stagingManifest.load(stagingManifest)
+
+        if self.binarySolver:
+            self.binarySolver.openDumpCache(os.path.join(self.cacheDir, 'dump.db'))
+            self.binarySolver.openStripCache(os.path.join(self.cacheDir, 'stripped'))
+
+            if not self.fullDeploy:
+                self.binarySolver.depGraph.load(deployManifest)
+
         self.prepare()
 
+        if self.binarySolver:
+            self.binarySolver.closeDumpCache()
+            self.binarySolver.closeStripCache()
+            self.binarySolver.depGraph.save(deployManifest)
+            self.writeDependencyGraph()
+
+        self.stagingManifest.refresh()
+        self.stagingManifest.writeJson(stagingManifest)
+        self.stagingManifest.writeJson(os.path.join(self.pkgsDir,
+                                                    '{}-{}-manifest.json'.format(self.programName,
+                                                                                 self.programVersion)))
+
+        print('\nCache statistics\n')
+        self.printCacheStats()
+
         if not 'NO_SHOW_PKG_DATA_INFO' in os.environ \
             or os.environ['NO_SHOW_PKG_DATA_INFO'] != '1':
             print('\nPackaged data info\n')
@@ -86,21 +139,139 @@ class DeployBase(tools.utils.DeployToolsUtils):
         else:
             print('\nCreating packages\n')
             self.package()
+            self.writeChecksums()
             print('\nCleaning up')
             self.cleanup()
             print('Deploy finnished\n')
 
+    @staticmethod
+    def digestAlgorithms():
+        algorithms = ['sha256']
+
+        if 'DEPLOY_BLAKE2B' in os.environ \
+            and os.environ['DEPLOY_BLAKE2B'] == '1':
+            algorithms.append('blake2b')
+
+        return algorithms
+
+    def hashPackage(self, path):
+        # The packages are created in parallel, hash them before taking the
+        # print mutex so the big ones don't wait for each other.
+        with self.packageDigestsMutex:
+            if path in self.packageDigests:
+                return self.packageDigests[path]
+
+        try:
+            digests = self.fileDigests(path, self.digestAlgorithms())
+        except:
+            return {}
+
+        with self.packageDigestsMutex:
+            self.packageDigests[path] = digests
+
+        return digests
+
+    def printPackageInfo(self, path):
+        if os.path.exists(path):
+            digests = self.hashPackage(path)
+            print('   ',
+                  os.path.basename(path),
+                  self.hrSize(os.path.getsize(path)))
+
+            for algorithm in self.digestAlgorithms():
+                if algorithm in digests:
+                    print('    {}sum: {}'.format(algorithm, digests[algorithm]))
+        else:
+            print('   ',
+                  os.path.basename(path),
+                  'FAILED')
+
+    def writeChecksums(self):
+        # Write the checksums of the packages in the format used by
+        # sha256sum and b2sum. The checksums of the packages created by other
+        # deploys in the same directory are kept.
+        sumsFiles = {'sha256': 'SHA256SUMS', 'blake2b': 'B2SUMS'}
+
+        for algorithm in self.digestAlgorithms():
+            sumsFile = os.path.join(self.pkgsDir, sumsFiles[algorithm])
+            checksums = {}
+
+            try:
+                with open(sumsFile) as f:
+                    for line in f:
+                        checksum = line.strip().split('  ', 1)
+
+                        if len(checksum) == 2 \
+                            and os.path.exists(os.path.join(self.pkgsDir,
+                                                            checksum[1])):
+                            checksums[checksum[1]] = checksum[0]
+            except:
+                pass
+
+            for path in self.packageDigests:
+                if os.path.exists(path):
+                    name = os.path.relpath(path, self.pkgsDir).replace(os.sep, '/')
+                    checksums[name] = self.packageDigests[path][algorithm]
+
+            if len(checksums) < 1:
+                continue
+
+            if not os.path.exists(self.pkgsDir):
+                os.makedirs(self.pkgsDir)
+
+            with open(sumsFile, 'w') as f:
+                for name in sorted(checksums):
+                    f.write('{}  {}\n'.format(checksums[name], name))
+
     def printPackageDataInfo(self):
-        packagedFiles = []
+        for entry in self.stagingManifest.files():
+            print('    ' + os.path.join(self.rootInstallDir, entry['path']))
+
+    def stagedDependencies(self):
+        # Returns the dependencies that are still in the staging directory,
+        # some of them could have been removed after copying them.
+        self.stagingManifest.refresh()
+
+        return [dep for dep in self.dependencies
+                if self.stagingManifest.hasOrigin(dep)]
+
+    def writeDependencyGraph(self):
+        if not os.path.exists(self.reportsDir):
+            os.makedirs(self.reportsDir)
+
+        graph = os.path.join(self.reportsDir, 'dependency-graph')
+        self.binarySolver.depGraph.writeJson(graph + '.json')
+        self.binarySolver.depGraph.writeDot(graph + '.dot')
+
+    def printCacheStats(self):
+        print('    Copy policy: {}'.format('full copy' if self.fullDeploy else self.copyPolicy))
+        print('    Copied files: ' + self.copySummary(self.copyTotals))
+        print('    ' + self.stagingManifest.stats())
+
+        for method, files, size in self.copyBackend.stats():
+            print('    Files copied using {}: {} ({})'.format(method,
+                                                               files,
+                                                               self.hrSize(size)))
+
+        if not self.binarySolver:
+            return
+
+        for stats in self.binarySolver.cacheStats():
+            print('    ' + stats)
+
+    def printUnresolvedDependencies(self):
+        unresolved = self.binarySolver.unresolvedDependencies()
+
+        if len(unresolved) < 1:
+            return
 
-        for root, _, files in os.walk(self.rootInstallDir):
-            for f in files:
-                packagedFiles.append(os.path.join(root, f))
+        print('\nUnresolved dependencies\n')
 
-        packagedFiles = sorted(packagedFiles)
+        for dep in sorted(unresolved):
+            print('    {}'.format(dep))
 
-        for f in packagedFiles:
-            print('    ' + f)
+            for binary in unresolved[dep]:
+                print('        required by {}'.format(binary))
 
     def prepare(self):
         pass
@@ -109,4 +280,6 @@ class DeployBase(tools.utils.DeployToolsUtils):
         pass
 
     def cleanup(self):
-        shutil.rmtree(self.installDir, True)
+        # Move the staging directory to the mirror, the next deploy will
+        # take the unchanged files from there.
+        self.keepMirror()
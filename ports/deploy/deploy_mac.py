@@ -30,6 +30,7 @@ import time
 
 import deploy_base
 import tools.binary_mach
+import tools.copybackend
 import tools.qt5
 
 
@@ -101,14 +102,18 @@ class Deploy(deploy_base.DeployBase, tools.qt5.DeployToolsQt):
     def solvedepsLibs(self):
         deps = sorted(self.binarySolver.scanDependencies(self.installDir))
 
+        result = tools.copybackend.CopyResult()
+
         for dep in deps:
             depPath = os.path.join(self.libInstallDir, os.path.basename(dep))
 
             if dep != depPath:
                 print('    {} -> {}'.format(dep, depPath))
-                self.copy(dep, depPath, not dep.endswith('.framework'))
+                result.update(self.copy(dep, depPath, not dep.endswith('.framework')))
                 self.dependencies.append(dep)
 
+        print('\n    ' + self.copySummary(result))
+
     @staticmethod
     def removeUnneededFiles(path):
         adirs = set()
@@ -144,21 +149,16 @@ class Deploy(deploy_base.DeployBase, tools.qt5.DeployToolsQt):
                                              self.binaryInstallDir))
         log = '\tFixed {}\n\n'.format(mach)
         machInfo = self.binarySolver.dump(mach)
+        deleteRpaths = []
+        addRpaths = []
+        newId = ''
+        changes = {}
 
         # Change rpath
         if mach.startswith(self.binaryInstallDir):
             log += '\t\tChanging rpath to {}\n'.format(rpath)
-
-            for oldRpath in machInfo['rpaths']:
-                process = subprocess.Popen(['install_name_tool', # nosec
-                                            '-delete_rpath', oldRpath, mach],
-                                           stdout=subprocess.PIPE)
-                process.communicate()
-
-            process = subprocess.Popen(['install_name_tool', # nosec
-                                        '-add_rpath', rpath, mach],
-                                       stdout=subprocess.PIPE)
-            process.communicate()
+            deleteRpaths = machInfo['rpaths']
+            addRpaths = [rpath]
 
         # Change ID
         if mach.startswith(self.binaryInstallDir):
@@ -170,11 +170,7 @@ class Deploy(deploy_base.DeployBase, tools.qt5.DeployToolsQt):
 
         if newMachId != machInfo['id']:
             log += '\t\tChanging ID to {}\n'.format(newMachId)
-
-            process = subprocess.Popen(['install_name_tool', # nosec
-                                        '-id', newMachId, mach],
-                                       stdout=subprocess.PIPE)
-            process.communicate()
+            newId = newMachId
 
         # Change library links
         for dep in machInfo['imports']:
@@ -197,16 +193,51 @@ class Deploy(deploy_base.DeployBase, tools.qt5.DeployToolsQt):
 
             if dep != newDepPath:
                 log += '\t\t{} -> {}\n'.format(dep, newDepPath)
-
-                process = subprocess.Popen(['install_name_tool', # nosec
-                                            '-change', dep, newDepPath, mach],
-                                           stdout=subprocess.PIPE)
-                process.communicate()
+                changes[dep] = newDepPath
+
+        # Apply all changes at once, and fall back to install_name_tool if
+        # the binary can't be rewritten in place.
+        if (len(deleteRpaths) > 0
+            or len(addRpaths) > 0
+            or len(newId) > 0
+            or len(changes) > 0) \
+            and not self.binarySolver.rewriteLoadCommands(mach,
+                                                          deleteRpaths,
+                                                          addRpaths,
+                                                          newId,
+                                                          changes):
+            self.runInstallNameTool(mach, deleteRpaths, addRpaths, newId, changes)
 
         mutex.acquire()
         print(log)
         mutex.release()
 
+    @staticmethod
+    def runInstallNameTool(mach, deleteRpaths, addRpaths, newId, changes):
+        for oldRpath in deleteRpaths:
+            process = subprocess.Popen(['install_name_tool', # nosec
+                                        '-delete_rpath', oldRpath, mach],
+                                       stdout=subprocess.PIPE)
+            process.communicate()
+
+        for newRpath in addRpaths:
+            process = subprocess.Popen(['install_name_tool', # nosec
+                                        '-add_rpath', newRpath, mach],
+                                       stdout=subprocess.PIPE)
+            process.communicate()
+
+        if len(newId) > 0:
+            process = subprocess.Popen(['install_name_tool', # nosec
+                                        '-id', newId, mach],
+                                       stdout=subprocess.PIPE)
+            process.communicate()
+
+        for dep in changes:
+            process = subprocess.Popen(['install_name_tool', # nosec
+                                        '-change', dep, changes[dep], mach],
+                                       stdout=subprocess.PIPE)
+            process.communicate()
+
     def fixRpaths(self):
         path = os.path.join(self.execPrefixDir)
         mutex = threading.Lock()
@@ -316,7 +347,7 @@ class Deploy(deploy_base.DeployBase, tools.qt5.DeployToolsQt):
 
         packages = set()
 
-        for dep in self.dependencies:
+        for dep in self.stagedDependencies():
             packageInfo = self.searchPackageFor(cellarPath, dep)
 
             if len(packageInfo) > 0:
@@ -329,41 +360,7 @@ class Deploy(deploy_base.DeployBase, tools.qt5.DeployToolsQt):
                 print('    ' + packge)
                 f.write(packge + '\n')
 
-    @staticmethod
-    def hrSize(size):
-        i = int(math.log(size) // math.log(1024))
-
-        if i < 1:
-            return '{} B'.format(size)
-
-        units = ['KiB', 'MiB', 'GiB', 'TiB']
-        sizeKiB = size / (1024 ** i)
-
-        return '{:.2f} {}'.format(sizeKiB, units[i - 1])
-
-    def printPackageInfo(self, path):
-        if os.path.exists(path):
-            print('   ',
-                  os.path.basename(path),
-                  self.hrSize(os.path.getsize(path)))
-            print('    sha256sum:', Deploy.sha256sum(path))
-        else:
-            print('   ',
-                  os.path.basename(path),
-                  'FAILED')
-
-    @staticmethod
-    def dirSize(path):
-        size = 0
-
-        for root, _, files in os.walk(path):
-            for f in files:
-                fpath = os.path.join(root, f)
-
-                if not os.path.islink(fpath):
-                    size += os.path.getsize(fpath)
-
-        return size
+        self.recordStaged(depsInfoFile)
 
     # https://asmaloney.com/2013/07/howto/packaging-a-mac-os-x-application-using-a-dmg/
     def createPortable(self, mutex):
@@ -372,9 +369,10 @@ class Deploy(deploy_base.DeployBase, tools.qt5.DeployToolsQt):
         if not os.path.exists(staggingDir):
             os.makedirs(staggingDir)
 
-        self.copy(self.appBundleDir,
-                  os.path.join(staggingDir, self.programName + '.app'))
-        imageSize = self.dirSize(staggingDir)
+        self.copyStaged(self.appBundleDir,
+                        os.path.join(staggingDir, self.programName + '.app'))
+        imageSize = self.stagingManifest.size(os.path.relpath(self.appBundleDir,
+                                                              self.rootInstallDir))
         tmpDmg = os.path.join(self.installDir, self.programName + '_tmp.dmg')
         volumeName = "{}-portable-{}".format(self.programName,
                                              self.programVersion)
@@ -463,6 +461,8 @@ class Deploy(deploy_base.DeployBase, tools.qt5.DeployToolsQt):
                                    stdout=subprocess.PIPE)
         process.communicate()
 
+        self.hashPackage(packagePath)
+
         mutex.acquire()
         print('Created portable package:')
         self.printPackageInfo(packagePath)
@@ -474,6 +474,8 @@ class Deploy(deploy_base.DeployBase, tools.qt5.DeployToolsQt):
         if not packagePath:
             return
 
+        self.hashPackage(self.outPackage)
+
         mutex.acquire()
         print('Created installable package:')
         self.printPackageInfo(self.outPackage)
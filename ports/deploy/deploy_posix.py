@@ -20,7 +20,6 @@
 # Web-Site: http://webcamoid.github.io/
 
 import configparser
-import math
 import os
 import platform
 import subprocess # nosec
@@ -30,6 +29,7 @@ import threading
 
 import deploy_base
 import tools.binary_elf
+import tools.copybackend
 import tools.qt5
 
 
@@ -67,6 +67,7 @@ class Deploy(deploy_base.DeployBase, tools.qt5.DeployToolsQt):
             self.targetSystem = 'android'
 
         self.binarySolver = tools.binary_elf.DeployToolsBinary()
+        self.binarySolver.ldLibraryPath.append(self.qmakeQuery(var='QT_INSTALL_LIBS'))
         self.binarySolver.readExcludeList(os.path.join(self.rootDir, 'ports/deploy/exclude.{}.{}.txt'.format(os.name, sys.platform)))
         self.packageConfig = os.path.join(self.rootDir, 'ports/deploy/package_info.conf')
         self.dependencies = []
@@ -100,18 +101,20 @@ class Deploy(deploy_base.DeployBase, tools.qt5.DeployToolsQt):
         return self.whereBin('appimagetool-x86_64.AppImage')
 
     def solvedepsLibs(self):
-        qtLibsPath = self.qmakeQuery(var='QT_INSTALL_LIBS')
-        self.binarySolver.ldLibraryPath.append(qtLibsPath)
         deps = sorted(self.binarySolver.scanDependencies(self.installDir))
 
+        result = tools.copybackend.CopyResult()
+
         for dep in deps:
             depPath = os.path.join(self.libInstallDir, os.path.basename(dep))
 
             if dep != depPath:
                 print('    {} -> {}'.format(dep, depPath))
-                self.copy(dep, depPath, True)
+                result.update(self.copy(dep, depPath, True))
                 self.dependencies.append(dep)
 
+        print('\n    ' + self.copySummary(result))
+
     def prepare(self):
         print('Executing make install')
         self.makeInstall(self.buildDir, self.installDir)
@@ -300,7 +303,7 @@ class Deploy(deploy_base.DeployBase, tools.qt5.DeployToolsQt):
 
         packages = set()
 
-        for dep in self.dependencies:
+        for dep in self.stagedDependencies():
             packageInfo = self.searchPackageFor(dep)
 
             if len(packageInfo) > 0:
@@ -313,6 +316,8 @@ class Deploy(deploy_base.DeployBase, tools.qt5.DeployToolsQt):
                 print('    ' + packge)
                 f.write(packge + '\n')
 
+        self.recordStaged(depsInfoFile)
+
     def createLauncher(self):
         path = os.path.join(self.rootInstallDir, self.programName) + '.sh'
         libDir = self.qmakeQuery(var='QT_INSTALL_LIBS') \
@@ -330,29 +335,7 @@ class Deploy(deploy_base.DeployBase, tools.qt5.DeployToolsQt):
             launcher.write('{} "$@"\n'.format(self.programName))
 
         os.chmod(path, 0o744)
-
-    @staticmethod
-    def hrSize(size):
-        i = int(math.log(size) // math.log(1024))
-
-        if i < 1:
-            return '{} B'.format(size)
-
-        units = ['KiB', 'MiB', 'GiB', 'TiB']
-        sizeKiB = size / (1024 ** i)
-
-        return '{:.2f} {}'.format(sizeKiB, units[i - 1])
-
-    def printPackageInfo(self, path):
-        if os.path.exists(path):
-            print('   ',
-                  os.path.basename(path),
-                  self.hrSize(os.path.getsize(path)))
-            print('    sha256sum:', Deploy.sha256sum(path))
-        else:
-            print('   ',
-                  os.path.basename(path),
-                  'FAILED')
+        self.recordStaged(path)
 
     def createPortable(self, mutex):
         packagePath = \
@@ -365,7 +348,14 @@ class Deploy(deploy_base.DeployBase, tools.qt5.DeployToolsQt):
             os.makedirs(self.pkgsDir)
 
         with tarfile.open(packagePath, 'w:xz') as tar:
-            tar.add(self.rootInstallDir, self.programName)
+            tar.add(self.rootInstallDir, self.programName, recursive=False)
+
+            for path in self.stagingManifest.paths():
+                tar.add(os.path.join(self.rootInstallDir, path),
+                        os.path.join(self.programName, path),
+                        recursive=False)
+
+        self.hashPackage(packagePath)
 
         mutex.acquire()
         print('Created portable package:')
@@ -378,6 +368,8 @@ class Deploy(deploy_base.DeployBase, tools.qt5.DeployToolsQt):
         if not packagePath:
             return
 
+        self.hashPackage(self.outPackage)
+
         mutex.acquire()
         print('Created installable package:')
         self.printPackageInfo(self.outPackage)
@@ -398,7 +390,7 @@ class Deploy(deploy_base.DeployBase, tools.qt5.DeployToolsQt):
         if not os.path.exists(usrDir):
             os.makedirs(usrDir)
 
-        self.copy(self.rootInstallDir, usrDir)
+        self.copyStaged(self.rootInstallDir, usrDir)
         launcher = os.path.join(appDir, 'AppRun')
 
         if not os.path.exists(launcher):
@@ -468,6 +460,8 @@ class Deploy(deploy_base.DeployBase, tools.qt5.DeployToolsQt):
                                     env=penv)
         process.communicate()
 
+        self.hashPackage(packagePath)
+
         mutex.acquire()
         print('Created AppImage package:')
         self.printPackageInfo(packagePath)
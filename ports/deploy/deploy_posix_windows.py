@@ -19,7 +19,6 @@
 #
 # Web-Site: http://webcamoid.github.io/
 
-import math
 import os
 import subprocess # nosec
 import sys
@@ -28,6 +27,7 @@ import zipfile
 
 import deploy_base
 import tools.binary_pecoff
+import tools.copybackend
 import tools.qt5
 
 
@@ -61,6 +61,7 @@ class Deploy(deploy_base.DeployBase, tools.qt5.DeployToolsQt):
         self.detectMake()
         self.binarySolver = tools.binary_pecoff.DeployToolsBinary()
         self.binarySolver.readExcludeList(os.path.join(self.rootDir, 'ports/deploy/exclude.{}.{}.txt'.format(os.name, sys.platform)))
+        self.binarySolver.readSystemDllsList(os.path.join(self.rootDir, 'ports/deploy/exclude.nt.win32.txt'))
         self.packageConfig = os.path.join(self.rootDir, 'ports/deploy/package_info.conf')
         self.dependencies = []
         self.installerConfig = os.path.join(self.installDir, 'installer/config')
@@ -146,7 +147,7 @@ class Deploy(deploy_base.DeployBase, tools.qt5.DeployToolsQt):
                      'D3DCompiler_47.dll']
 
         for dep in extraDeps:
-            path = self.whereBin(dep)
+            path = self.binarySolver.dllPath(dep)
 
             if path != '':
                 deps.add(path)
@@ -156,14 +157,19 @@ class Deploy(deploy_base.DeployBase, tools.qt5.DeployToolsQt):
 
         deps = sorted(deps)
 
+        result = tools.copybackend.CopyResult()
+
         for dep in deps:
             depPath = os.path.join(self.binaryInstallDir, os.path.basename(dep))
 
             if dep != depPath:
                 print('    {} -> {}'.format(dep, depPath))
-                self.copy(dep, depPath)
+                result.update(self.copy(dep, depPath))
                 self.dependencies.append(dep)
 
+        print('\n    ' + self.copySummary(result))
+        self.printUnresolvedDependencies()
+
     def removeDebugs(self):
         dbgFiles = set()
 
@@ -352,7 +358,7 @@ class Deploy(deploy_base.DeployBase, tools.qt5.DeployToolsQt):
 
         packages = set()
 
-        for dep in self.dependencies:
+        for dep in self.stagedDependencies():
             packageInfo = self.searchPackageFor(dep)
 
             if len(packageInfo) > 0:
@@ -365,6 +371,8 @@ class Deploy(deploy_base.DeployBase, tools.qt5.DeployToolsQt):
                 print('    ' + packge)
                 f.write(packge + '\n')
 
+        self.recordStaged(depsInfoFile)
+
     def createLauncher(self):
         path = os.path.join(self.rootInstallDir, self.programName) + '.bat'
         libDir = os.path.relpath(self.libInstallDir, self.rootInstallDir)
@@ -386,28 +394,7 @@ class Deploy(deploy_base.DeployBase, tools.qt5.DeployToolsQt):
                            + '-p "%~dp0{}\\avkys" '.format(libDir)
                            + '-c "%~dp0share\\config"\n')
 
-    @staticmethod
-    def hrSize(size):
-        i = int(math.log(size) // math.log(1024))
-
-        if i < 1:
-            return '{} B'.format(size)
-
-        units = ['KiB', 'MiB', 'GiB', 'TiB']
-        sizeKiB = size / (1024 ** i)
-
-        return '{:.2f} {}'.format(sizeKiB, units[i - 1])
-
-    def printPackageInfo(self, path):
-        if os.path.exists(path):
-            print('   ',
-                  os.path.basename(path),
-                  self.hrSize(os.path.getsize(path)))
-            print('    sha256sum:', Deploy.sha256sum(path))
-        else:
-            print('   ',
-                  os.path.basename(path),
-                  'FAILED')
+        self.recordStaged(path)
 
     def createPortable(self, mutex):
         arch = 'win32' if self.targetArch == '32bit' else 'win64'
@@ -421,12 +408,11 @@ class Deploy(deploy_base.DeployBase, tools.qt5.DeployToolsQt):
             os.makedirs(self.pkgsDir)
 
         with zipfile.ZipFile(packagePath, 'w', zipfile.ZIP_DEFLATED, False) as zipFile:
-            for root, dirs, files in os.walk(self.rootInstallDir):
-                for f in dirs + files:
-                    filePath = os.path.join(root, f)
-                    dstPath = os.path.join(self.programName,
-                                           filePath.replace(self.rootInstallDir + os.sep, ''))
-                    zipFile.write(filePath, dstPath)
+            for path in self.stagingManifest.paths():
+                zipFile.write(os.path.join(self.rootInstallDir, path),
+                              os.path.join(self.programName, path))
+
+        self.hashPackage(packagePath)
 
         mutex.acquire()
         print('Created portable package:')
@@ -439,6 +425,8 @@ class Deploy(deploy_base.DeployBase, tools.qt5.DeployToolsQt):
         if not packagePath:
             return
 
+        self.hashPackage(self.outPackage)
+
         mutex.acquire()
         print('Created installable package:')
         self.printPackageInfo(self.outPackage)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Webcamoid, webcam capture application.
+# Copyright (C) 2017  Gonzalo Exequiel Pedone
+#
+# Webcamoid is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Webcamoid is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Webcamoid. If not, see <http://www.gnu.org/licenses/>.
+#
+# Web-Site: http://webcamoid.github.io/
+
+# Writes the synthetic ld.so.cache files used by the tests, in the old
+# format, the new format and the combined format, where the new format is
+# appended to the old one.
+#
+# Run it from this directory to create the fixtures again.
+#
+# https://sourceware.org/git/?p=glibc.git;a=blob;f=sysdeps/generic/dl-cache.h
+
+import os
+import struct
+
+# Cache magic signatures
+CACHEMAGIC = b'ld.so-1.7.0'
+CACHEMAGIC_NEW = b'glibc-ld.so.cache1.1'
+
+# Library flags
+FLAG_ELF_LIBC6 = 0x0003
+FLAG_X8664_LIB64 = 0x0300
+FLAG_AARCH64_LIB64 = 0x0a00
+
+# Libraries in the glibc-hwcaps subdirectories
+DL_CACHE_HWCAP_EXTENSION = 1 << 62
+
+# Each entry is written as:
+#
+# (flags, soname, path, hwcap)
+OLD_ENTRIES = [(FLAG_ELF_LIBC6 | FLAG_X8664_LIB64, 'libold.so.5', '/lib64/libold.so.5', 0),
+               (FLAG_ELF_LIBC6, 'libold.so.5', '/lib/libold.so.5', 0)]
+
+NEW_ENTRIES = [(FLAG_ELF_LIBC6 | FLAG_X8664_LIB64,
+                'libbar.so.2',
+                '/usr/lib/x86_64-linux-gnu/glibc-hwcaps/x86-64-v3/libbar.so.2',
+                DL_CACHE_HWCAP_EXTENSION | 2),
+               (FLAG_ELF_LIBC6 | FLAG_X8664_LIB64,
+                'libbar.so.2',
+                '/usr/lib/x86_64-linux-gnu/libbar.so.2',
+                0),
+               (FLAG_ELF_LIBC6 | FLAG_AARCH64_LIB64,
+                'libfoo.so.1',
+                '/usr/lib/aarch64-linux-gnu/libfoo.so.1',
+                0),
+               (FLAG_ELF_LIBC6 | FLAG_X8664_LIB64,
+                'libfoo.so.1',
+                '/usr/lib/x86_64-linux-gnu/libfoo.so.1',
+                0),
+               (FLAG_ELF_LIBC6,
+                'libfoo.so.1',
+                '/usr/lib/i386-linux-gnu/libfoo.so.1',
+                0)]
+
+
+def stringTable(entries, base):
+    # Returns the strings and the offset of each one, relative to base.
+    strings = b''
+    offsets = {}
+
+    for _, soname, path, _ in entries:
+        for string in [soname, path]:
+            if not string in offsets:
+                offsets[string] = base + len(strings)
+                strings += string.encode() + b'\x00'
+
+    return strings, offsets
+
+def oldEntries(entries, offsets):
+    return b''.join([struct.pack('iII', flags, offsets[soname], offsets[path])
+                     for flags, soname, path, _ in entries])
+
+def oldHeader(nlibs):
+    return CACHEMAGIC.ljust(12, b'\x00') + struct.pack('I', nlibs)
+
+def oldCache(entries):
+    strings, offsets = stringTable(entries, 0)
+
+    return oldHeader(len(entries)) + oldEntries(entries, offsets) + strings
+
+def newCache(entries):
+    # The strings are relative to the beginning of the header.
+    headerSize = 48 + 24 * len(entries)
+    strings, offsets = stringTable(entries, headerSize)
+    header = CACHEMAGIC_NEW \
+           + struct.pack('IIB3xI12x', len(entries), len(strings), 0, 0)
+
+    return header \
+         + b''.join([struct.pack('iIIIQ', flags, offsets[soname], offsets[path], 0, hwcap)
+                     for flags, soname, path, hwcap in entries]) \
+         + strings
+
+def combinedCache(oldEntriesList, newEntriesList):
+    # The new format is placed right after the old entries, and contains all
+    # the entries. The strings of the old entries are relative to the end of
+    # the old entries, so both share the same string table.
+    entries = oldEntriesList + newEntriesList
+    _, offsets = stringTable(entries, 48 + 24 * len(entries))
+
+    return oldHeader(len(oldEntriesList)) \
+         + oldEntries(oldEntriesList, offsets) \
+         + newCache(entries)
+
+def fixtures():
+    return {'old.cache': oldCache(OLD_ENTRIES),
+            'new.cache': newCache(NEW_ENTRIES),
+            'combined.cache': combinedCache(OLD_ENTRIES, NEW_ENTRIES)}
+
+
+if __name__ == '__main__':
+    for name, data in fixtures().items():
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), name), 'wb') as f:
+            f.write(data)
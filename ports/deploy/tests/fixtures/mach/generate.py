@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Webcamoid, webcam capture application.
+# Copyright (C) 2017  Gonzalo Exequiel Pedone
+#
+# Webcamoid is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Webcamoid is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Webcamoid. If not, see <http://www.gnu.org/licenses/>.
+#
+# Web-Site: http://webcamoid.github.io/
+
+# Writes the synthetic Mach-O files used by the tests. These only have the
+# headers and load commands read by the deploy tools, plus a few bytes of
+# fake code, so they can be created and read in any system.
+#
+# Run it from this directory to create the fixtures again.
+
+import os
+import struct
+
+# Magic numbers
+MH_MAGIC = 0xfeedface
+MH_MAGIC_64 = 0xfeedfacf
+FAT_MAGIC = 0xcafebabe
+
+# CPU types
+CPU_TYPE_I386 = 7
+CPU_TYPE_X86_64 = 7 | 0x01000000
+CPU_TYPE_ARM64 = 12 | 0x01000000
+CPU_TYPE_POWERPC = 18
+
+# File types
+MH_DYLIB = 0x6
+
+# Commands definitions
+LC_REQ_DYLD = 0x80000000
+LC_SEGMENT = 0x1
+LC_LOAD_DYLIB = 0xc
+LC_ID_DYLIB = 0xd
+LC_SEGMENT_64 = 0x19
+LC_RPATH = 0x1c | LC_REQ_DYLD
+LC_CODE_SIGNATURE = 0x1d
+
+CODE = b'\x55\x48\x89\xe5\x5d\xc3' + b'\x90' * 10
+
+
+def align(size, alignment):
+    return size + (-size % alignment)
+
+def stringCommand(cmd, fields, string, endian, is64):
+    string = string.encode() + b'\x00'
+    stringOffset = 12 + len(fields)
+    cmdsize = align(stringOffset + len(string), 8 if is64 else 4)
+
+    return struct.pack(endian + 'III', cmd, cmdsize, stringOffset) \
+         + fields \
+         + string.ljust(cmdsize - stringOffset, b'\x00')
+
+def dylibCommand(cmd, name, endian, is64):
+    # (timestamp, current_version, compatibility_version)
+    return stringCommand(cmd,
+                         struct.pack(endian + 'III', 2, 0x10000, 0x10000),
+                         name,
+                         endian,
+                         is64)
+
+def segmentCommand(textOffset, fileSize, endian, is64):
+    # A __TEXT segment with a single __text section at textOffset.
+    if is64:
+        section = struct.pack(endian + '16s16sQQIIIIIIII',
+                              b'__text', b'__TEXT',
+                              textOffset, len(CODE), textOffset,
+                              4, 0, 0, 0x80000400, 0, 0, 0)
+
+        return struct.pack(endian + 'II16sQQQQiiII',
+                           LC_SEGMENT_64, 72 + len(section), b'__TEXT',
+                           0, fileSize, 0, fileSize,
+                           5, 5, 1, 0) + section
+
+    section = struct.pack(endian + '16s16sIIIIIIIII',
+                          b'__text', b'__TEXT',
+                          textOffset, len(CODE), textOffset,
+                          4, 0, 0, 0x80000400, 0, 0)
+
+    return struct.pack(endian + 'II16sIIIIiiII',
+                       LC_SEGMENT, 56 + len(section), b'__TEXT',
+                       0, fileSize, 0, fileSize,
+                       5, 5, 1, 0) + section
+
+def machO(cputype,
+          dylibId,
+          imports,
+          rpaths,
+          is64=True,
+          endian='<',
+          textOffset=0x1000,
+          signed=False):
+    # Creates a dylib, if textOffset is 0 the code is placed right after the
+    # load commands, leaving no room for adding more commands.
+    headerSize = 32 if is64 else 28
+
+    def commands(textOffset, fileSize):
+        cmds = [segmentCommand(textOffset, fileSize, endian, is64),
+                dylibCommand(LC_ID_DYLIB, dylibId, endian, is64)]
+        cmds += [dylibCommand(LC_LOAD_DYLIB, dylib, endian, is64)
+                 for dylib in imports]
+        cmds += [stringCommand(LC_RPATH, b'', rpath, endian, is64)
+                 for rpath in rpaths]
+
+        if signed:
+            # (cmd, cmdsize, dataoff, datasize)
+            cmds.append(struct.pack(endian + 'IIII',
+                                    LC_CODE_SIGNATURE, 16,
+                                    fileSize - 16, 16))
+
+        return cmds
+
+    if textOffset < 1:
+        textOffset = align(headerSize + len(b''.join(commands(0, 0))), 16)
+
+    fileSize = textOffset + len(CODE) + (16 if signed else 0)
+    cmds = commands(textOffset, fileSize)
+    header = struct.pack(endian + 'IiiIIII',
+                         MH_MAGIC_64 if is64 else MH_MAGIC,
+                         cputype,
+                         3,
+                         MH_DYLIB,
+                         len(cmds),
+                         len(b''.join(cmds)),
+                         0x100085)
+
+    if is64:
+        header += b'\x00' * 4
+
+    data = (header + b''.join(cmds)).ljust(textOffset, b'\x00') + CODE
+
+    if signed:
+        data += b'\xfa\xde\x0c\xc0' + b'\x00' * 12
+
+    return data
+
+def fat(slices):
+    # Place every slice in its own page.
+    archs = b''
+    data = b''
+    offset = 0x1000
+
+    for cputype, sliceData in slices:
+        archs += struct.pack('>iiIII', cputype, 3, offset, len(sliceData), 12)
+        data = data.ljust(offset - 0x1000, b'\x00') + sliceData
+        offset = align(0x1000 + len(data), 0x1000)
+
+    header = struct.pack('>II', FAT_MAGIC, len(slices)) + archs
+
+    return header.ljust(0x1000, b'\x00') + data
+
+def javaClass():
+    # Java class files share the magic number with universal binaries,
+    # followed by the minor and major versions of the class file format.
+    return struct.pack('>IHHH', FAT_MAGIC, 0, 52, 1).ljust(64, b'\x00')
+
+def fixtures():
+    thin = {'cputype': CPU_TYPE_X86_64,
+            'dylibId': '/usr/local/lib/libfoo.1.dylib',
+            'imports': ['/usr/local/lib/libbar.1.dylib',
+                        '/usr/lib/libSystem.B.dylib'],
+            'rpaths': ['/usr/local/lib']}
+
+    return {'thin.dylib': machO(**thin),
+            'thin-be32.dylib': machO(CPU_TYPE_POWERPC,
+                                     '/usr/local/lib/libfoo.1.dylib',
+                                     ['/usr/lib/libSystem.B.dylib'],
+                                     ['@loader_path/../lib'],
+                                     is64=False,
+                                     endian='>'),
+            'noroom.dylib': machO(textOffset=0, **thin),
+            'signed.dylib': machO(signed=True, **thin),
+            'fat.dylib': fat([(CPU_TYPE_X86_64, machO(**thin)),
+                              (CPU_TYPE_ARM64,
+                               machO(CPU_TYPE_ARM64,
+                                     '/opt/homebrew/lib/libfoo.1.dylib',
+                                     ['/opt/homebrew/lib/libbar.1.dylib',
+                                      '/usr/lib/libSystem.B.dylib'],
+                                     ['/opt/homebrew/lib']))]),
+            'fat-i386.dylib': fat([(CPU_TYPE_I386,
+                                    machO(CPU_TYPE_I386,
+                                          '/usr/local/lib/libfoo.1.dylib',
+                                          ['/usr/lib/libSystem.B.dylib'],
+                                          [],
+                                          is64=False))]),
+            'java.class': javaClass()}
+
+
+if __name__ == '__main__':
+    for name, data in fixtures().items():
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), name), 'wb') as f:
+            f.write(data)
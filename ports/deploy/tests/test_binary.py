@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Webcamoid, webcam capture application.
+# Copyright (C) 2017  Gonzalo Exequiel Pedone
+#
+# Webcamoid is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Webcamoid is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Webcamoid. If not, see <http://www.gnu.org/licenses/>.
+#
+# Web-Site: http://webcamoid.github.io/
+
+import glob
+import os
+import re
+import shutil
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+import tools.binary
+
+
+EXCLUDE_LISTS = sorted(glob.glob(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                              'exclude.*.txt')))
+
+
+def legacyIsExcluded(excludes, path, targetSystem):
+    # The exclude check used before the patterns were joined in a single
+    # regular expression.
+    for exclude in excludes:
+        if targetSystem == 'windows' or targetSystem == 'posix_windows':
+            path = path.lower().replace('\\', '/')
+            exclude = exclude.lower()
+
+        if re.fullmatch(exclude, path):
+            return True
+
+    return False
+
+def samplePaths(pattern):
+    # Returns paths that match, or almost match, the exclude pattern.
+    name = pattern
+
+    if name.startswith('(.*/)*'):
+        name = name[len('(.*/)*'):]
+
+    name = name.replace('[0-9]+', '6') \
+               .replace('.*', 'x') \
+               .replace('\\.', '.') \
+               .replace('\\+', '+')
+
+    if re.search(r'[][()|*?{}\\]', name):
+        return []
+
+    return [name,
+            '/usr/lib/' + name,
+            '/usr/lib/x86_64-linux-gnu/' + name + '.1',
+            '/opt/qt/lib/lib' + name,
+            'C:\\Windows\\System32\\' + name.upper(),
+            name.replace('.', 'x')]
+
+def dependencyList():
+    # A list of dependencies like the ones found while deploying: the
+    # libraries in the system, and paths built from the exclude lists.
+    paths = []
+
+    for libdir in ['/usr/lib/x86_64-linux-gnu', '/usr/lib64', '/usr/lib']:
+        try:
+            paths += [os.path.join(libdir, name)
+                      for name in sorted(os.listdir(libdir))]
+        except:
+            pass
+
+    binary = tools.binary.DeployToolsBinary()
+
+    for excludeList in EXCLUDE_LISTS:
+        for pattern in binary.readPatterns(excludeList):
+            paths += samplePaths(pattern)
+
+    return paths
+
+
+class TestExcludes(unittest.TestCase):
+    def excludeLists(self):
+        # The cross deploy to Windows reads the list of the host.
+        for excludeList in EXCLUDE_LISTS:
+            if excludeList.endswith('.nt.win32.txt'):
+                targetSystems = ['windows']
+            elif excludeList.endswith('.darwin.txt'):
+                targetSystems = ['mac']
+            else:
+                targetSystems = ['posix', 'posix_windows']
+
+            for targetSystem in targetSystems:
+                binary = tools.binary.DeployToolsBinary()
+                binary.targetSystem = targetSystem
+                binary.readExcludeList(excludeList)
+
+                yield excludeList, targetSystem, binary
+
+    def testSameVerdicts(self):
+        # The joined regular expression must give the same verdicts as
+        # matching each pattern on its own.
+        paths = dependencyList()
+        self.assertTrue(len(EXCLUDE_LISTS) > 0)
+
+        for excludeList, targetSystem, binary in self.excludeLists():
+            excluded = 0
+
+            for path in paths:
+                verdict = legacyIsExcluded(binary.excludes, path, targetSystem)
+                self.assertEqual(binary.isExcluded(path),
+                                 verdict,
+                                 (os.path.basename(excludeList), targetSystem, path))
+                excluded += verdict
+
+            self.assertTrue(excluded > 0, (excludeList, targetSystem))
+
+    @unittest.skipUnless(os.environ.get('DEPLOY_BENCHMARKS') == '1',
+                         'set DEPLOY_BENCHMARKS=1 to run the benchmarks')
+    def testBenchmark(self):
+        paths = dependencyList()
+
+        for excludeList, targetSystem, binary in self.excludeLists():
+            start = time.perf_counter()
+
+            for path in paths:
+                legacyIsExcluded(binary.excludes, path, targetSystem)
+
+            legacyTime = time.perf_counter() - start
+            start = time.perf_counter()
+
+            for path in paths:
+                binary.matchExclude(path, targetSystem)
+
+            regexTime = time.perf_counter() - start
+            print('\n{} ({}), {} paths: per pattern {:.3f} s, '
+                  'joined regex {:.3f} s'.format(os.path.basename(excludeList),
+                                                  targetSystem,
+                                                  len(paths),
+                                                  legacyTime,
+                                                  regexTime))
+
+
+class TestIsCandidate(unittest.TestCase):
+    def setUp(self):
+        self.binary = tools.binary.DeployToolsBinary()
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir, True)
+
+    def candidates(self, names):
+        for name in names:
+            with open(os.path.join(self.tempDir, name), 'w') as f:
+                f.write('module Foo\n')
+
+        with os.scandir(self.tempDir) as entries:
+            return sorted([entry.name
+                           for entry in entries
+                           if self.binary.isCandidate(entry)])
+
+    def testDataFiles(self):
+        self.assertEqual(self.candidates(['qmldir',
+                                          'plugins.qmltypes',
+                                          'Main.qml',
+                                          'libfoo.so',
+                                          'webcamoid']),
+                         ['libfoo.so', 'webcamoid'])
+
+
+class TestStripSymbols(unittest.TestCase):
+    def setUp(self):
+        self.binary = tools.binary.DeployToolsBinary()
+        self.tempDir = tempfile.mkdtemp()
+        self.binaries = []
+
+        for name in ['libbad.so', 'libgood.so']:
+            path = os.path.join(self.tempDir, name)
+
+            with open(path, 'wb') as f:
+                f.write(b'\0' * 64)
+
+            self.binaries.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir, True)
+
+    def testFailedStrip(self):
+        # A binary that can't be stripped is reported, and the others are
+        # still stripped.
+        stripped = []
+
+        def strip(binary):
+            if binary.endswith('libbad.so'):
+                raise OSError('file format not recognized')
+
+            stripped.append(binary)
+
+        with unittest.mock.patch.object(self.binary, 'find', return_value=self.binaries), \
+             unittest.mock.patch.object(self.binary, 'strip', side_effect=strip), \
+             unittest.mock.patch('builtins.print') as output:
+            self.binary.stripSymbols(self.tempDir)
+
+        lines = [call.args[0] for call in output.call_args_list]
+        self.assertEqual(stripped, [self.binaries[1]])
+        self.assertIn('    {}: failed to strip: file format not recognized'.format(self.binaries[0]),
+                      lines)
+        self.assertTrue(lines[-1].startswith('    1 binaries stripped, 0 already stripped, 1 failed'))
+
+
+class TestStripCache(unittest.TestCase):
+    def setUp(self):
+        self.binary = tools.binary.DeployToolsBinary()
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.binary.closeStripCache()
+        shutil.rmtree(self.tempDir, True)
+
+    def cacheSize(self, size):
+        env = {'STRIP_CACHE_SIZE': size, 'NO_DEPLOY_CACHE': '0'}
+
+        with unittest.mock.patch.dict(os.environ, env), \
+             unittest.mock.patch('builtins.print'):
+            self.binary.openStripCache(self.tempDir)
+
+        return self.binary.stripCache.maxSize
+
+    def testCacheSize(self):
+        self.assertEqual(self.cacheSize('200'), 200 * 1024 * 1024)
+
+    def testInvalidCacheSize(self):
+        for size in ['', 'abc', '1.5', '0', '-5']:
+            self.assertEqual(self.cacheSize(size), 1024 * 1024 * 1024, size)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,526 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Webcamoid, webcam capture application.
+# Copyright (C) 2017  Gonzalo Exequiel Pedone
+#
+# Webcamoid is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Webcamoid is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Webcamoid. If not, see <http://www.gnu.org/licenses/>.
+#
+# Web-Site: http://webcamoid.github.io/
+
+import os
+import shutil
+import struct
+import subprocess # nosec
+import sys
+import tempfile
+import time
+import unittest
+
+import tools.binary_elf
+
+
+LDCACHE_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'fixtures',
+                                'ldcache')
+
+OLD_CACHE = {('libold.so.5', 0x0300): ['/lib64/libold.so.5'],
+             ('libold.so.5', 0x0000): ['/lib/libold.so.5']}
+
+NEW_CACHE = {('libbar.so.2', 0x0300): ['/usr/lib/x86_64-linux-gnu/libbar.so.2'],
+             ('libfoo.so.1', 0x0a00): ['/usr/lib/aarch64-linux-gnu/libfoo.so.1'],
+             ('libfoo.so.1', 0x0300): ['/usr/lib/x86_64-linux-gnu/libfoo.so.1'],
+             ('libfoo.so.1', 0x0000): ['/usr/lib/i386-linux-gnu/libfoo.so.1']}
+
+
+def sectionNames(binary, data):
+    header = binary.readElfHeader(data)
+    sections = binary.readSections(data, header)
+    shstrtab = sections[header['shstrndx']][4]
+
+    return [binary.readString(data, shstrtab + section[0])
+            for section in sections[1:]]
+
+def allocatedSections(binary, data):
+    # Returns the contents of the sections loaded in memory.
+    SHF_ALLOC = 0x2
+    SHT_NOBITS = 8
+
+    header = binary.readElfHeader(data)
+    sections = binary.readSections(data, header)
+    shstrtab = sections[header['shstrndx']][4]
+
+    return {binary.readString(data, shstrtab + section[0]):
+                bytes(data[section[4]: section[4] + section[5]])
+            for section in sections
+            if section[2] & SHF_ALLOC and section[1] != SHT_NOBITS}
+
+def writeElfHeader(path, machine):
+    # Only the header is read for checking the machine of the libraries.
+    with open(path, 'wb') as f:
+        f.write(b'\x7fELF\x02\x01\x01'.ljust(0x10, b'\x00')
+                + struct.pack('<HH', 3, machine))
+
+def run(*args, cwd=None):
+    subprocess.run(args, # nosec
+                   cwd=cwd,
+                   stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL,
+                   check=True)
+
+def legacyDump(binary):
+    # The ELF reader used before dump() was ported to mmap, it reads the
+    # section headers with seek() and read() calls. It's kept here to check
+    # the current reader against it.
+    SHT_STRTAB = 0x3
+    SHT_DYNAMIC = 0x6
+    DT_NULL = 0
+    DT_NEEDED = 1
+    DT_RPATH = 15
+    DT_RUNPATH = 0x1d
+
+    def readString(f):
+        s = b''
+
+        while True:
+            c = f.read(1)
+
+            if c in [b'\x00', b'']:
+                break
+
+            s += c
+
+        return s
+
+    def readNumber(f, is32):
+        return struct.unpack('I' if is32 else 'Q', f.read(4 if is32 else 8))[0]
+
+    with open(binary, 'rb') as f:
+        if f.read(4) != b'\x7fELF':
+            return {}
+
+        is32 = struct.unpack('B', f.read(1))[0] == 1
+        f.seek(0x12, os.SEEK_SET)
+        machine = struct.unpack('H', f.read(2))[0]
+        f.seek(0x20 if is32 else 0x28, os.SEEK_SET)
+        sectionHeaderTable = readNumber(f, is32)
+        f.seek(0x30 if is32 else 0x3c, os.SEEK_SET)
+        nSections = struct.unpack('H', f.read(2))[0]
+        shstrtabIndex = struct.unpack('H', f.read(2))[0]
+        f.seek(sectionHeaderTable, os.SEEK_SET)
+        entries = {DT_NEEDED: [], DT_RPATH: [], DT_RUNPATH: []}
+        strtabs = []
+        shstrtab = []
+
+        for section in range(nSections):
+            sectionStart = f.tell()
+            sectionName = struct.unpack('I', f.read(4))[0]
+            sectionType = struct.unpack('I', f.read(4))[0]
+            f.seek(sectionStart + (0x0c if is32 else 0x10), os.SEEK_SET)
+            shAddr = readNumber(f, is32)
+            shOffset = readNumber(f, is32)
+            f.seek(shOffset, os.SEEK_SET)
+
+            if sectionType == SHT_DYNAMIC:
+                while True:
+                    dTag, dVal = struct.unpack('iI' if is32 else 'qQ',
+                                               f.read(8 if is32 else 16))
+
+                    if dTag == DT_NULL:
+                        break
+
+                    if dTag in entries:
+                        entries[dTag].append(dVal)
+            elif sectionType == SHT_STRTAB:
+                if section == shstrtabIndex:
+                    shstrtab = [shAddr, shOffset]
+                else:
+                    strtabs += [[sectionName, shAddr, shOffset]]
+
+            f.seek(sectionStart + (0x28 if is32 else 0x40), os.SEEK_SET)
+
+        strtab = []
+
+        for tab in strtabs:
+            f.seek(tab[0] - shstrtab[0] + shstrtab[1], os.SEEK_SET)
+
+            if readString(f) == b'.dynstr':
+                strtab = tab
+
+        def readStrings(tag):
+            strings = set()
+
+            for ptr in entries[tag]:
+                f.seek(ptr + strtab[2], os.SEEK_SET)
+                strings.add(readString(f).decode(sys.getdefaultencoding()))
+
+            return strings
+
+        return {'machine': machine,
+                'imports': readStrings(DT_NEEDED),
+                'rpath': readStrings(DT_RPATH),
+                'runpath': readStrings(DT_RUNPATH)}
+
+def systemElfFiles(limit=200):
+    # Returns the ELF files found in the system library and binary
+    # directories.
+    binary = tools.binary_elf.DeployToolsBinary()
+    files = [os.path.realpath(sys.executable)]
+
+    for libdir in ['/usr/lib/x86_64-linux-gnu',
+                   '/usr/lib/aarch64-linux-gnu',
+                   '/usr/lib64',
+                   '/usr/lib',
+                   '/usr/bin']:
+        try:
+            names = sorted(os.listdir(libdir))
+        except:
+            continue
+
+        for name in names:
+            path = os.path.join(libdir, name)
+
+            if len(files) >= limit:
+                return files
+
+            if os.path.islink(path) or not os.path.isfile(path):
+                continue
+
+            try:
+                if binary.isValid(path):
+                    files.append(path)
+            except:
+                pass
+
+    return files
+
+
+@unittest.skipUnless(shutil.which('gcc')
+                     and shutil.which('strip')
+                     and shutil.which('ar'),
+                     'GNU toolchain not found')
+class TestStrip(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.binary = tools.binary_elf.DeployToolsBinary()
+        cls.tempDir = tempfile.mkdtemp()
+
+        with open(os.path.join(cls.tempDir, 'main.c'), 'w') as f:
+            f.write('#include <stdio.h>\n'
+                    'int main() { puts("stripped"); return 0; }\n')
+
+        with open(os.path.join(cls.tempDir, 'lib.c'), 'w') as f:
+            f.write('int inc(int x) { return x + 1; }\n')
+
+        run('gcc', '-g', '-o', 'main', 'main.c', cwd=cls.tempDir)
+        run('gcc', '-g', '-shared', '-fPIC', '-o', 'lib.so', 'lib.c', cwd=cls.tempDir)
+        run('gcc', '-g', '-c', 'lib.c', cwd=cls.tempDir)
+        run('ar', 'rcs', 'lib.a', 'lib.o', cwd=cls.tempDir)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tempDir, True)
+
+    def path(self, name):
+        return os.path.join(self.tempDir, name)
+
+    def gnuStrip(self, name):
+        # GNU strip keeps the comments, stripData() removes them too.
+        path = self.path(name + '.gnu')
+        shutil.copy(self.path(name), path)
+        run('strip', '--strip-all', '-R', '.comment', path)
+
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def checkStrip(self, name):
+        with open(self.path(name), 'rb') as f:
+            data = f.read()
+
+        stripped = self.binary.stripData(data)
+        self.assertIsNotNone(stripped)
+        self.assertEqual(sectionNames(self.binary, stripped),
+                         sectionNames(self.binary, self.gnuStrip(name)))
+
+        # The loaded contents of the binary must not change.
+        self.assertEqual(allocatedSections(self.binary, stripped),
+                         allocatedSections(self.binary, data))
+
+        return stripped
+
+    def testExecutable(self):
+        stripped = self.checkStrip('main')
+        path = self.path('main.stripped')
+
+        with open(path, 'wb') as f:
+            f.write(stripped)
+
+        os.chmod(path, 0o755)
+        output = subprocess.run([path], # nosec
+                                stdout=subprocess.PIPE,
+                                check=True).stdout
+        self.assertEqual(output, b'stripped\n')
+
+    def testSharedObject(self):
+        self.checkStrip('lib.so')
+
+    def testStaticArchive(self):
+        # Archives are not handled in process, these go to the strip tool.
+        with open(self.path('lib.a'), 'rb') as f:
+            self.assertIsNone(self.binary.stripData(f.read()))
+
+        shutil.copy(self.path('lib.a'), self.path('lib.a.tool'))
+        self.binary.strip(self.path('lib.a.tool'))
+        members = {}
+
+        for archive in ['lib.a.tool', 'lib.a.gnu']:
+            if archive == 'lib.a.gnu':
+                shutil.copy(self.path('lib.a'), self.path(archive))
+                run('strip', '--strip-all', self.path(archive))
+
+            outDir = self.path(archive + '.d')
+            os.makedirs(outDir)
+            run('ar', 'x', self.path(archive), cwd=outDir)
+
+            with open(os.path.join(outDir, 'lib.o'), 'rb') as f:
+                members[archive] = sectionNames(self.binary, f.read())
+
+        self.assertEqual(members['lib.a.tool'], members['lib.a.gnu'])
+
+    def testIsStripped(self):
+        self.assertFalse(self.binary.isStripped(self.path('main')))
+        path = self.path('main.isstripped')
+
+        with open(path, 'wb') as f:
+            f.write(self.checkStrip('main'))
+
+        self.assertTrue(self.binary.isStripped(path))
+
+    def testCompressedDebugSections(self):
+        # A binary without the symbols table must not be reported as
+        # stripped if it still has compressed debug information.
+        path = self.path('main.zdebug')
+
+        with open(path, 'wb') as f:
+            f.write(self.checkStrip('main'))
+
+        with open(self.path('zdebug_info'), 'wb') as f:
+            f.write(b'ZLIB' + bytes(60))
+
+        try:
+            run('objcopy',
+                '--add-section', '.zdebug_info=' + self.path('zdebug_info'),
+                path)
+        except:
+            self.skipTest('objcopy not found')
+
+        self.assertFalse(self.binary.isStripped(path))
+        self.binary.strip(path)
+        self.assertTrue(self.binary.isStripped(path))
+
+        with open(path, 'rb') as f:
+            self.assertNotIn('.zdebug_info', sectionNames(self.binary, f.read()))
+
+
+class TestLdCache(unittest.TestCase):
+    def setUp(self):
+        self.binary = tools.binary_elf.DeployToolsBinary()
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir, True)
+
+    def readCache(self, name):
+        return self.binary.readLdCache(os.path.join(LDCACHE_FIXTURES, name))
+
+    def readCacheData(self, data):
+        path = os.path.join(self.tempDir, 'ld.so.cache')
+
+        with open(path, 'wb') as f:
+            f.write(data)
+
+        return self.binary.readLdCache(path)
+
+    def testOldFormat(self):
+        self.assertEqual(self.readCache('old.cache'), OLD_CACHE)
+
+    def testNewFormat(self):
+        # The libraries in glibc-hwcaps are skipped.
+        self.assertEqual(self.readCache('new.cache'), NEW_CACHE)
+
+    def testCombinedFormat(self):
+        # The new format contains all the entries of the old one.
+        cache = dict(OLD_CACHE)
+        cache.update(NEW_CACHE)
+        self.assertEqual(self.readCache('combined.cache'), cache)
+
+    def testMissing(self):
+        self.assertEqual(self.readCache('missing.cache'), {})
+
+    def testArchFilter(self):
+        self.binary.ldCache = self.readCache('new.cache')
+
+        # x86_64
+        self.assertEqual(self.binary.ldCacheCandidates('libfoo.so.1', 62),
+                         ['/usr/lib/x86_64-linux-gnu/libfoo.so.1'])
+        self.assertEqual(self.binary.ldCacheCandidates('libbar.so.2', 62),
+                         ['/usr/lib/x86_64-linux-gnu/libbar.so.2'])
+
+        # i386
+        self.assertEqual(self.binary.ldCacheCandidates('libfoo.so.1', 3),
+                         ['/usr/lib/i386-linux-gnu/libfoo.so.1'])
+        self.assertEqual(self.binary.ldCacheCandidates('libbar.so.2', 3), [])
+
+        # AArch64
+        self.assertEqual(self.binary.ldCacheCandidates('libfoo.so.1', 183),
+                         ['/usr/lib/aarch64-linux-gnu/libfoo.so.1'])
+
+        # Machines without flags get the libraries of any architecture.
+        self.assertEqual(sorted(self.binary.ldCacheCandidates('libfoo.so.1', 40)),
+                         ['/usr/lib/aarch64-linux-gnu/libfoo.so.1',
+                          '/usr/lib/i386-linux-gnu/libfoo.so.1',
+                          '/usr/lib/x86_64-linux-gnu/libfoo.so.1'])
+
+    def testCorrupt(self):
+        for name in ['old.cache', 'new.cache', 'combined.cache']:
+            with open(os.path.join(LDCACHE_FIXTURES, name), 'rb') as f:
+                data = f.read()
+
+            # Truncated entries.
+            self.assertEqual(self.readCacheData(data[: 40]), {}, name)
+
+            # The last string is not terminated.
+            self.assertEqual(self.readCacheData(data[: -1]), {}, name)
+
+            # The number of entries goes beyond the end of the file.
+            corrupt = bytearray(data)
+            offset = data.find(b'glibc-ld.so.cache1.1')
+            struct.pack_into('I', corrupt, 20 + offset if offset >= 0 else 12, 1000)
+            self.assertEqual(self.readCacheData(corrupt), {}, name)
+
+        self.assertEqual(self.readCacheData(b''), {})
+        self.assertEqual(self.readCacheData(b'not a cache file'), {})
+
+        # The soname of the second entry is out of the file, the first one
+        # is skipped.
+        with open(os.path.join(LDCACHE_FIXTURES, 'new.cache'), 'rb') as f:
+            corrupt = bytearray(f.read())
+
+        struct.pack_into('I', corrupt, 48 + 24 + 4, len(corrupt))
+        self.assertEqual(self.readCacheData(corrupt), {})
+
+    def testFallback(self):
+        # Without cache the libraries are searched in the directories.
+        libDir = os.path.join(self.tempDir, 'lib')
+        os.makedirs(libDir)
+        lib = os.path.join(libDir, 'libfoo.so.1')
+        writeElfHeader(lib, 62)
+
+        with open(os.path.join(LDCACHE_FIXTURES, 'new.cache'), 'rb') as f:
+            self.binary.ldCache = self.readCacheData(f.read()[: 100])
+
+        self.binary.ldLibraryPath = []
+        self.binary.libsSeachPaths = [libDir]
+        self.assertEqual(self.binary.ldCache, {})
+        self.assertEqual(self.binary.libPath('libfoo.so.1', 62, [], []), lib)
+
+
+class TestLibPath(unittest.TestCase):
+    def setUp(self):
+        self.binary = tools.binary_elf.DeployToolsBinary()
+        self.binary.ldCache = {}
+        self.binary.ldLibraryPath = []
+        self.tempDir = tempfile.mkdtemp()
+        self.systemDir = os.path.join(self.tempDir, 'system')
+        self.rpathDir = os.path.join(self.tempDir, 'rpath')
+        os.makedirs(self.systemDir)
+        os.makedirs(self.rpathDir)
+        self.binary.libsSeachPaths = [self.systemDir]
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir, True)
+
+    def deploy(self, lib):
+        # Copy a library to the RPATH, as the deploy does.
+        path = os.path.join(self.rpathDir, lib)
+        mtime = os.stat(self.rpathDir).st_mtime_ns
+        writeElfHeader(path, 62)
+
+        # Don't depend on the resolution of the file system timestamps.
+        os.utime(self.rpathDir, ns=(mtime + 1000000, mtime + 1000000))
+
+        return path
+
+    def testDeployedToRpath(self):
+        self.assertEqual(self.binary.libPath('libfoo.so.1', 62, [self.rpathDir], []), '')
+        lib = self.deploy('libfoo.so.1')
+        self.assertEqual(self.binary.libPath('libfoo.so.1', 62, [self.rpathDir], []), lib)
+
+    def testRpathOverridesSystem(self):
+        systemLib = os.path.join(self.systemDir, 'libbar.so.2')
+        writeElfHeader(systemLib, 62)
+        self.assertEqual(self.binary.libPath('libbar.so.2', 62, [self.rpathDir], []),
+                         systemLib)
+        lib = self.deploy('libbar.so.2')
+        self.assertEqual(self.binary.libPath('libbar.so.2', 62, [self.rpathDir], []), lib)
+        self.assertEqual(self.binary.libPath('libbar.so.2', 62, [], [self.rpathDir]), lib)
+
+
+class TestDump(unittest.TestCase):
+    def setUp(self):
+        self.binary = tools.binary_elf.DeployToolsBinary()
+
+    def testSameAsLegacyReader(self):
+        checked = 0
+
+        for path in systemElfFiles():
+            try:
+                expected = legacyDump(path)
+            except:
+                # The legacy reader fails with the binaries without section
+                # headers or .dynstr, only the current one reads these.
+                continue
+
+            if len(expected['imports']) < 1:
+                continue
+
+            self.assertEqual(self.binary.dumpBinary(path), expected, path)
+            checked += 1
+
+        if checked < 1:
+            self.skipTest('No dynamic ELF files found in the system')
+
+    @unittest.skipUnless(os.environ.get('DEPLOY_BENCHMARKS') == '1',
+                         'set DEPLOY_BENCHMARKS=1 to run the benchmarks')
+    def testBenchmark(self):
+        files = systemElfFiles(1000)
+        times = []
+
+        for dump in [legacyDump, self.binary.dumpBinary]:
+            start = time.perf_counter()
+
+            for path in files:
+                try:
+                    dump(path)
+                except:
+                    pass
+
+            times.append(time.perf_counter() - start)
+
+        print('\n{} ELF files: legacy reader {:.3f} s, '
+              'mmap reader {:.3f} s'.format(len(files), *times))
+
+
+if __name__ == '__main__':
+    unittest.main()
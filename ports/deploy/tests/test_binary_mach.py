@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Webcamoid, webcam capture application.
+# Copyright (C) 2017  Gonzalo Exequiel Pedone
+#
+# Webcamoid is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Webcamoid is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Webcamoid. If not, see <http://www.gnu.org/licenses/>.
+#
+# Web-Site: http://webcamoid.github.io/
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import unittest.mock
+
+import deploy_mac
+import tools.binary_mach
+
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'fixtures',
+                        'mach')
+
+THIN_INFO = {'imports': ['/usr/local/lib/libbar.1.dylib',
+                         '/usr/lib/libSystem.B.dylib'],
+             'rpaths': ['/usr/local/lib'],
+             'id': '/usr/local/lib/libfoo.1.dylib'}
+
+ARM64_INFO = {'imports': ['/opt/homebrew/lib/libbar.1.dylib',
+                          '/usr/lib/libSystem.B.dylib'],
+              'rpaths': ['/opt/homebrew/lib'],
+              'id': '/opt/homebrew/lib/libfoo.1.dylib'}
+
+
+def fixture(name):
+    return os.path.join(FIXTURES, name)
+
+
+class TestDump(unittest.TestCase):
+    def setUp(self):
+        self.binary = tools.binary_mach.DeployToolsBinary()
+        self.binary.targetCpuType = self.binary.cpuTypes['x86_64']
+        self.binary.targetArch = '64bit'
+
+    def testThin(self):
+        self.assertTrue(self.binary.isValid(fixture('thin.dylib')))
+        self.assertEqual(self.binary.dumpBinary(fixture('thin.dylib')), THIN_INFO)
+
+    def testThinBigEndian(self):
+        self.assertTrue(self.binary.isValid(fixture('thin-be32.dylib')))
+        self.assertEqual(self.binary.dumpBinary(fixture('thin-be32.dylib')),
+                         {'imports': ['/usr/lib/libSystem.B.dylib'],
+                          'rpaths': ['@loader_path/../lib'],
+                          'id': '/usr/local/lib/libfoo.1.dylib'})
+
+    def testFat(self):
+        self.assertTrue(self.binary.isValid(fixture('fat.dylib')))
+
+        with open(fixture('fat.dylib'), 'rb') as f:
+            data = f.read()
+
+        self.assertTrue(self.binary.isFat(data[: 8]))
+        self.assertEqual(self.binary.readFatArchs(data),
+                         [(self.binary.cpuTypes['x86_64'], 0x1000, 0x1010),
+                          (self.binary.cpuTypes['arm64'], 0x3000, 0x1010)])
+        self.assertEqual(self.binary.dumpBinary(fixture('fat.dylib')), THIN_INFO)
+
+        self.binary.targetCpuType = self.binary.cpuTypes['arm64']
+        self.assertEqual(self.binary.dumpBinary(fixture('fat.dylib')), ARM64_INFO)
+
+    def testSelectFatArch(self):
+        x86_64 = (self.binary.cpuTypes['x86_64'], 0x1000, 0x1010)
+        arm64 = (self.binary.cpuTypes['arm64'], 0x3000, 0x1010)
+        i386 = (self.binary.cpuTypes['i386'], 0x5000, 0x1010)
+
+        self.binary.targetCpuType = self.binary.cpuTypes['arm64']
+        self.assertEqual(self.binary.selectFatArch([x86_64, arm64]), arm64)
+
+        # Without a slice for the CPU, pick one with the same word size.
+        self.binary.targetCpuType = self.binary.cpuTypes['ppc']
+        self.assertEqual(self.binary.selectFatArch([i386, arm64, x86_64]), arm64)
+
+        self.binary.targetArch = '32bit'
+        self.assertEqual(self.binary.selectFatArch([x86_64, i386]), i386)
+        self.assertEqual(self.binary.selectFatArch([x86_64, arm64]), x86_64)
+        self.assertIsNone(self.binary.selectFatArch([]))
+
+    def testFatWithoutTargetSlice(self):
+        self.assertEqual(self.binary.dumpBinary(fixture('fat-i386.dylib')),
+                         {'imports': ['/usr/lib/libSystem.B.dylib'],
+                          'rpaths': [],
+                          'id': '/usr/local/lib/libfoo.1.dylib'})
+
+    def testJavaClass(self):
+        with open(fixture('java.class'), 'rb') as f:
+            self.assertFalse(self.binary.isFat(f.read(8)))
+
+        self.assertFalse(self.binary.isValid(fixture('java.class')))
+        self.assertEqual(self.binary.dumpBinary(fixture('java.class')), {})
+
+
+class TestRewrite(unittest.TestCase):
+    def setUp(self):
+        self.binary = tools.binary_mach.DeployToolsBinary()
+        self.binary.targetCpuType = self.binary.cpuTypes['x86_64']
+        self.binary.targetArch = '64bit'
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir, True)
+
+    def copyFixture(self, name, dst=''):
+        path = os.path.join(self.tempDir, dst if len(dst) > 0 else name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copy(fixture(name), path)
+
+        return path
+
+    @staticmethod
+    def read(path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def testRewriteThin(self):
+        path = self.copyFixture('thin.dylib')
+        self.assertTrue(self.binary.rewriteLoadCommands(path,
+                                                        ['/usr/local/lib'],
+                                                        ['@executable_path/../Frameworks'],
+                                                        '@rpath/libfoo.1.dylib',
+                                                        {'/usr/local/lib/libbar.1.dylib':
+                                                            '@rpath/libbar.1.dylib'}))
+        self.assertEqual(self.binary.dumpBinary(path),
+                         {'imports': ['@rpath/libbar.1.dylib',
+                                      '/usr/lib/libSystem.B.dylib'],
+                          'rpaths': ['@executable_path/../Frameworks'],
+                          'id': '@rpath/libfoo.1.dylib'})
+
+        # Only the load commands change.
+        original = self.read(fixture('thin.dylib'))
+        rewritten = self.read(path)
+        self.assertEqual(len(rewritten), len(original))
+        self.assertEqual(rewritten[0x1000:], original[0x1000:])
+
+    def testRewriteFat(self):
+        path = self.copyFixture('fat.dylib')
+        self.assertTrue(self.binary.rewriteLoadCommands(path,
+                                                        ['/usr/local/lib', '/opt/homebrew/lib'],
+                                                        ['@executable_path/../Frameworks'],
+                                                        '@rpath/libfoo.1.dylib',
+                                                        {'/usr/local/lib/libbar.1.dylib':
+                                                            '@rpath/libbar.1.dylib',
+                                                         '/opt/homebrew/lib/libbar.1.dylib':
+                                                            '@rpath/libbar.1.dylib'}))
+        expected = {'imports': ['@rpath/libbar.1.dylib',
+                                '/usr/lib/libSystem.B.dylib'],
+                    'rpaths': ['@executable_path/../Frameworks'],
+                    'id': '@rpath/libfoo.1.dylib'}
+
+        for cpu in ['x86_64', 'arm64']:
+            self.binary.targetCpuType = self.binary.cpuTypes[cpu]
+            self.assertEqual(self.binary.dumpBinary(path), expected)
+
+    def testNoRoom(self):
+        # There is no padding after the load commands, a new rpath doesn't
+        # fit and the file must be left as is.
+        path = self.copyFixture('noroom.dylib')
+        self.assertFalse(self.binary.rewriteLoadCommands(path,
+                                                         [],
+                                                         ['@executable_path/../Frameworks'],
+                                                         '',
+                                                         {}))
+        self.assertEqual(self.read(path), self.read(fixture('noroom.dylib')))
+
+        # Removing commands always fits.
+        self.assertTrue(self.binary.rewriteLoadCommands(path,
+                                                        ['/usr/local/lib'],
+                                                        [],
+                                                        '',
+                                                        {}))
+        self.assertEqual(self.binary.dumpBinary(path)['rpaths'], [])
+
+    def testCodeSignature(self):
+        deploy = deploy_mac.Deploy.__new__(deploy_mac.Deploy)
+        deploy.binarySolver = self.binary
+        deploy.binaryInstallDir = os.path.join(self.tempDir, 'MacOS')
+        deploy.libInstallDir = os.path.join(self.tempDir, 'Frameworks')
+        path = self.copyFixture('signed.dylib', 'Frameworks/libfoo.1.dylib')
+
+        self.assertFalse(self.binary.rewriteLoadCommands(path,
+                                                         [],
+                                                         [],
+                                                         '@rpath/libfoo.1.dylib',
+                                                         {}))
+        self.assertEqual(self.read(path), self.read(fixture('signed.dylib')))
+
+        # Signed binaries are handed to install_name_tool.
+        with unittest.mock.patch.object(deploy_mac.Deploy,
+                                        'runInstallNameTool') as runInstallNameTool, \
+             unittest.mock.patch('builtins.print'):
+            deploy.fixLibRpath(threading.Lock(), path)
+
+        rpath = '@executable_path/../Frameworks'
+        runInstallNameTool.assert_called_once_with(path,
+                                                   [],
+                                                   [],
+                                                   rpath + '/libfoo.1.dylib',
+                                                   {'/usr/local/lib/libbar.1.dylib':
+                                                        rpath + '/libbar.1.dylib',
+                                                    '/usr/lib/libSystem.B.dylib':
+                                                        rpath + '/libSystem.B.dylib'})
+        self.assertEqual(self.read(path), self.read(fixture('signed.dylib')))
+
+
+class TestDylibPath(unittest.TestCase):
+    def setUp(self):
+        self.binary = tools.binary_mach.DeployToolsBinary()
+        self.tempDir = tempfile.mkdtemp()
+        self.libDir = os.path.join(self.tempDir, 'lib')
+        os.makedirs(self.libDir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir, True)
+
+    def testLibraryCopiedLater(self):
+        # A library that wasn't found must be found once it's copied to
+        # the searched directories.
+        with unittest.mock.patch.dict(os.environ, {}, clear=True):
+            self.assertEqual(self.binary.dylibPath('@rpath/libfoo.dylib',
+                                                   self.tempDir,
+                                                   [self.libDir]),
+                             '')
+            lib = os.path.join(self.libDir, 'libfoo.dylib')
+            open(lib, 'w').close()
+            self.assertEqual(self.binary.dylibPath('@rpath/libfoo.dylib',
+                                                   self.tempDir,
+                                                   [self.libDir]),
+                             os.path.join(os.path.realpath(self.libDir),
+                                          'libfoo.dylib'))
+
+
+if __name__ == '__main__':
+    unittest.main()
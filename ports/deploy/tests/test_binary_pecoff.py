@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Webcamoid, webcam capture application.
+# Copyright (C) 2017  Gonzalo Exequiel Pedone
+#
+# Webcamoid is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Webcamoid is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Webcamoid. If not, see <http://www.gnu.org/licenses/>.
+#
+# Web-Site: http://webcamoid.github.io/
+
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+import tools.binary_pecoff
+
+
+EXCLUDE_LIST = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            'exclude.nt.win32.txt')
+
+
+class TestResolveImports(unittest.TestCase):
+    def setUp(self):
+        self.binary = tools.binary_pecoff.DeployToolsBinary()
+        self.binary.targetSystem = 'posix_windows'
+        self.binary.readSystemDllsList(EXCLUDE_LIST)
+        self.tempDir = tempfile.mkdtemp()
+        self.binary.sysBinsPath = [self.tempDir]
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir, True)
+
+    def testUnresolved(self):
+        # The system DLLs are not reported as unresolved, no matter the
+        # case of the name.
+        imports = {'KERNEL32.dll',
+                   'User32.DLL',
+                   'advapi32.dll',
+                   'api-ms-win-crt-runtime-l1-1-0.dll',
+                   'Qt5Core.dll',
+                   'libfoo.dll'}
+        open(os.path.join(self.tempDir, 'qt5core.dll'), 'w').close()
+
+        with unittest.mock.patch.object(self.binary, 'dump', return_value=imports):
+            deps = self.binary.resolveImports(os.path.join(self.tempDir, 'main.exe'))
+
+        self.assertEqual(sorted(deps),
+                         [('Qt5Core.dll', os.path.join(self.tempDir, 'qt5core.dll')),
+                          ('libfoo.dll', '')])
+
+    def testSystemDllNames(self):
+        self.assertTrue(self.binary.isSystemDll('KERNEL32.dll'))
+        self.assertFalse(self.binary.isSystemDll('kernel32xdll'))
+        self.assertFalse(self.binary.isSystemDll('libkernel32.dll'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Webcamoid, webcam capture application.
+# Copyright (C) 2017  Gonzalo Exequiel Pedone
+#
+# Webcamoid is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Webcamoid is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Webcamoid. If not, see <http://www.gnu.org/licenses/>.
+#
+# Web-Site: http://webcamoid.github.io/
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import tools.depgraph
+
+
+class TestReuse(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.libDir = os.path.join(self.tempDir, 'lib')
+        os.makedirs(self.libDir)
+        self.binary = self.writeFile(os.path.join(self.tempDir, 'app'), b'app')
+        self.lib = self.writeFile(os.path.join(self.libDir, 'libfoo.so'), b'foo')
+        self.manifest = os.path.join(self.tempDir, 'deploy-manifest.json')
+        graph = tools.depgraph.DependencyGraph()
+        graph.setDependencies(self.binary,
+                              [('libfoo.so', self.lib), ('libbar.so', '')],
+                              [self.libDir])
+        graph.save(self.manifest)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir, True)
+
+    @staticmethod
+    def writeFile(path, data):
+        with open(path, 'wb') as f:
+            f.write(data)
+
+        return path
+
+    def loadGraph(self):
+        graph = tools.depgraph.DependencyGraph()
+        self.assertTrue(graph.load(self.manifest))
+
+        return graph
+
+    def shiftMtime(self, path):
+        mtime = os.stat(path).st_mtime_ns + 1000000000
+        os.utime(path, ns=(mtime, mtime))
+
+    def testUnchanged(self):
+        graph = self.loadGraph()
+        self.assertTrue(graph.isSolved(self.binary))
+        self.assertEqual(graph.dependencies(self.binary), [self.lib])
+
+    def testDependencyReplaced(self):
+        self.writeFile(self.lib, b'foobar')
+        self.assertFalse(self.loadGraph().isSolved(self.binary))
+
+    def testSearchDirChanged(self):
+        self.writeFile(os.path.join(self.libDir, 'libbar.so'), b'bar')
+        self.shiftMtime(self.libDir)
+        self.assertFalse(self.loadGraph().isSolved(self.binary))
+
+
+if __name__ == '__main__':
+    unittest.main()
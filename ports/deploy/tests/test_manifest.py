@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Webcamoid, webcam capture application.
+# Copyright (C) 2017  Gonzalo Exequiel Pedone
+#
+# Webcamoid is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Webcamoid is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Webcamoid. If not, see <http://www.gnu.org/licenses/>.
+#
+# Web-Site: http://webcamoid.github.io/
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import tools.manifest
+import tools.utils
+
+
+class TestRecord(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.rootDir = os.path.join(self.tempDir, 'root')
+        self.sysDir = os.path.join(self.tempDir, 'sys')
+        self.writeFile(os.path.join(self.rootDir, 'bin', 'app'), 'app')
+        os.makedirs(os.path.join(self.rootDir, 'share', 'empty'))
+        self.writeFile(os.path.join(self.sysDir, 'plugins', 'x', 'libx.so'), 'x')
+        self.writeFile(os.path.join(self.sysDir, 'libfoo.so'), 'foo')
+        self.utils = tools.utils.DeployToolsUtils()
+        self.manifest = tools.manifest.StagingManifest(self.rootDir)
+        self.utils.stagingManifest = self.manifest
+        self.manifest.recordTree()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir, True)
+
+    @staticmethod
+    def writeFile(path, data):
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        with open(path, 'w') as f:
+            f.write(data)
+
+    def testCopiedFiles(self):
+        self.utils.copy(os.path.join(self.sysDir, 'plugins'),
+                        os.path.join(self.rootDir, 'plugins'))
+        self.utils.copy(os.path.join(self.sysDir, 'libfoo.so'),
+                        os.path.join(self.rootDir, 'lib', 'libfoo.so'))
+        self.manifest.refresh()
+        origins = {entry['path']: entry['origin'] for entry in self.manifest.files()}
+        self.assertEqual(origins,
+                         {os.path.join('bin', 'app'): '',
+                          os.path.join('lib', 'libfoo.so'): os.path.join(self.sysDir, 'libfoo.so'),
+                          os.path.join('plugins', 'x', 'libx.so'): os.path.join(self.sysDir, 'plugins', 'x', 'libx.so')})
+        self.assertEqual(self.manifest.directories,
+                         ['bin', 'lib', 'plugins', os.path.join('plugins', 'x'),
+                          'share', os.path.join('share', 'empty')])
+        self.assertTrue(self.manifest.hasOrigin(os.path.join(self.sysDir, 'plugins')))
+        self.assertFalse(self.manifest.hasOrigin(os.path.join(self.sysDir, 'plugin')))
+
+    def testMovedFile(self):
+        lib = os.path.join(self.rootDir, 'lib', 'libfoo.so')
+        self.utils.copy(os.path.join(self.sysDir, 'libfoo.so'), lib)
+        self.utils.move(lib, os.path.join(self.rootDir, 'libs', 'libfoo.so'))
+        self.manifest.refresh()
+        entry = self.manifest.entries[os.path.join('libs', 'libfoo.so')]
+        self.assertEqual(entry['origin'], os.path.join(self.sysDir, 'libfoo.so'))
+        self.assertFalse(os.path.join('lib', 'libfoo.so') in self.manifest.entries)
+
+    def testModifiedAndRemovedFiles(self):
+        app = os.path.join(self.rootDir, 'bin', 'app')
+        self.writeFile(app, 'stripped')
+        self.manifest.refresh()
+        entry = self.manifest.entries[os.path.join('bin', 'app')]
+        self.assertEqual(entry['size'], len('stripped'))
+        self.assertEqual(entry['hash'], tools.utils.DeployToolsUtils.sha256sum(app))
+        os.remove(app)
+        self.manifest.refresh()
+        self.assertEqual(self.manifest.entries, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -19,10 +19,13 @@
 #
 # Web-Site: http://webcamoid.github.io/
 
+import concurrent.futures
 import os
 import shutil
+import time
 import xml.etree.ElementTree as ET
 
+import tools.copybackend
 import tools.utils
 
 
@@ -98,6 +101,9 @@ class AndroidTools(tools.utils.DeployToolsUtils):
         return []
 
     def fixQtLibs(self):
+        start = time.time()
+        libs = []
+
         for root, dirs, files in os.walk(self.assetsIntallDir):
             for f in files:
                 if f.endswith('.so'):
@@ -113,9 +119,21 @@ class AndroidTools(tools.utils.DeployToolsUtils):
 
                     dstPath = os.path.join(self.libInstallDir, lib)
                     print('    {} -> {}'.format(srcPath, dstPath))
-                    self.move(srcPath, dstPath)
+                    libs.append((srcPath, dstPath))
                     self.bundledInLib += [(lib, os.path.join(relPath, f))]
 
+        result = tools.copybackend.CopyResult()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.njobs) as executor:
+            for libResult in executor.map(lambda lib: self.move(*lib), libs):
+                result.update(libResult)
+
+        print('\n    {} libraries moved ({}) in {:.2f} s, '
+              '{} failed'.format(result.copied,
+                                 self.hrSize(result.copiedBytes),
+                                 time.time() - start,
+                                 result.failed))
+
     def libBaseName(self, lib):
         basename = os.path.basename(lib)
 
@@ -19,13 +19,18 @@
 #
 # Web-Site: http://webcamoid.github.io/
 
+import concurrent.futures
+import functools
 import os
 import re
 import subprocess # nosec
-import threading
+import sys
 import time
 
 import tools
+import tools.depgraph
+import tools.dumpcache
+import tools.stripcache
 
 
 class DeployToolsBinary(tools.utils.DeployToolsUtils):
@@ -33,28 +38,207 @@ class DeployToolsBinary(tools.utils.DeployToolsUtils):
         super().__init__()
         self.detectStrip()
         self.excludes = []
+        self.excludeRegex = None
+        self.excludeRegexSystem = ''
+        self.excludeVerdicts = functools.lru_cache(maxsize=4096)(self.matchExclude)
+        self.binaryFormat = ''
+        self.dumpCache = None
+        self.stripCache = None
+        self.depGraph = tools.depgraph.DependencyGraph()
+
+        # Files smaller than this can't be a binary of this format.
+        self.minBinarySize = 0
+
+        # Files with these extensions are never checked unless they are
+        # executable.
+        self.dataExtensions = {'.conf',
+                               '.css',
+                               '.desktop',
+                               '.h',
+                               '.html',
+                               '.icns',
+                               '.ico',
+                               '.ini',
+                               '.jpg',
+                               '.js',
+                               '.json',
+                               '.png',
+                               '.prl',
+                               '.qm',
+                               '.qml',
+                               '.qmltypes',
+                               '.qrc',
+                               '.svg',
+                               '.svgz',
+                               '.ttf',
+                               '.txt',
+                               '.xml'}
+
+        # Data files without extension.
+        self.dataNames = {'PkgInfo',
+                          'qmldir'}
 
     def isValid(self, path):
         return False
 
+    def isCandidate(self, entry):
+        try:
+            info = entry.stat(follow_symlinks=False)
+        except:
+            return False
+
+        if info.st_size < self.minBinarySize:
+            return False
+
+        if entry.name in self.dataNames:
+            return False
+
+        if info.st_mode & 0o111:
+            return True
+
+        return not os.path.splitext(entry.name)[1].lower() in self.dataExtensions
+
+    def findCandidates(self, path, candidates):
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        self.findCandidates(entry.path, candidates)
+                    elif entry.is_file(follow_symlinks=False) \
+                        and self.isCandidate(entry):
+                        candidates.append(entry.path)
+        except:
+            pass
+
     def find(self, path):
+        # Filter out the files that can't be binaries without opening them,
+        # then check the magic of the remaining ones in parallel.
+        candidates = []
+        self.findCandidates(path, candidates)
+        chunkSize = max(1, -(-len(candidates) // self.njobs))
+        chunks = [candidates[i: i + chunkSize]
+                  for i in range(0, len(candidates), chunkSize)]
         binaries = []
 
-        for root, _, files in os.walk(path):
-            for f in files:
-                binaryPath = os.path.join(root, f)
-
-                if not os.path.islink(binaryPath) and self.isValid(binaryPath):
-                    binaries.append(binaryPath)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.njobs) as executor:
+            for chunk in executor.map(self.filterValid, chunks):
+                binaries += chunk
 
         return binaries
 
+    def filterValid(self, paths):
+        return [path for path in paths if self.isValid(path)]
+
+    def openDumpCache(self, cacheFile):
+        self.closeDumpCache()
+
+        if 'NO_DEPLOY_CACHE' in os.environ \
+            and os.environ['NO_DEPLOY_CACHE'] == '1':
+            return
+
+        self.dumpCache = tools.dumpcache.DumpCache(cacheFile)
+
+    def closeDumpCache(self):
+        if self.dumpCache:
+            self.dumpCache.close()
+
+    def openStripCache(self, cacheDir):
+        self.closeStripCache()
+
+        if 'NO_DEPLOY_CACHE' in os.environ \
+            and os.environ['NO_DEPLOY_CACHE'] == '1':
+            return
+
+        if 'STRIP_CACHE_SIZE' in os.environ:
+            # The cache size is given in MiB, use the default size if the
+            # value is not valid.
+            try:
+                maxSize = int(os.environ['STRIP_CACHE_SIZE'])
+            except:
+                maxSize = 0
+
+            if maxSize > 0:
+                self.stripCache = tools.stripcache.StripCache(cacheDir,
+                                                              maxSize * 1024 * 1024)
+
+                return
+
+            print('Invalid STRIP_CACHE_SIZE value: {}, '
+                  'using the default size'.format(os.environ['STRIP_CACHE_SIZE']))
+
+        self.stripCache = tools.stripcache.StripCache(cacheDir)
+
+    def closeStripCache(self):
+        if self.stripCache:
+            self.stripCache.close()
+
+    @staticmethod
+    def formatCacheStats(name, hits, misses):
+        total = hits + misses
+        hitRate = 100 * hits / total if total > 0 else 0
+
+        return '{}: {} hits, {} misses ({:.2f}% hit rate)'.format(name,
+                                                                  hits,
+                                                                  misses,
+                                                                  hitRate)
+
+    def cacheStats(self):
+        stats = [self.depGraph.stats()]
+
+        if self.dumpCache:
+            stats.append(self.formatCacheStats('Dump cache',
+                                               self.dumpCache.hits,
+                                               self.dumpCache.misses))
+
+        if self.stripCache:
+            stats.append(self.formatCacheStats('Strip cache',
+                                               self.stripCache.hits,
+                                               self.stripCache.misses))
+
+        return stats
+
     def dump(self, binary):
+        if not self.dumpCache or not self.dumpCache.db:
+            return self.dumpBinary(binary)
+
+        info = self.dumpCache.get(self.binaryFormat, binary)
+
+        if info is None:
+            info = self.dumpBinary(binary)
+            self.dumpCache.set(self.binaryFormat, binary, info)
+
+        return info
+
+    def dumpBinary(self, binary):
         return {}
 
-    def dependencies(self, binary):
+    def resolutionContext(self):
+        return (tuple(self.excludes),)
+
+    # Returns a list of (importName, path) pairs, path is empty when the
+    # import could not be found.
+    def resolveImports(self, binary):
+        return []
+
+    # Returns the directories searched for the imports of the binary, the
+    # imports must be resolved again if any of these change.
+    def searchDirs(self, binary):
         return []
 
+    def dependencies(self, binary):
+        return [dep for _, dep in self.resolveImports(binary) if len(dep) > 0]
+
+    def unresolvedDependencies(self):
+        return self.depGraph.unresolved()
+
+    def graphDependencies(self, binary):
+        if not self.depGraph.isSolved(binary):
+            self.depGraph.setDependencies(binary,
+                                          self.resolveImports(binary),
+                                          self.searchDirs(binary))
+
+        return self.depGraph.dependencies(binary)
+
     def allDependencies(self, binary):
         deps = self.dependencies(binary)
         solved = set()
@@ -77,11 +261,38 @@ class DeployToolsBinary(tools.utils.DeployToolsUtils):
         return solved
 
     def scanDependencies(self, path):
+        # Solve the dependencies of all binaries at once, level by level, so
+        # each library is solved only once no matter how many binaries
+        # depend on it. The solved binaries are kept in the dependency graph,
+        # so next scans only solve the binaries added in between.
+        self.depGraph.setContext(self.resolutionContext())
+        solved = set()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.njobs) as executor:
+            binaries = self.find(path)
+            self.depGraph.setRoots(binaries)
+
+            while len(binaries) > 0:
+                nextBinaries = []
+
+                for deps in executor.map(self.graphDependencies, binaries):
+                    for dep in deps:
+                        if not dep in solved:
+                            solved.add(dep)
+                            nextBinaries.append(dep)
+
+                binaries = nextBinaries
+
         deps = set()
 
-        for binPath in self.find(path):
-            for dep in self.allDependencies(binPath):
-                deps.add(dep)
+        for dep in solved:
+            if self.system == 'mac':
+                i = dep.rfind('.framework/')
+
+                if i >= 0:
+                    dep = dep[: i] + '.framework'
+
+            deps.add(dep)
 
         return sorted(deps)
 
@@ -98,28 +309,101 @@ class DeployToolsBinary(tools.utils.DeployToolsUtils):
         process = subprocess.Popen([self.stripBin, binary], # nosec
                                    stdout=subprocess.PIPE,
                                    stderr=subprocess.PIPE)
-        process.communicate()
+        _, stderr = process.communicate()
 
-    def stripSymbols(self, path):
-        threads = []
+        if process.returncode != 0:
+            error = stderr.decode(sys.getdefaultencoding(), 'replace').strip()
 
-        for binary in self.find(path):
-            thread = threading.Thread(target=self.strip, args=(binary,))
-            threads.append(thread)
+            raise OSError(error if len(error) > 0 else
+                          '{} exited with code {}'.format(self.stripBin,
+                                                          process.returncode))
 
-            while threading.active_count() >= self.njobs:
-                time.sleep(0.25)
+    def isStripped(self, binary):
+        return False
 
-            thread.start()
+    def stripIdentity(self):
+        # Identifies the tool used for stripping the binaries, the cached
+        # binaries stripped by a different tool are not reused.
+        if self.stripBin == '':
+            return ''
 
-        for thread in threads:
-            thread.join()
+        try:
+            st = os.stat(self.stripBin)
+        except:
+            return self.stripBin
 
-    def readExcludeList(self, excludeList):
-        self.excludes = []
+        return '{}:{}:{}'.format(self.stripBin, st.st_size, st.st_mtime_ns)
+
+    def stripBinary(self, binary):
+        # Returns the size of the binary before and after stripping it, the
+        # time it took, and the error message if it failed. A binary that
+        # can't be stripped doesn't stop the others from being stripped.
+        start = time.time()
+
+        try:
+            size = os.path.getsize(binary)
+
+            if self.isStripped(binary):
+                return binary, size, size, 0, False, ''
+
+            key = ''
 
-        if os.path.exists(excludeList):
-            with open(excludeList) as f:
+            if self.stripCache:
+                key = self.stripCache.key(self.sha256sum(binary), self.stripIdentity())
+
+                if self.stripCache.get(key, binary):
+                    return binary, size, os.path.getsize(binary), time.time() - start, True, ''
+
+            self.strip(binary)
+
+            if len(key) > 0:
+                self.stripCache.set(key, binary)
+
+            return binary, size, os.path.getsize(binary), time.time() - start, True, ''
+        except Exception as e:
+            return binary, 0, 0, time.time() - start, False, str(e)
+
+    def stripSymbols(self, path):
+        start = time.time()
+        stripped = 0
+        skipped = 0
+        failed = 0
+        savedBytes = 0
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.njobs) as executor:
+            for binary, size, newSize, elapsed, isStripped, error in executor.map(self.stripBinary,
+                                                                                  self.find(path)):
+                if len(error) > 0:
+                    print('    {}: failed to strip: {}'.format(binary, error))
+                    failed += 1
+
+                    continue
+
+                if not isStripped:
+                    skipped += 1
+
+                    continue
+
+                print('    {}: {} -> {} ({:.2f} s)'.format(binary,
+                                                           self.hrSize(size),
+                                                           self.hrSize(newSize),
+                                                           elapsed))
+                stripped += 1
+                savedBytes += size - newSize
+
+        print('    {} binaries stripped, {} already stripped, {} failed, '
+              '{} saved in {:.2f} s'.format(stripped,
+                                            skipped,
+                                            failed,
+                                            self.hrSize(savedBytes),
+                                            time.time() - start))
+
+    @staticmethod
+    def readPatterns(patternsList):
+        patterns = []
+
+        if os.path.exists(patternsList):
+            with open(patternsList) as f:
                 for line in f:
                     line = line.strip()
 
@@ -132,18 +416,60 @@ class DeployToolsBinary(tools.utils.DeployToolsUtils):
                         line = line.strip()
 
                         if len(line) > 0:
-                            self.excludes.append(line)
+                            patterns.append(line)
+
+        return patterns
+
+    def readExcludeList(self, excludeList):
+        self.excludes = self.readPatterns(excludeList)
+        self.excludeRegex = None
+        self.excludeVerdicts.cache_clear()
+
+    def compileExcludes(self):
+        # Join all the patterns in a single regular expression.
+        #
+        # Most patterns are in the form '(.*/)*libname', the nested repetition
+        # makes the regex engine backtrack on every directory of the path, so
+        # these are grouped together behind a single '(?:.*/)?', which matches
+        # the same strings.
+        anyDir = '(.*/)*'
+        names = []
+        patterns = []
 
-    def isExcluded(self, path):
         for exclude in self.excludes:
-            if self.targetSystem == 'windows' or self.targetSystem == 'posix_windows':
-                path = path.lower().replace('\\', '/')
-                exclude = exclude.lower()
+            if exclude.startswith(anyDir) and not '|' in exclude:
+                names.append('(?:{})'.format(exclude[len(anyDir):]))
+            else:
+                patterns.append('(?:{})'.format(exclude))
 
-            if re.fullmatch(exclude, path):
-                return True
+        if len(names) > 0:
+            patterns.insert(0, '(?:.*/)?(?:{})'.format('|'.join(names)))
 
-        return False
+        if len(patterns) < 1:
+            return None
+
+        flags = 0
+
+        if self.targetSystem == 'windows' or self.targetSystem == 'posix_windows':
+            flags = re.IGNORECASE
+
+        return re.compile('|'.join(patterns), flags)
+
+    def matchExclude(self, path, targetSystem):
+        if self.excludeRegex is None or self.excludeRegexSystem != targetSystem:
+            self.excludeRegex = self.compileExcludes()
+            self.excludeRegexSystem = targetSystem
+
+        if self.excludeRegex is None:
+            return False
+
+        if targetSystem == 'windows' or targetSystem == 'posix_windows':
+            path = path.replace('\\', '/')
+
+        return self.excludeRegex.fullmatch(path) is not None
+
+    def isExcluded(self, path):
+        return self.excludeVerdicts(path, self.targetSystem)
 
     def resetFilePermissions(self, rootPath, binariesPath):
         for root, dirs, files in os.walk(rootPath):
@@ -20,10 +20,12 @@
 # Web-Site: http://webcamoid.github.io/
 
 import fnmatch
+import mmap
 import os
 import re
 import struct
 import sys
+import threading
 
 import tools.binary
 
@@ -31,6 +33,8 @@ import tools.binary
 class DeployToolsBinary(tools.binary.DeployToolsBinary):
     def __init__(self):
         super().__init__()
+        self.binaryFormat = 'elf'
+        self.minBinarySize = 0x34
         self.ldLibraryPath = os.environ['LD_LIBRARY_PATH'].split(':') if 'LD_LIBRARY_PATH' in os.environ else []
         self.libsSeachPaths = self.readLdconf() \
                             + ['/usr/lib',
@@ -39,11 +43,29 @@ class DeployToolsBinary(tools.binary.DeployToolsBinary):
                                '/lib64',
                                '/usr/local/lib',
                                '/usr/local/lib64']
+        self.ldCache = self.readLdCache()
         self.emCodes = {3  : '386',
                         40 : 'ARM',
                         62 : 'X86_64',
                         183: 'AARCH64'}
 
+        # Map ELF machine codes to the architecture flags used in
+        # ld.so.cache.
+        self.ldCacheFlags = {3  : 0x0000,
+                             62 : 0x0300,
+                             183: 0x0a00}
+        self.dirIndex = {}
+        self.ldLibraryIndex = {}
+        self.libsSearchIndex = {}
+        self.libsIndexContext = None
+        self.libsIndexMutex = threading.Lock()
+        self.libPathCache = {}
+        self.libPathCacheHits = 0
+        self.libPathCacheMisses = 0
+        self.machineCache = {}
+        self.machineCacheHits = 0
+        self.machineCacheMisses = 0
+
     def readLdconf(self, ldconf='/etc/ld.so.conf'):
         if not os.path.exists(ldconf):
             return []
@@ -85,179 +107,548 @@ class DeployToolsBinary(tools.binary.DeployToolsBinary):
 
         return libpaths
 
+    @staticmethod
+    def readLdCacheString(data, offset):
+        # The strings of a valid cache are always inside the file and null
+        # terminated.
+        end = data.find(b'\x00', offset)
+
+        if offset < 0 or end < 0:
+            raise ValueError('Invalid string offset: {}'.format(offset))
+
+        return data[offset: end].decode(sys.getdefaultencoding())
+
+    # https://sourceware.org/git/?p=glibc.git;a=blob;f=sysdeps/generic/dl-cache.h
+    def readLdCache(self, ldcache='/etc/ld.so.cache'):
+        # Returns an empty cache if the file is missing, truncated or
+        # corrupt, the libraries are searched in the directories then.
+
+        # Cache magic signatures
+        CACHEMAGIC = b'ld.so-1.7.0'
+        CACHEMAGIC_NEW = b'glibc-ld.so.cache1.1'
+
+        # Mask of the architecture required by the library.
+        FLAG_REQUIRED_MASK = 0xff00
+
+        cache = {}
+
+        try:
+            with open(ldcache, 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    newHeader = -1
+
+                    if data[: len(CACHEMAGIC)] == CACHEMAGIC:
+                        # Old format, the new format may be appended after the
+                        # old entries.
+                        nlibs = struct.unpack_from('I', data, 12)[0]
+                        strings = 16 + 12 * nlibs
+
+                        if strings > len(data):
+                            return {}
+
+                        newHeader = data.find(CACHEMAGIC_NEW, strings)
+
+                        if newHeader < 0:
+                            for flags, key, value in struct.iter_unpack('iII', data[16: strings]):
+                                soname = self.readLdCacheString(data, strings + key)
+                                path = self.readLdCacheString(data, strings + value)
+                                cache.setdefault((soname, flags & FLAG_REQUIRED_MASK), []).append(path)
+
+                            return cache
+                    elif data[: len(CACHEMAGIC_NEW)] == CACHEMAGIC_NEW:
+                        newHeader = 0
+
+                    if newHeader < 0:
+                        return {}
+
+                    # In the new format the strings are relative to the
+                    # beginning of the header.
+                    nlibs = struct.unpack_from('I', data, newHeader + 20)[0]
+                    start = newHeader + 48
+                    end = start + 24 * nlibs
+
+                    if end > len(data):
+                        return {}
+
+                    for flags, key, value, _, hwcap in struct.iter_unpack('iIIIQ', data[start: end]):
+                        # The libraries optimized for some CPU features are
+                        # only loaded in the CPUs supporting them, deploy the
+                        # generic ones.
+                        if hwcap != 0:
+                            continue
+
+                        soname = self.readLdCacheString(data, newHeader + key)
+                        path = self.readLdCacheString(data, newHeader + value)
+                        cache.setdefault((soname, flags & FLAG_REQUIRED_MASK), []).append(path)
+        except:
+            return {}
+
+        return cache
+
+    def ldCacheCandidates(self, lib, machine):
+        if not self.ldCache:
+            return []
+
+        if machine in self.ldCacheFlags:
+            key = (lib, self.ldCacheFlags[machine])
+
+            return self.ldCache[key] if key in self.ldCache else []
+
+        candidates = []
+
+        for key in self.ldCache:
+            if key[0] == lib:
+                candidates += self.ldCache[key]
+
+        return candidates
+
     def isValid(self, path):
         with open(path, 'rb') as f:
             return f.read(4) == b'\x7fELF'
 
     @staticmethod
-    def readString(f):
-        s = b''
+    def readString(data, offset):
+        end = data.find(b'\x00', offset)
 
-        while True:
-            c = f.read(1)
+        if end < 0:
+            end = len(data)
 
-            if c == b'\x00':
-                break
+        return data[offset: end].decode(sys.getdefaultencoding())
+
+    @staticmethod
+    def readElfHeader(data):
+        # ELF file magic
+        ELFMAGIC = b'\x7fELF'
+
+        if len(data) < 0x34 or data[: 4] != ELFMAGIC:
+            return {}
+
+        # Read the data structure and the byte order of the file.
+        is32bits = data[4] == 1
+        endian = '>' if data[5] == 2 else '<'
+
+        if is32bits:
+            header = struct.unpack_from(endian + 'HHIIIIIHHHHHH', data, 0x10)
+        else:
+            if len(data) < 0x40:
+                return {}
 
-            s += c
+            header = struct.unpack_from(endian + 'HHIQQQIHHHHHH', data, 0x10)
 
-        return s
+        return {'is32bits': is32bits,
+                'endian': endian,
+                'type': header[0],
+                'machine': header[1],
+                'phoff': header[4],
+                'shoff': header[5],
+                'phentsize': header[8],
+                'phnum': header[9],
+                'shentsize': header[10],
+                'shnum': header[11],
+                'shstrndx': header[12]}
 
     @staticmethod
-    def readNumber(f, arch):
-        if arch == '32bits':
-            return struct.unpack('I', f.read(4))[0]
+    def readSections(data, header):
+        # Each entry is read as:
+        #
+        # (name, type, flags, addr, offset, size, link, info, addralign, entsize)
+        sectionFormat = header['endian'] \
+                      + ('IIIIIIIIII' if header['is32bits'] else 'IIQQQQIIQQ')
+        entrySize = struct.calcsize(sectionFormat)
+
+        if header['shoff'] < 1 \
+            or header['shentsize'] != entrySize \
+            or header['shoff'] + header['shnum'] * entrySize > len(data):
+            return []
+
+        sectionTable = data[header['shoff']: header['shoff'] + header['shnum'] * entrySize]
 
-        return struct.unpack('Q', f.read(8))[0]
+        return list(struct.iter_unpack(sectionFormat, sectionTable))
 
     @staticmethod
-    def readDynamicEntry(f, arch):
-        if arch == '32bits':
-            return struct.unpack('iI', f.read(8))
+    def readDynamicEntries(data, header, offset, size):
+        entryFormat = header['endian'] + ('iI' if header['is32bits'] else 'qQ')
+        entrySize = struct.calcsize(entryFormat)
+        size = min(size, len(data) - offset)
+        size -= size % entrySize
 
-        return struct.unpack('qQ', f.read(16))
+        if offset < 0 or size < 1:
+            return []
 
-    # https://refspecs.linuxfoundation.org/lsb.shtml (See Core, Generic)
-    # https://en.wikipedia.org/wiki/Executable_and_Linkable_Format
-    def dump(self, binary):
-        # ELF file magic
-        ELFMAGIC = b'\x7fELF'
+        entries = []
 
-        # Sections
-        SHT_STRTAB = 0x3
-        SHT_DYNAMIC = 0x6
+        for entry in struct.iter_unpack(entryFormat, data[offset: offset + size]):
+            entries.append(entry)
 
+            # DT_NULL marks the end of the dynamic section.
+            if entry[0] == 0:
+                break
+
+        return entries
+
+    @staticmethod
+    def readDependencies(data, entries, strtab):
         # Dynamic section entries
-        DT_NULL = 0
         DT_NEEDED = 1
         DT_RPATH = 15
         DT_RUNPATH = 0x1d
 
-        with open(binary, 'rb') as f:
-            # Read magic signature.
-            magic = f.read(4)
+        needed = set()
+        rpaths = set()
+        runpaths = set()
 
-            if magic != ELFMAGIC:
-                return {}
+        for dTag, dVal in entries:
+            if dTag == DT_NEEDED:
+                # Dynamically imported libraries.
+                needed.add(DeployToolsBinary.readString(data, strtab + dVal))
+            elif dTag == DT_RPATH:
+                # RPATHs.
+                rpaths.add(DeployToolsBinary.readString(data, strtab + dVal))
+            elif dTag == DT_RUNPATH:
+                # RUNPATHs.
+                runpaths.add(DeployToolsBinary.readString(data, strtab + dVal))
 
-            # Read the data structure of the file.
-            eiClass = '32bits' if struct.unpack('B', f.read(1))[0] == 1 else '64bits'
-
-            # Read machine code.
-            f.seek(0x12, os.SEEK_SET)
-            machine = struct.unpack('H', f.read(2))[0]
-
-            # Get a pointer to the sections table.
-            sectionHeaderTable = 0
-
-            if eiClass == '32bits':
-                f.seek(0x20, os.SEEK_SET)
-                sectionHeaderTable = self.readNumber(f, eiClass)
-                f.seek(0x30, os.SEEK_SET)
-            else:
-                f.seek(0x28, os.SEEK_SET)
-                sectionHeaderTable = self.readNumber(f, eiClass)
-                f.seek(0x3c, os.SEEK_SET)
-
-            # Read the number of sections.
-            nSections = struct.unpack('H', f.read(2))[0]
-
-            # Read the index of the string table that stores sections names.
-            shstrtabIndex = struct.unpack('H', f.read(2))[0]
-
-            # Read sections.
-            f.seek(sectionHeaderTable, os.SEEK_SET)
-            neededPtr = []
-            rpathsPtr = []
-            runpathsPtr = []
-            strtabs = []
-            shstrtab = []
-
-            for section in range(nSections):
-                sectionStart = f.tell()
-
-                # Read the a pointer to the virtual address in the string table
-                # that contains the name of this section.
-                sectionName = struct.unpack('I', f.read(4))[0]
-
-                # Read the type of this section.
-                sectionType = struct.unpack('I', f.read(4))[0]
-
-                # Read the virtual address of this section.
-                f.seek(sectionStart + (0x0c if eiClass == '32bits' else 0x10), os.SEEK_SET)
-                shAddr = self.readNumber(f, eiClass)
-
-                # Read the offset in file to this section.
-                shOffset = self.readNumber(f, eiClass)
-                f.seek(shOffset, os.SEEK_SET)
-
-                if sectionType == SHT_DYNAMIC:
-                    # Read dynamic sections.
-                    while True:
-                        # Read dynamic entries.
-                        dTag, dVal = self.readDynamicEntry(f, eiClass)
-
-                        if dTag == DT_NULL:
-                            # End of dynamic sections.
-                            break
-                        elif dTag == DT_NEEDED:
-                            # Dynamically imported libraries.
-                            neededPtr.append(dVal)
-                        elif dTag == DT_RPATH:
-                            # RPATHs.
-                            rpathsPtr.append(dVal)
-                        elif dTag == DT_RUNPATH:
-                            # RUNPATHs.
-                            runpathsPtr.append(dVal)
-                elif sectionType == SHT_STRTAB:
-                    # Read string tables.
-                    if section == shstrtabIndex:
-                        # We found the string table that stores sections names.
-                        shstrtab = [shAddr, shOffset]
-                    else:
-                        # Save string tables for later usage.
-                        strtabs += [[sectionName, shAddr, shOffset]]
-
-                # Move to next section.
-                f.seek(sectionStart + (0x28 if eiClass == '32bits' else 0x40), os.SEEK_SET)
-
-            # Libraries names and RUNPATHs are located in '.dynstr' table.
-            strtab = []
-
-            for tab in strtabs:
-                f.seek(tab[0] - shstrtab[0] + shstrtab[1], os.SEEK_SET)
-
-                if self.readString(f) == b'.dynstr':
-                    strtab = tab
-
-            # Read dynamically imported libraries.
-            needed = set()
-
-            for lib in neededPtr:
-                f.seek(lib + strtab[2], os.SEEK_SET)
-                needed.add(self.readString(f).decode(sys.getdefaultencoding()))
-
-            # Read RPATHs
-            rpaths = set()
-
-            for path in rpathsPtr:
-                f.seek(path + strtab[2], os.SEEK_SET)
-                rpaths.add(self.readString(f).decode(sys.getdefaultencoding()))
-
-            # Read RUNPATHs
-            runpaths = set()
-
-            for path in runpathsPtr:
-                f.seek(path + strtab[2], os.SEEK_SET)
-                runpaths.add(self.readString(f).decode(sys.getdefaultencoding()))
-
-            return {'machine': machine,
-                    'imports': needed,
-                    'rpath': rpaths,
-                    'runpath': runpaths}
+        return needed, rpaths, runpaths
+
+    # https://refspecs.linuxfoundation.org/lsb.shtml (See Core, Generic)
+    # https://en.wikipedia.org/wiki/Executable_and_Linkable_Format
+    def dumpBinary(self, binary):
+        try:
+            with open(binary, 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    return self.dumpData(data)
+        except:
+            pass
 
         return {}
 
+    @staticmethod
+    def readSegments(data, header):
+        # Each entry is read as:
+        #
+        # (type, offset, vaddr, filesz)
+        if header['is32bits']:
+            segmentFormat = header['endian'] + 'IIIIIIII'
+            fields = [0, 1, 2, 4]
+        else:
+            segmentFormat = header['endian'] + 'IIQQQQQQ'
+            fields = [0, 2, 3, 5]
+
+        entrySize = struct.calcsize(segmentFormat)
+
+        if header['phoff'] < 1 \
+            or header['phentsize'] != entrySize \
+            or header['phoff'] + header['phnum'] * entrySize > len(data):
+            return []
+
+        segmentTable = data[header['phoff']: header['phoff'] + header['phnum'] * entrySize]
+
+        return [tuple(segment[i] for i in fields)
+                for segment in struct.iter_unpack(segmentFormat, segmentTable)]
+
+    @staticmethod
+    def addressToOffset(segments, address):
+        # Segments
+        PT_LOAD = 1
+
+        for pType, pOffset, pVaddr, pFilesz in segments:
+            if pType == PT_LOAD and pVaddr <= address < pVaddr + pFilesz:
+                return address - pVaddr + pOffset
+
+        return -1
+
+    def readDynamicSegment(self, data, header):
+        # Segments
+        PT_DYNAMIC = 2
+
+        # Dynamic section entries
+        DT_STRTAB = 5
+        DT_STRSZ = 10
+
+        segments = self.readSegments(data, header)
+
+        for pType, pOffset, _, pFilesz in segments:
+            if pType != PT_DYNAMIC:
+                continue
+
+            entries = self.readDynamicEntries(data, header, pOffset, pFilesz)
+            strtabAddress = -1
+            strtabSize = 0
+
+            for dTag, dVal in entries:
+                if dTag == DT_STRTAB:
+                    strtabAddress = dVal
+                elif dTag == DT_STRSZ:
+                    strtabSize = dVal
+
+            if strtabAddress < 0:
+                break
+
+            # DT_STRTAB holds a virtual address, translate it to a position
+            # in the file through the loadable segments.
+            strtab = self.addressToOffset(segments, strtabAddress)
+
+            if strtab < 0 or strtab + strtabSize > len(data):
+                break
+
+            return entries, strtab
+
+        return [], -1
+
+    def readDynamicSection(self, data, header):
+        # Sections
+        SHT_DYNAMIC = 0x6
+
+        sections = self.readSections(data, header)
+
+        for section in sections:
+            if section[1] != SHT_DYNAMIC:
+                continue
+
+            entries = self.readDynamicEntries(data, header, section[4], section[5])
+
+            # The dynamic section links to the string table ('.dynstr')
+            # containing the libraries names, RPATHs and RUNPATHs.
+            if section[6] < len(sections):
+                return entries, sections[section[6]][4]
+
+            break
+
+        return [], -1
+
+    def dumpData(self, data):
+        header = self.readElfHeader(data)
+
+        if not header:
+            return {}
+
+        # Read the dynamic entries from the PT_DYNAMIC segment, this only
+        # touches the program headers and works with binaries without section
+        # headers. Use the sections table if that fails.
+        entries, strtab = self.readDynamicSegment(data, header)
+
+        if strtab < 0:
+            entries, strtab = self.readDynamicSection(data, header)
+
+        needed = set()
+        rpaths = set()
+        runpaths = set()
+
+        if strtab >= 0:
+            needed, rpaths, runpaths = self.readDependencies(data, entries, strtab)
+
+        return {'machine': header['machine'],
+                'imports': needed,
+                'rpath': rpaths,
+                'runpath': runpaths}
+
+    @staticmethod
+    def isStrippable(section, name):
+        # Returns True if stripData() removes the section: the symbols
+        # tables, the debug information and the comments.
+
+        # Sections
+        SHT_SYMTAB = 2
+        SHT_SYMTAB_SHNDX = 18
+        SHF_ALLOC = 0x2
+
+        if section[2] & SHF_ALLOC:
+            return False
+
+        return section[1] in [SHT_SYMTAB, SHT_SYMTAB_SHNDX] \
+            or name.startswith('.debug') \
+            or name.startswith('.zdebug') \
+            or name == '.comment'
+
+    def isStripped(self, binary):
+        try:
+            with open(binary, 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    header = self.readElfHeader(data)
+
+                    if not header:
+                        return False
+
+                    sections = self.readSections(data, header)
+                    shstrndx = header['shstrndx']
+
+                    if shstrndx >= len(sections):
+                        return len(sections) < 1
+
+                    shstrtab = sections[shstrndx][4]
+
+                    for i, section in enumerate(sections):
+                        if i == 0 or i == shstrndx:
+                            continue
+
+                        if self.isStrippable(section,
+                                             self.readString(data, shstrtab + section[0])):
+                            return False
+        except:
+            return False
+
+        return True
+
+    def stripData(self, data):
+        # Returns the binary without the symbols table, the debug information
+        # and the comments, or None if the binary must be stripped with the
+        # strip tool.
+
+        # ELF types
+        ET_EXEC = 2
+        ET_DYN = 3
+
+        # Sections
+        SHT_SYMTAB = 2
+        SHT_RELA = 4
+        SHT_NOBITS = 8
+        SHT_REL = 9
+        SHF_ALLOC = 0x2
+        SHF_INFO_LINK = 0x40
+        SHN_LORESERVE = 0xff00
+
+        header = self.readElfHeader(data)
+
+        if not header \
+            or not header['type'] in [ET_EXEC, ET_DYN] \
+            or header['shnum'] >= SHN_LORESERVE:
+            return None
+
+        sections = self.readSections(data, header)
+        shstrndx = header['shstrndx']
+
+        if len(sections) < 1 or shstrndx < 1 or shstrndx >= len(sections):
+            return None
+
+        names = [self.readString(data, sections[shstrndx][4] + section[0])
+                 for section in sections]
+        removed = set()
+
+        for i, section in enumerate(sections):
+            if i == 0 or i == shstrndx:
+                continue
+
+            if self.isStrippable(section, names[i]):
+                removed.add(i)
+
+        # Remove the string table of the symbols table, and the relocations
+        # of the removed sections, unless something else needs them.
+        for i, section in enumerate(sections):
+            if i in removed:
+                continue
+
+            if section[1] in [SHT_REL, SHT_RELA] \
+                and not section[2] & SHF_ALLOC \
+                and section[7] in removed:
+                removed.add(i)
+
+        for i in list(removed):
+            link = sections[i][6]
+
+            if sections[i][1] == SHT_SYMTAB \
+                and 0 < link < len(sections) \
+                and link != shstrndx \
+                and not sections[link][2] & SHF_ALLOC \
+                and all(j in removed or j == link or section[6] != link
+                        for j, section in enumerate(sections)):
+                removed.add(link)
+
+        if len(removed) < 1:
+            return None
+
+        # Everything mapped by the segments is kept as is, the remaining
+        # sections and the new sections table are appended after it.
+        segments = self.readSegments(data, header)
+        dataEnd = header['phoff'] + header['phnum'] * header['phentsize']
+
+        for _, offset, _, size in segments:
+            dataEnd = max(dataEnd, offset + size)
+
+        stripped = bytearray(data[: dataEnd])
+        newIndex = {}
+
+        for i in range(len(sections)):
+            if not i in removed:
+                newIndex[i] = len(newIndex)
+
+        # Rebuild the sections names table.
+        shstrtab = bytearray(b'\x00')
+        nameOffsets = {'': 0}
+
+        for i in newIndex:
+            if not names[i] in nameOffsets:
+                nameOffsets[names[i]] = len(shstrtab)
+                shstrtab += names[i].encode(sys.getdefaultencoding()) + b'\x00'
+
+        newSections = []
+
+        for i in newIndex:
+            name, sType, flags, addr, offset, size, link, info, addralign, entsize = sections[i]
+
+            if i == shstrndx:
+                offset = len(stripped)
+                size = len(shstrtab)
+                stripped += shstrtab
+            elif i > 0 and sType != SHT_NOBITS and offset + size > dataEnd:
+                if addralign > 1:
+                    stripped += b'\x00' * (-len(stripped) % addralign)
+
+                stripped += data[offset: offset + size]
+                offset = len(stripped) - size
+
+            link = newIndex[link] if link in newIndex else 0
+
+            if sType in [SHT_REL, SHT_RELA] or flags & SHF_INFO_LINK:
+                info = newIndex[info] if info in newIndex else 0
+
+            newSections.append((nameOffsets[names[i]] if i > 0 else name,
+                                sType,
+                                flags,
+                                addr,
+                                offset,
+                                size,
+                                link,
+                                info,
+                                addralign,
+                                entsize))
+
+        sectionFormat = header['endian'] \
+                      + ('IIIIIIIIII' if header['is32bits'] else 'IIQQQQIIQQ')
+        stripped += b'\x00' * (-len(stripped) % (4 if header['is32bits'] else 8))
+        shoff = len(stripped)
+
+        for section in newSections:
+            stripped += struct.pack(sectionFormat, *section)
+
+        # Update the sections table position, the number of sections and the
+        # index of the names table.
+        if header['is32bits']:
+            struct.pack_into(header['endian'] + 'I', stripped, 0x20, shoff)
+            struct.pack_into(header['endian'] + 'HH', stripped, 0x30, len(newSections), newIndex[shstrndx])
+        else:
+            struct.pack_into(header['endian'] + 'Q', stripped, 0x28, shoff)
+            struct.pack_into(header['endian'] + 'HH', stripped, 0x3c, len(newSections), newIndex[shstrndx])
+
+        return stripped
+
+    def stripIdentity(self):
+        # Increase the version every time stripData() output changes.
+        return 'elf-1:' + super().stripIdentity()
+
+    def strip(self, binary):
+        # Strip the binary in process, fall back to the strip tool for the
+        # binaries that can't be handled here.
+        try:
+            with open(binary, 'rb') as f:
+                data = f.read()
+
+            stripped = self.stripData(data)
+        except:
+            stripped = None
+
+        if stripped is None or not self.writeFileAtomically(binary, stripped):
+            super().strip(binary)
+
     @staticmethod
     def readRpaths(elfInfo, binDir):
         rpaths = []
@@ -281,28 +672,165 @@ class DeployToolsBinary(tools.binary.DeployToolsBinary):
 
         return rpaths, runpaths
 
-    def libPath(self, lib, machine, rpaths, runpaths):
-        # man ld.so
-        searchPaths = rpaths \
-                    + self.ldLibraryPath \
-                    + runpaths \
-                    + self.libsSeachPaths
+    def machineCode(self, path):
+        if path in self.machineCache:
+            self.machineCacheHits += 1
+
+            return self.machineCache[path]
+
+        self.machineCacheMisses += 1
+        machine = None
+
+        # Read just the ELF header, the machine code is at 0x12.
+        try:
+            with open(path, 'rb') as f:
+                header = f.read(0x14)
+
+            if len(header) == 0x14 and header[: 4] == b'\x7fELF':
+                endian = '>' if header[5] == 2 else '<'
+                machine = struct.unpack_from(endian + 'H', header, 0x12)[0]
+        except:
+            pass
+
+        self.machineCache[path] = machine
+
+        return machine
+
+    @staticmethod
+    def dirMtime(libdir):
+        try:
+            return os.stat(libdir).st_mtime_ns
+        except:
+            return -1
+
+    def listDir(self, libdir):
+        # The directory is listed again if it was modified since the last
+        # time, for instance when the deploy copies libraries into it.
+        mtime = self.dirMtime(libdir)
+
+        if libdir in self.dirIndex and self.dirIndex[libdir][0] == mtime:
+            return self.dirIndex[libdir][1]
+
+        names = set()
+
+        try:
+            with os.scandir(libdir) as entries:
+                for entry in entries:
+                    names.add(entry.name)
+        except:
+            pass
+
+        self.dirIndex[libdir] = (mtime, names)
+
+        return names
+
+    def buildLibsIndex(self, searchPaths):
+        index = {}
 
         for libdir in searchPaths:
-            path = os.path.join(libdir, lib)
+            for lib in self.listDir(libdir):
+                if not lib in index:
+                    index[lib] = []
+
+                index[lib].append(os.path.join(libdir, lib))
+
+        return index
+
+    def updateLibsIndex(self):
+        # Rebuild the index only when the search paths change, for instance
+        # when a path is appended to ldLibraryPath.
+        context = (tuple(self.ldLibraryPath), tuple(self.libsSeachPaths))
+
+        if context == self.libsIndexContext:
+            return False
+
+        with self.libsIndexMutex:
+            if context == self.libsIndexContext:
+                return False
+
+            self.dirIndex = {}
+            self.ldLibraryIndex = self.buildLibsIndex(self.ldLibraryPath)
+            self.libsSearchIndex = self.buildLibsIndex(self.libsSeachPaths)
+            self.libPathCache = {}
+            self.libsIndexContext = context
+
+        return True
+
+    def libCandidates(self, lib, machine, rpaths, runpaths):
+        # man ld.so
+        if os.sep in lib:
+            searchPaths = rpaths \
+                        + self.ldLibraryPath \
+                        + runpaths \
+                        + self.libsSeachPaths
+
+            return [os.path.join(libdir, lib) for libdir in searchPaths]
+
+        candidates = [os.path.join(libdir, lib) for libdir in rpaths if lib in self.listDir(libdir)]
+
+        if lib in self.ldLibraryIndex:
+            candidates += self.ldLibraryIndex[lib]
+
+        candidates += [os.path.join(libdir, lib) for libdir in runpaths if lib in self.listDir(libdir)]
+
+        # Like the dynamic loader, search in ld.so.cache before falling back
+        # to the default library paths.
+        candidates += self.ldCacheCandidates(lib, machine)
+
+        if lib in self.libsSearchIndex:
+            candidates += self.libsSearchIndex[lib]
 
-            if os.path.exists(path):
-                depElfInfo = self.dump(path)
+        return candidates
 
-                if depElfInfo:
-                    if 'machine' in depElfInfo and (machine == 0 or depElfInfo['machine'] == machine):
-                        return path
-                    elif 'links' in depElfInfo and len(depElfInfo['links']) > 0:
-                        return path
+    def libPath(self, lib, machine, rpaths, runpaths):
+        # The resolved paths are only valid for the current search paths.
+        self.updateLibsIndex()
+
+        # The RPATHs and RUNPATHs can point to the directories the libraries
+        # are being deployed to, the result is not valid anymore if these
+        # change.
+        key = (lib,
+               machine,
+               tuple(rpaths),
+               tuple(runpaths),
+               tuple([self.dirMtime(libdir) for libdir in rpaths + runpaths]))
+
+        if key in self.libPathCache:
+            self.libPathCacheHits += 1
+
+            return self.libPathCache[key]
+
+        self.libPathCacheMisses += 1
+        libpath = ''
+
+        for path in self.libCandidates(lib, machine, rpaths, runpaths):
+            depMachine = self.machineCode(path)
+
+            if depMachine is not None and (machine == 0 or depMachine == machine):
+                libpath = path
+
+                break
+
+        self.libPathCache[key] = libpath
 
-        return ''
+        return libpath
 
-    def dependencies(self, binary):
+    def cacheStats(self):
+        return super().cacheStats() \
+             + [self.formatCacheStats('Library resolution cache',
+                                      self.libPathCacheHits,
+                                      self.libPathCacheMisses),
+                self.formatCacheStats('Machine code cache',
+                                      self.machineCacheHits,
+                                      self.machineCacheMisses)]
+
+    def resolutionContext(self):
+        return super().resolutionContext() \
+             + (tuple(self.ldLibraryPath),
+                tuple(self.libsSeachPaths),
+                len(self.ldCache))
+
+    def resolveImports(self, binary):
         elfInfo = self.dump(binary)
 
         if not elfInfo:
@@ -326,10 +854,20 @@ class DeployToolsBinary(tools.binary.DeployToolsBinary):
             libpath = self.libPath(lib, machine, rpaths, runpaths)
 
             if len(libpath) > 0 and not self.isExcluded(libpath):
-                libs.append(libpath)
+                libs.append((lib, libpath))
 
         return libs
 
+    def searchDirs(self, binary):
+        elfInfo = self.dump(binary)
+
+        if not elfInfo:
+            return []
+
+        rpaths, runpaths = self.readRpaths(elfInfo, os.path.dirname(binary))
+
+        return rpaths + self.ldLibraryPath + runpaths + self.libsSeachPaths
+
     def name(self, binary):
         dep = os.path.basename(binary)[3:]
 
@@ -19,9 +19,12 @@
 #
 # Web-Site: http://webcamoid.github.io/
 
+import mmap
 import os
+import platform
 import struct
 import sys
+import threading
 
 import tools.binary
 
@@ -29,6 +32,8 @@ import tools.binary
 class DeployToolsBinary(tools.binary.DeployToolsBinary):
     def __init__(self):
         super().__init__()
+        self.binaryFormat = 'mach'
+        self.minBinarySize = 28
 
         # 32 bits magic number.
         self.MH_MAGIC = 0xfeedface # Native endian
@@ -38,94 +43,391 @@ class DeployToolsBinary(tools.binary.DeployToolsBinary):
         self.MH_MAGIC_64 = 0xfeedfacf # Native endian
         self.MH_CIGAM_64 = 0xcffaedfe # Reverse endian
 
+        # Universal binaries magic number, always stored as big endian.
+        self.FAT_MAGIC = 0xcafebabe
+        self.FAT_MAGIC_64 = 0xcafebabf
+
+        # CPU types
+        self.CPU_ARCH_ABI64 = 0x01000000
+        self.cpuTypes = {'i386': 7,
+                         'x86_64': 7 | self.CPU_ARCH_ABI64,
+                         'arm': 12,
+                         'arm64': 12 | self.CPU_ARCH_ABI64,
+                         'ppc': 18,
+                         'ppc64': 18 | self.CPU_ARCH_ABI64}
+
+        # CPU type of the slice read from universal binaries.
+        self.targetCpuType = self.cpuTypes.get(platform.machine(), 0)
+
+        self.dyldIndex = {}
+        self.dyldIndexContext = None
+        self.dyldIndexMutex = threading.Lock()
+        self.refPathCache = {}
+        self.refPathCacheHits = 0
+        self.refPathCacheMisses = 0
+
+    def isFat(self, header):
+        if len(header) < 8:
+            return False
+
+        magic, nArchs = struct.unpack_from('>II', header)
+
+        # Java class files share the same magic number, but there the next
+        # field is the class file version, which starts at 45.
+        return magic in [self.FAT_MAGIC, self.FAT_MAGIC_64] and nArchs < 45
+
     def isValid(self, path):
         try:
             with open(path, 'rb') as f:
-                # Read magic number.
-                magic = struct.unpack('I', f.read(4))[0]
-
-                if magic == self.MH_MAGIC \
-                    or magic == self.MH_CIGAM \
-                    or magic == self.MH_MAGIC_64 \
-                    or magic == self.MH_CIGAM_64:
-                    return True
+                header = f.read(8)
+
+            # Read magic number.
+            magic, = struct.unpack_from('<I', header)
+
+            if magic == self.MH_MAGIC \
+                or magic == self.MH_CIGAM \
+                or magic == self.MH_MAGIC_64 \
+                or magic == self.MH_CIGAM_64:
+                return True
+
+            return self.isFat(header)
         except:
             pass
 
         return False
 
-    # https://github.com/aidansteele/osx-abi-macho-file-format-reference
-    def dump(self, binary):
+    def readFatArchs(self, data):
+        # Each slice is read as:
+        #
+        # (cputype, offset, size)
+        magic, nArchs = struct.unpack_from('>II', data)
+
+        if magic == self.FAT_MAGIC_64:
+            archFormat = '>iiQQII'
+        else:
+            archFormat = '>iiIII'
+
+        archsSize = nArchs * struct.calcsize(archFormat)
+
+        if 8 + archsSize > len(data):
+            return []
+
+        return [(arch[0], arch[2], arch[3])
+                for arch in struct.iter_unpack(archFormat, data[8: 8 + archsSize])]
+
+    def selectFatArch(self, archs):
+        # Prefer the slice for the target CPU, then any slice with the same
+        # word size as the target.
+        for arch in archs:
+            if arch[0] == self.targetCpuType:
+                return arch
+
+        is64bits = self.targetArch == '64bit'
+
+        for arch in archs:
+            if bool(arch[0] & self.CPU_ARCH_ABI64) == is64bits:
+                return arch
+
+        return archs[0] if len(archs) > 0 else None
+
+    @staticmethod
+    def readString(data, offset, end):
+        stringEnd = data.find(b'\x00', offset, end)
+
+        if stringEnd < 0:
+            stringEnd = end
+
+        return data[offset: stringEnd].decode(sys.getdefaultencoding())
+
+    def dumpData(self, data, offset=0):
         # Commands definitions
         LC_REQ_DYLD = 0x80000000
         LC_LOAD_DYLIB = 0xc
         LC_RPATH = 0x1c | LC_REQ_DYLD
         LC_ID_DYLIB = 0xd
 
+        if offset + 28 > len(data):
+            return {}
+
+        # Read magic number.
+        magic, = struct.unpack_from('<I', data, offset)
+
+        if magic == self.MH_MAGIC or magic == self.MH_MAGIC_64:
+            endian = '<'
+        elif magic == self.MH_CIGAM or magic == self.MH_CIGAM_64:
+            endian = '>'
+        else:
+            return {}
+
+        is32bits = magic == self.MH_MAGIC or magic == self.MH_CIGAM
+
+        # Read the number and the total size of the load commands.
+        ncmds, sizeofcmds = struct.unpack_from(endian + 'II', data, offset + 16)
+
+        # Read all load commands at once.
+        commandsOffset = offset + (28 if is32bits else 32)
+        commands = data[commandsOffset: commandsOffset + sizeofcmds]
+
         dylibImports = []
         rpaths = []
         dylibId = ''
+        loadCommandStart = 0
 
-        with open(binary, 'rb') as f:
-            # Read magic number.
-            magic = struct.unpack('I', f.read(4))[0]
+        for _ in range(ncmds):
+            if loadCommandStart + 8 > len(commands):
+                break
 
-            if magic == self.MH_MAGIC or magic == self.MH_CIGAM:
-                is32bits = True
-            elif magic == self.MH_MAGIC_64 or magic == self.MH_CIGAM_64:
-                is32bits = False
-            else:
-                return {}
+            cmd, cmdsize = struct.unpack_from(endian + 'II', commands, loadCommandStart)
 
-            # Read number of commands.
-            f.seek(12, os.SEEK_CUR)
-            ncmds = struct.unpack('I', f.read(4))[0]
+            if cmdsize < 8:
+                break
 
-            # Move to load commands
-            f.seek(8 if is32bits else 12, os.SEEK_CUR)
+            # If the command list a library
+            if cmd in [LC_LOAD_DYLIB, LC_RPATH, LC_ID_DYLIB] \
+                and loadCommandStart + 12 <= len(commands):
+                stringOffset, = struct.unpack_from(endian + 'I',
+                                                   commands,
+                                                   loadCommandStart + 8)
+                s = self.readString(commands,
+                                    loadCommandStart + stringOffset,
+                                    min(loadCommandStart + cmdsize, len(commands)))
 
-            for _ in range(ncmds):
-                # Read a load command and store it's position in the file.
-                loadCommandStart = f.tell()
-                loadCommand = struct.unpack('II', f.read(8))
+                if cmd == LC_LOAD_DYLIB:
+                    dylibImports.append(s)
+                elif cmd == LC_RPATH:
+                    rpaths.append(s)
+                elif cmd == LC_ID_DYLIB:
+                    dylibId = s
 
-                # If the command list a library
-                if loadCommand[0] in [LC_LOAD_DYLIB, LC_RPATH, LC_ID_DYLIB]:
-                    # Save the position of the next command.
-                    nextCommand = f.tell() + loadCommand[1] - 8
+            loadCommandStart += cmdsize
 
-                    # Move to the string
-                    f.seek(loadCommandStart + struct.unpack('I', f.read(4))[0], os.SEEK_SET)
-                    dylib = b''
+        return {'imports': dylibImports, 'rpaths': rpaths, 'id': dylibId}
 
-                    # Read string until null character.
-                    while True:
-                        c = f.read(1)
+    # https://github.com/aidansteele/osx-abi-macho-file-format-reference
+    def dumpBinary(self, binary):
+        try:
+            with open(binary, 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    if not self.isFat(data[: 8]):
+                        return self.dumpData(data)
 
-                        if c == b'\x00':
-                            break
+                    arch = self.selectFatArch(self.readFatArchs(data))
 
-                        dylib += c
-                    s = dylib.decode(sys.getdefaultencoding())
+                    if arch is None:
+                        return {}
 
-                    if loadCommand[0] == LC_LOAD_DYLIB:
-                        dylibImports.append(s)
-                    elif loadCommand[0] == LC_RPATH:
-                        rpaths.append(s)
-                    elif loadCommand[0] == LC_ID_DYLIB:
-                        dylibId = s
+                    return self.dumpData(data, arch[1])
+        except:
+            pass
 
-                    f.seek(nextCommand, os.SEEK_SET)
-                else:
-                    f.seek(loadCommand[1] - 8, os.SEEK_CUR)
+        return {}
 
-        return {'imports': dylibImports, 'rpaths': rpaths, 'id': dylibId}
+    @staticmethod
+    def segmentDataOffset(command, endian, is32bits, sliceSize):
+        # Returns the offset of the first byte of data in the file mapped by
+        # the segment, the load commands can't grow beyond this point.
+        S_ZEROFILL = 0x1
+        S_GB_ZEROFILL = 0xc
+        S_THREAD_LOCAL_ZEROFILL = 0x12
+
+        # Segments are read as:
+        #
+        # (cmd, cmdsize, segname, vmaddr, vmsize, fileoff, filesize, maxprot,
+        #  initprot, nsects, flags)
+        #
+        # and sections as:
+        #
+        # (sectname, segname, addr, size, offset, align, reloff, nreloc,
+        #  flags, ...)
+        if is32bits:
+            segmentFormat = endian + 'II16sIIIIiiII'
+            sectionFormat = endian + '16s16sIIIIIIIII'
+        else:
+            segmentFormat = endian + 'II16sQQQQiiII'
+            sectionFormat = endian + '16s16sQQIIIIIIII'
+
+        segmentSize = struct.calcsize(segmentFormat)
+        sectionSize = struct.calcsize(sectionFormat)
+
+        if len(command) < segmentSize:
+            return 0
+
+        segment = struct.unpack_from(segmentFormat, command)
+        fileOffset, fileSize, nSections = segment[5], segment[6], segment[9]
+        dataOffset = sliceSize
+
+        if fileOffset > 0 and fileSize > 0:
+            dataOffset = fileOffset
+
+        if segmentSize + nSections * sectionSize > len(command):
+            return 0
+
+        for section in struct.iter_unpack(sectionFormat,
+                                          command[segmentSize: segmentSize + nSections * sectionSize]):
+            if section[8] & 0xff in [S_ZEROFILL,
+                                     S_GB_ZEROFILL,
+                                     S_THREAD_LOCAL_ZEROFILL]:
+                continue
+
+            if section[3] > 0 and section[4] > 0:
+                dataOffset = min(dataOffset, section[4])
+
+        return dataOffset
 
     @staticmethod
-    def solveRefpath(path):
-        if not path.startswith('@'):
-            return path
+    def stringCommand(cmd, fields, string, endian, align):
+        # Build a load command with the given fixed fields, followed by the
+        # string, padded to the required alignment.
+        string = string.encode(sys.getdefaultencoding()) + b'\x00'
+        stringOffset = 12 + len(fields)
+        cmdsize = stringOffset + len(string)
+        cmdsize += -cmdsize % align
+
+        return struct.pack(endian + 'III', cmd, cmdsize, stringOffset) \
+             + fields \
+             + string \
+             + b'\x00' * (cmdsize - stringOffset - len(string))
+
+    def rewriteSlice(self, data, offset, size, deleteRpaths, addRpaths, newId, changes):
+        # Commands definitions
+        LC_REQ_DYLD = 0x80000000
+        LC_SEGMENT = 0x1
+        LC_SEGMENT_64 = 0x19
+        LC_LOAD_DYLIB = 0xc
+        LC_ID_DYLIB = 0xd
+        LC_LOAD_WEAK_DYLIB = 0x18 | LC_REQ_DYLD
+        LC_RPATH = 0x1c | LC_REQ_DYLD
+        LC_CODE_SIGNATURE = 0x1d
+        LC_REEXPORT_DYLIB = 0x1f | LC_REQ_DYLD
+        LC_LAZY_LOAD_DYLIB = 0x20
+        LC_LOAD_UPWARD_DYLIB = 0x23 | LC_REQ_DYLD
+
+        loadCommands = [LC_LOAD_DYLIB,
+                        LC_LOAD_WEAK_DYLIB,
+                        LC_REEXPORT_DYLIB,
+                        LC_LAZY_LOAD_DYLIB,
+                        LC_LOAD_UPWARD_DYLIB]
+
+        if offset + 28 > len(data):
+            return False
+
+        magic, = struct.unpack_from('<I', data, offset)
+
+        if magic == self.MH_MAGIC or magic == self.MH_MAGIC_64:
+            endian = '<'
+        elif magic == self.MH_CIGAM or magic == self.MH_CIGAM_64:
+            endian = '>'
+        else:
+            return False
+
+        is32bits = magic == self.MH_MAGIC or magic == self.MH_CIGAM
+        headerSize = 28 if is32bits else 32
+        align = 4 if is32bits else 8
+        ncmds, sizeofcmds = struct.unpack_from(endian + 'II', data, offset + 16)
+        commandsOffset = offset + headerSize
+        commands = bytes(data[commandsOffset: commandsOffset + sizeofcmds])
+        dataOffset = size
+        newCommands = []
+        rpaths = []
+        loadCommandStart = 0
+
+        for _ in range(ncmds):
+            if loadCommandStart + 8 > len(commands):
+                return False
+
+            cmd, cmdsize = struct.unpack_from(endian + 'II', commands, loadCommandStart)
+
+            if cmdsize < 8 or loadCommandStart + cmdsize > len(commands):
+                return False
+
+            command = commands[loadCommandStart: loadCommandStart + cmdsize]
+            loadCommandStart += cmdsize
+
+            # Modifying a signed binary invalidates the signature, leave these
+            # to install_name_tool.
+            if cmd == LC_CODE_SIGNATURE:
+                return False
+
+            if cmd == LC_SEGMENT or cmd == LC_SEGMENT_64:
+                dataOffset = min(dataOffset,
+                                 self.segmentDataOffset(command,
+                                                        endian,
+                                                        cmd == LC_SEGMENT,
+                                                        size))
+            elif cmd == LC_RPATH \
+                or cmd == LC_ID_DYLIB \
+                or cmd in loadCommands:
+                if cmdsize < 12:
+                    return False
+
+                stringOffset, = struct.unpack_from(endian + 'I', command, 8)
+                string = self.readString(command, stringOffset, cmdsize)
+
+                if cmd == LC_RPATH:
+                    if string in deleteRpaths:
+                        continue
+
+                    rpaths.append(string)
+                elif cmd == LC_ID_DYLIB:
+                    if len(newId) > 0 and newId != string:
+                        command = self.stringCommand(cmd, command[12: 24], newId, endian, align)
+                elif string in changes:
+                    command = self.stringCommand(cmd, command[12: 24], changes[string], endian, align)
+
+            newCommands.append(command)
+
+        for rpath in addRpaths:
+            if not rpath in rpaths:
+                newCommands.append(self.stringCommand(LC_RPATH, b'', rpath, endian, align))
+                rpaths.append(rpath)
+
+        newCommandsData = b''.join(newCommands)
+
+        # The load commands must fit in the padding before the first section.
+        if headerSize + len(newCommandsData) > dataOffset:
+            return False
+
+        regionSize = max(sizeofcmds, len(newCommandsData))
+        data[commandsOffset: commandsOffset + regionSize] = \
+            newCommandsData + b'\x00' * (regionSize - len(newCommandsData))
+        struct.pack_into(endian + 'II', data, offset + 16, len(newCommands), len(newCommandsData))
+
+        return True
+
+    def rewriteLoadCommands(self, binary, deleteRpaths, addRpaths, newId, changes):
+        # Apply all the changes to the binary at once, same as
+        # install_name_tool -delete_rpath, -add_rpath, -id and -change would
+        # do. Returns False without modifying the file if any of the changes
+        # can't be done in place.
+        try:
+            with open(binary, 'rb') as f:
+                data = bytearray(f.read())
+        except:
+            return False
 
+        if self.isFat(data[: 8]):
+            slices = [(offset, size) for _, offset, size in self.readFatArchs(data)]
+        else:
+            slices = [(0, len(data))]
+
+        if len(slices) < 1:
+            return False
+
+        for offset, size in slices:
+            if offset + size > len(data) \
+                or not self.rewriteSlice(data,
+                                         offset,
+                                         size,
+                                         deleteRpaths,
+                                         addRpaths,
+                                         newId,
+                                         changes):
+                return False
+
+        return self.writeFileAtomically(binary, data)
+
+    @staticmethod
+    def dyldSearchPaths():
         searchPaths = []
 
         if 'DYLD_LIBRARY_PATH' in os.environ:
@@ -134,41 +436,185 @@ class DeployToolsBinary(tools.binary.DeployToolsBinary):
         if 'DYLD_FRAMEWORK_PATH' in os.environ:
             searchPaths += os.environ['DYLD_FRAMEWORK_PATH'].split(':')
 
+        return searchPaths
+
+    def updateDyldIndex(self):
+        # Index the dylibs and frameworks in the DYLD search paths, the index
+        # is rebuilt only when the search paths change.
+        context = tuple(self.dyldSearchPaths())
+
+        if context == self.dyldIndexContext:
+            return False
+
+        with self.dyldIndexMutex:
+            if context == self.dyldIndexContext:
+                return False
+
+            index = {}
+
+            for libdir in context:
+                try:
+                    with os.scandir(libdir) as entries:
+                        for entry in entries:
+                            if not entry.name in index:
+                                index[entry.name] = []
+
+                            index[entry.name].append(libdir)
+                except:
+                    pass
+
+            self.dyldIndex = index
+            self.refPathCache = {}
+            self.dyldIndexContext = context
+
+        return True
+
+    def searchDyldIndex(self, path):
         if path.endswith('.dylib'):
             dep = os.path.basename(path)
+            name = dep
         else:
             i = path.rfind(os.sep, 0, path.rfind('.framework'))
             dep = path[i + 1:]
+            name = dep.split(os.sep)[0]
+
+        if not name in self.dyldIndex:
+            return ''
 
-        for fpath in searchPaths:
-            realPath = os.path.join(fpath, dep)
+        for libdir in self.dyldIndex[name]:
+            realPath = os.path.join(libdir, dep)
 
             if os.path.exists(realPath):
                 return realPath
 
         return ''
 
-    def dependencies(self, binary):
+    @staticmethod
+    def expandRefpath(path, loaderDir):
+        # The executable path is not known while scanning, the binaries
+        # using it are expected to be in the same directory as the main
+        # executable.
+        for prefix in ['@loader_path', '@executable_path']:
+            if path == prefix:
+                return loaderDir
+
+            if path.startswith(prefix + '/'):
+                return os.path.normpath(os.path.join(loaderDir,
+                                                     path[len(prefix) + 1:]))
+
+        return path
+
+    def refpathCandidates(self, path, loaderDir, rpaths):
+        if path.startswith('@rpath/'):
+            for rpath in rpaths:
+                rpath = self.expandRefpath(rpath, loaderDir)
+
+                if not rpath.startswith('@'):
+                    yield os.path.join(rpath, path[len('@rpath/'):])
+        else:
+            path = self.expandRefpath(path, loaderDir)
+
+            if not path.startswith('@'):
+                yield path
+
+    def solveRefpath(self, path, loaderDir, rpaths):
+        if not path.startswith('@'):
+            return path
+
+        # DYLD paths have precedence over the paths in the binary, same as
+        # in dyld.
+        realPath = self.searchDyldIndex(path)
+
+        if len(realPath) > 0:
+            return realPath
+
+        for candidate in self.refpathCandidates(path, loaderDir, rpaths):
+            if os.path.exists(candidate):
+                return candidate
+
+        return ''
+
+    def dylibPath(self, dylib, loaderDir, rpaths):
+        # The resolved paths are only valid for the current search paths.
+        self.updateDyldIndex()
+
+        # Absolute paths don't depend on the loader.
+        if dylib.startswith('@'):
+            key = (dylib, loaderDir, tuple(rpaths))
+        else:
+            key = (dylib, '', ())
+
+        if key in self.refPathCache:
+            self.refPathCacheHits += 1
+
+            return self.refPathCache[key]
+
+        self.refPathCacheMisses += 1
+        mach = self.solveRefpath(dylib, loaderDir, rpaths)
+
+        # The libraries that can't be found aren't cached, these could be
+        # copied to the searched directories later.
+        if mach == '' or not os.path.exists(mach):
+            return ''
+
+        dirName = os.path.dirname(mach)
+        dirName = os.path.realpath(dirName)
+        baseName = os.path.basename(mach)
+        mach = os.path.join(dirName, baseName)
+        self.refPathCache[key] = mach
+
+        return mach
+
+    def cacheStats(self):
+        return super().cacheStats() \
+             + [self.formatCacheStats('Library resolution cache',
+                                      self.refPathCacheHits,
+                                      self.refPathCacheMisses)]
+
+    def resolutionContext(self):
+        context = super().resolutionContext()
+
+        for var in ['DYLD_LIBRARY_PATH', 'DYLD_FRAMEWORK_PATH']:
+            context += (os.environ[var] if var in os.environ else '',)
+
+        return context
+
+    def resolveImports(self, binary):
         machInfo = self.dump(binary)
 
         if not machInfo:
             return []
 
         libs = []
+        loaderDir = os.path.dirname(binary)
 
-        for mach in machInfo['imports']:
-            mach = self.solveRefpath(mach)
+        for dylib in machInfo['imports']:
+            mach = self.dylibPath(dylib, loaderDir, machInfo['rpaths'])
 
-            if mach == '' or self.isExcluded(mach) or not os.path.exists(mach):
+            if mach == '' or self.isExcluded(mach):
                 continue
 
-            dirName = os.path.dirname(mach)
-            dirName = os.path.realpath(dirName)
-            baseName = os.path.basename(mach)
-            libs.append(os.path.join(dirName, baseName))
+            libs.append((dylib, mach))
 
         return libs
 
+    def searchDirs(self, binary):
+        machInfo = self.dump(binary)
+
+        if not machInfo:
+            return []
+
+        dirs = self.dyldSearchPaths()
+        loaderDir = os.path.dirname(binary)
+
+        for dylib in machInfo['imports']:
+            for candidate in self.refpathCandidates(dylib,
+                                                    loaderDir,
+                                                    machInfo['rpaths']):
+                dirs.append(os.path.dirname(candidate))
+
+        return dirs
+
     def name(self, binary):
         dep = os.path.basename(binary)
         i = dep.find('.')
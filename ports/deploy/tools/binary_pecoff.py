@@ -19,10 +19,14 @@
 #
 # Web-Site: http://webcamoid.github.io/
 
+import bisect
 import mimetypes
+import mmap
 import os
+import re
 import struct
 import sys
+import threading
 
 import tools.binary
 
@@ -30,6 +34,23 @@ import tools.binary
 class DeployToolsBinary(tools.binary.DeployToolsBinary):
     def __init__(self):
         super().__init__()
+        self.binaryFormat = 'pecoff'
+        self.minBinarySize = 0x40
+        self.dirIndex = {}
+        self.dllIndex = {}
+        self.dllIndexContext = None
+        self.dllIndexMutex = threading.Lock()
+        self.systemDllsRegex = None
+
+    def isCandidate(self, entry):
+        if not super().isCandidate(entry):
+            return False
+
+        mimetype, _ = mimetypes.guess_type(entry.name)
+
+        return mimetype in ['application/x-msdownload',
+                            'application/x-msdos-program',
+                            'application/octet-stream']
 
     def isValid(self, path):
         mimetype, _ = mimetypes.guess_type(path)
@@ -37,12 +58,15 @@ class DeployToolsBinary(tools.binary.DeployToolsBinary):
         if mimetype == 'application/x-msdownload':
             return True
 
-        if mimetype != 'application/octet-stream':
+        # Non Windows hosts can also report DLLs as MS-DOS programs, check
+        # the magic bytes for these.
+        if not mimetype in ['application/x-msdos-program',
+                            'application/octet-stream']:
             return False
 
         with open(path, 'rb') as f:
             if f.read(2) != b'MZ':
-                return []
+                return False
 
             f.seek(0x3c, os.SEEK_SET)
             peHeaderOffset = struct.unpack('I', f.read(4))
@@ -54,125 +78,334 @@ class DeployToolsBinary(tools.binary.DeployToolsBinary):
 
         return True
 
+    @staticmethod
+    def readString(data, offset):
+        end = data.find(b'\x00', offset)
+
+        if end < 0:
+            end = len(data)
+
+        return data[offset: end].decode(sys.getdefaultencoding())
+
+    @staticmethod
+    def readPeHeader(data):
+        # Check DOS header signature.
+        if len(data) < 0x40 or data[: 2] != b'MZ':
+            return {}
+
+        # Move to COFF header.
+        peHeaderOffset, = struct.unpack_from('<I', data, 0x3c)
+
+        # Check COFF header signature.
+        if data[peHeaderOffset: peHeaderOffset + 4] != b'PE\x00\x00':
+            return {}
+
+        # Read COFF header.
+        coffHeaderOffset = peHeaderOffset + 4
+
+        if coffHeaderOffset + 22 > len(data):
+            return {}
+
+        _, nSections, _, _, _, optionalHeaderSize, _ = \
+            struct.unpack_from('<HHIIIHH', data, coffHeaderOffset)
+        optionalHeaderOffset = coffHeaderOffset + 20
+
+        # Read magic signature in standard COFF fields.
+        magic, = struct.unpack_from('<H', data, optionalHeaderOffset)
+
+        if magic == 0x10b:
+            imageBase, = struct.unpack_from('<I', data, optionalHeaderOffset + 28)
+            dataDirectoriesOffset = optionalHeaderOffset + 96
+        elif magic == 0x20b:
+            imageBase, = struct.unpack_from('<Q', data, optionalHeaderOffset + 24)
+            dataDirectoriesOffset = optionalHeaderOffset + 112
+        else:
+            return {}
+
+        nDataDirectories, = struct.unpack_from('<I', data, dataDirectoriesOffset - 4)
+        dataDirectoriesEnd = optionalHeaderOffset + optionalHeaderSize
+        nDataDirectories = min(nDataDirectories,
+                               (dataDirectoriesEnd - dataDirectoriesOffset) // 8)
+
+        if nDataDirectories < 0 or dataDirectoriesEnd > len(data):
+            return {}
+
+        # Each data directory is read as:
+        #
+        # (rva, size)
+        dataDirectories = \
+            list(struct.iter_unpack('<II',
+                                    data[dataDirectoriesOffset: dataDirectoriesOffset + 8 * nDataDirectories]))
+
+        return {'imageBase': imageBase,
+                'nSections': nSections,
+                'sectionTableOffset': dataDirectoriesEnd,
+                'dataDirectories': dataDirectories}
+
+    @staticmethod
+    def readSections(data, header):
+        # Build a table for translating RVAs to file offsets, sorted by the
+        # section address. Each entry is read as:
+        #
+        # (virtualAddress, virtualSize, rawDataOffset, rawDataSize)
+        sectionFormat = '<8sIIIIIIHHI'
+        entrySize = struct.calcsize(sectionFormat)
+        sectionTableOffset = header['sectionTableOffset']
+        sectionTableEnd = sectionTableOffset + header['nSections'] * entrySize
+
+        if sectionTableEnd > len(data):
+            return []
+
+        sections = []
+
+        for section in struct.iter_unpack(sectionFormat,
+                                          data[sectionTableOffset: sectionTableEnd]):
+            _, virtualSize, virtualAddress, rawDataSize, rawDataOffset = section[: 5]
+
+            if virtualSize < 1:
+                virtualSize = rawDataSize
+
+            sections.append((virtualAddress, virtualSize, rawDataOffset, rawDataSize))
+
+        return sorted(sections)
+
+    @staticmethod
+    def rvaToOffset(sections, addresses, rva):
+        i = bisect.bisect_right(addresses, rva) - 1
+
+        if i < 0:
+            return -1
+
+        virtualAddress, virtualSize, rawDataOffset, rawDataSize = sections[i]
+        offset = rva - virtualAddress
+
+        if offset >= virtualSize or offset >= rawDataSize:
+            return -1
+
+        return rawDataOffset + offset
+
+    def readDirectoryTable(self, data, sections, addresses, rva, entryFormat):
+        # Returns the entries of a table ending with a null entry.
+        offset = self.rvaToOffset(sections, addresses, rva)
+
+        if offset < 0:
+            return []
+
+        # The table can't go beyond the end of the section containing it.
+        _, _, rawDataOffset, rawDataSize = \
+            sections[bisect.bisect_right(addresses, rva) - 1]
+        entrySize = struct.calcsize(entryFormat)
+        tableEnd = min(rawDataOffset + rawDataSize, len(data))
+        tableEnd -= (tableEnd - offset) % entrySize
+        entries = []
+
+        for entry in struct.iter_unpack(entryFormat, data[offset: tableEnd]):
+            if not any(entry):
+                break
+
+            entries.append(entry)
+
+        return entries
+
+    def dumpData(self, data):
+        # Data directories
+        IMAGE_DIRECTORY_ENTRY_IMPORT = 1
+        IMAGE_DIRECTORY_ENTRY_DELAY_IMPORT = 13
+
+        # Delay load attributes
+        DLATTR_RVA = 0x1
+
+        header = self.readPeHeader(data)
+
+        if not header:
+            return set()
+
+        sections = self.readSections(data, header)
+        addresses = [section[0] for section in sections]
+        dataDirectories = header['dataDirectories']
+        nameRvas = set()
+
+        if len(dataDirectories) > IMAGE_DIRECTORY_ENTRY_IMPORT:
+            importTableRva, importTableSize = dataDirectories[IMAGE_DIRECTORY_ENTRY_IMPORT]
+
+            if importTableRva > 0 and importTableSize > 0:
+                # Each entry is read as:
+                #
+                # (importLookupTable, timeDateStamp, forwarderChain, name, importAddressTable)
+                for entry in self.readDirectoryTable(data,
+                                                     sections,
+                                                     addresses,
+                                                     importTableRva,
+                                                     '<IIIII'):
+                    nameRvas.add(entry[3])
+
+        if len(dataDirectories) > IMAGE_DIRECTORY_ENTRY_DELAY_IMPORT:
+            delayTableRva, delayTableSize = dataDirectories[IMAGE_DIRECTORY_ENTRY_DELAY_IMPORT]
+
+            if delayTableRva > 0 and delayTableSize > 0:
+                # Each entry is read as:
+                #
+                # (attributes, name, moduleHandle, importAddressTable,
+                #  importNameTable, boundImportAddressTable,
+                #  unloadInformationTable, timeDateStamp)
+                for entry in self.readDirectoryTable(data,
+                                                     sections,
+                                                     addresses,
+                                                     delayTableRva,
+                                                     '<IIIIIIII'):
+                    nameRva = entry[1]
+
+                    # Old linkers store virtual addresses instead of RVAs.
+                    if not entry[0] & DLATTR_RVA:
+                        nameRva -= header['imageBase']
+
+                    nameRvas.add(nameRva)
+
+        dllImports = set()
+
+        for nameRva in nameRvas:
+            offset = self.rvaToOffset(sections, addresses, nameRva)
+
+            if offset < 0:
+                continue
+
+            try:
+                dllImports.add(self.readString(data, offset))
+            except:
+                pass
+
+        return dllImports
+
     # https://msdn.microsoft.com/en-us/library/windows/desktop/ms680547(v=vs.85).aspx
     # https://upload.wikimedia.org/wikipedia/commons/1/1b/Portable_Executable_32_bit_Structure_in_SVG_fixed.svg
-    def dump(self, binary):
-        dllImports = set()
+    # https://docs.microsoft.com/en-us/windows/win32/debug/pe-format#delay-load-import-tables-image-only
+    def dumpBinary(self, binary):
+        try:
+            with open(binary, 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    return self.dumpData(data)
+        except:
+            pass
 
-        if not os.path.exists(binary) or not os.path.isfile(binary):
-            return dllImports
+        return set()
 
-        with open(binary, 'rb') as f:
-            # Check DOS header signature.
-            if f.read(2) != b'MZ':
-                return []
+    def resolutionContext(self):
+        return super().resolutionContext() + (tuple(self.sysBinsPath),)
 
-            # Move to COFF header.
-            f.seek(0x3c, os.SEEK_SET)
-            peHeaderOffset = struct.unpack('I', f.read(4))
-            f.seek(peHeaderOffset[0], os.SEEK_SET)
-            peSignatue = f.read(4)
+    def listDir(self, dlldir):
+        # Maps the lowercase file names in the directory to the real ones.
+        # The directory is listed again if it was modified since the last
+        # time.
+        try:
+            mtime = os.stat(dlldir).st_mtime_ns
+        except:
+            return {}
 
-            # Check COFF header signature.
-            if peSignatue != b'PE\x00\x00':
-                return []
+        if dlldir in self.dirIndex and self.dirIndex[dlldir][0] == mtime:
+            return self.dirIndex[dlldir][1]
 
-            # Read COFF header.
-            coffHeader = struct.unpack('HHIIIHH', f.read(20))
-            nSections = coffHeader[1]
-            sectionTablePos = coffHeader[5] + f.tell()
+        names = {}
 
-            # Read magic signature in standard COFF fields.
-            peType = 'PE32' if f.read(2) == b'\x0b\x01' else 'PE32+'
+        try:
+            with os.scandir(dlldir) as entries:
+                for entry in entries:
+                    name = entry.name.lower()
 
-            # Move to data directories.
-            f.seek(102 if peType == 'PE32' else 118, os.SEEK_CUR)
+                    if not name in names:
+                        names[name] = entry.name
+        except:
+            pass
 
-            # Read the import table.
-            importTablePos, importTableSize = struct.unpack('II', f.read(8))
+        self.dirIndex[dlldir] = (mtime, names)
 
-            # Move to Sections table.
-            f.seek(sectionTablePos, os.SEEK_SET)
-            sections = []
-            idataTablePhysical = -1
+        return names
 
-            # Search for 'idata' section.
-            for _ in range(nSections):
-                # Read section.
-                section = struct.unpack('8pIIIIIIHHI', f.read(40))
-                sectionName = section[0].replace(b'\x00', b'')
+    def updateDllIndex(self):
+        # Rebuild the index only when the search paths change.
+        context = tuple(self.sysBinsPath)
 
-                # Save a reference to the sections.
-                sections += [section]
+        if context == self.dllIndexContext:
+            return False
 
-                if sectionName == b'idata' or sectionName == b'rdata':
-                    idataTablePhysical = section[4]
+        with self.dllIndexMutex:
+            if context == self.dllIndexContext:
+                return False
 
-                    # If import table was defined calculate it's position in
-                    # the file in relation to the address given by 'idata'.
-                    if importTableSize > 0:
-                        idataTablePhysical += importTablePos - section[2]
+            index = {}
 
-            if idataTablePhysical < 0:
-                return []
+            for dlldir in self.sysBinsPath:
+                names = self.listDir(dlldir)
 
-            # Move to 'idata' section.
-            f.seek(idataTablePhysical, os.SEEK_SET)
-            dllList = set()
+                for name in names:
+                    if not name in index:
+                        index[name] = os.path.join(dlldir, names[name])
 
-            # Read 'idata' directory table.
-            while True:
-                # Read DLL entries.
-                try:
-                    dllImport = struct.unpack('IIIII', f.read(20))
-                except:
-                    break
+            self.dllIndex = index
+            self.dllIndexContext = context
 
-                # Null directory entry.
-                if dllImport[0] | dllImport[1] | dllImport[2] | dllImport[3] | dllImport[4] == 0:
-                    break
+        return True
 
-                # Locate where is located the DLL name in relation to the
-                # sections.
-                for section in sections:
-                    if dllImport[3] >= section[2] \
-                        and dllImport[3] < section[1] + section[2]:
-                        dllList.add(dllImport[3] - section[2] + section[4])
+    def dllPath(self, dll, binaryDir=''):
+        # DLL names are case insensitive in Windows. The DLLs are searched
+        # first in the directory of the binary importing them, then in the
+        # system paths.
+        name = dll.lower()
 
-                        break
+        if len(binaryDir) > 0:
+            names = self.listDir(binaryDir)
 
-            for dll in dllList:
-                # Move to DLL name.
-                f.seek(dll, os.SEEK_SET)
-                dllName = b''
+            if name in names:
+                return os.path.join(binaryDir, names[name])
 
-                # Read string until null character.
-                while True:
-                    c = f.read(1)
+        self.updateDllIndex()
 
-                    if c == b'\x00':
-                        break
+        if name in self.dllIndex:
+            return self.dllIndex[name]
 
-                    dllName += c
+        return ''
 
-                try:
-                    dllImports.add(dllName.decode(sys.getdefaultencoding()))
-                except:
-                    pass
+    def readSystemDllsList(self, dllsList):
+        # The system DLLs are not available when cross deploying, the
+        # imports that can't be found are matched by name against this list
+        # before reporting them as unresolved.
+        patterns = self.readPatterns(dllsList)
 
-        return dllImports
+        if len(patterns) < 1:
+            self.systemDllsRegex = None
+        else:
+            self.systemDllsRegex = \
+                re.compile('|'.join(['(?:{})'.format(pattern) for pattern in patterns]),
+                           re.IGNORECASE)
 
-    def dependencies(self, binary):
+    def isSystemDll(self, dll):
+        if self.isExcluded(dll):
+            return True
+
+        return self.systemDllsRegex is not None \
+               and self.systemDllsRegex.fullmatch(dll) is not None
+
+    def resolveImports(self, binary):
         deps = []
+        binaryDir = os.path.dirname(binary)
 
         for dep in self.dump(binary):
-            depPath = self.whereBin(dep)
-
-            if len(depPath) > 0 and not self.isExcluded(depPath):
-                deps.append(depPath)
+            depPath = self.dllPath(dep, binaryDir)
+
+            if len(depPath) < 1:
+                # API sets are virtual DLLs, these never exist in the disk.
+                # The system DLLs are not found when cross deploying, these
+                # are matched by name.
+                if not dep.lower().startswith(('api-ms-win-', 'ext-ms-')) \
+                    and not self.isSystemDll(os.path.basename(dep)):
+                    deps.append((dep, ''))
+            elif not self.isExcluded(depPath):
+                deps.append((dep, depPath))
 
         return deps
 
+    def searchDirs(self, binary):
+        return [os.path.dirname(binary)] + self.sysBinsPath
+
     def name(self, binary):
         dep = os.path.basename(binary)
 
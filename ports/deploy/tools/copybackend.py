@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Webcamoid, webcam capture application.
+# Copyright (C) 2017  Gonzalo Exequiel Pedone
+#
+# Webcamoid is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Webcamoid is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Webcamoid. If not, see <http://www.gnu.org/licenses/>.
+#
+# Web-Site: http://webcamoid.github.io/
+
+import os
+import shutil
+import sys
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# Copies regular files using the fastest method supported between the source
+# and destination file systems.
+#
+# The methods are tried in this order:
+#
+# reflink: the destination shares the blocks of the source (Btrfs, XFS).
+# copy_file_range: the kernel copies the data, without passing it through
+#                  user space, and may use server side copies (NFS, CIFS).
+# hardlink: the destination is the same file as the source. It's only used
+#           if DEPLOY_COPY_HARDLINKS=1, since modifying the deployed file
+#           would modify the source too.
+# userspace: a regular copy.
+#
+# A method that fails is not tried again for the same pair of devices.
+class CopyBackend:
+    # linux/fs.h
+    FICLONE = 0x40049409
+
+    def __init__(self):
+        self.methods = []
+
+        # FICLONE is a Linux ioctl, other systems could use the same number
+        # for something else.
+        if fcntl \
+            and hasattr(fcntl, 'ioctl') \
+            and sys.platform.startswith('linux'):
+            self.methods.append('reflink')
+
+        if hasattr(os, 'copy_file_range'):
+            self.methods.append('copy_file_range')
+
+        if 'DEPLOY_COPY_HARDLINKS' in os.environ \
+            and os.environ['DEPLOY_COPY_HARDLINKS'] == '1':
+            self.methods.append('hardlink')
+
+        self.methods.append('userspace')
+        self.deviceMethods = {}
+        self.files = {}
+        self.bytes = {}
+        self.mutex = threading.Lock()
+
+    def reflink(self, src, dst):
+        with open(src, 'rb') as fsrc:
+            with open(dst, 'wb') as fdst:
+                fcntl.ioctl(fdst.fileno(), self.FICLONE, fsrc.fileno())
+
+        shutil.copymode(src, dst)
+
+    @staticmethod
+    def copyFileRange(src, dst):
+        with open(src, 'rb') as fsrc:
+            with open(dst, 'wb') as fdst:
+                remaining = os.fstat(fsrc.fileno()).st_size
+
+                while remaining > 0:
+                    copied = os.copy_file_range(fsrc.fileno(),
+                                                fdst.fileno(),
+                                                remaining)
+
+                    if copied < 1:
+                        raise OSError('copy_file_range stopped before the end of the file')
+
+                    remaining -= copied
+
+        shutil.copymode(src, dst)
+
+    @staticmethod
+    def hardlink(src, dst):
+        os.link(src, dst)
+
+    @staticmethod
+    def userspace(src, dst):
+        shutil.copy(src, dst)
+
+    def copyWith(self, method, src, dst):
+        if method == 'reflink':
+            self.reflink(src, dst)
+        elif method == 'copy_file_range':
+            self.copyFileRange(src, dst)
+        elif method == 'hardlink':
+            self.hardlink(src, dst)
+        else:
+            self.userspace(src, dst)
+
+    def copy(self, src, dst):
+        # Copy the regular file src to dst, dst must not exist.
+        try:
+            size = os.path.getsize(src)
+            device = (os.stat(src).st_dev,
+                      os.stat(os.path.dirname(os.path.abspath(dst))).st_dev)
+        except:
+            return False
+
+        with self.mutex:
+            if not device in self.deviceMethods:
+                self.deviceMethods[device] = list(self.methods)
+
+            methods = list(self.deviceMethods[device])
+
+        for method in methods:
+            try:
+                self.copyWith(method, src, dst)
+            except:
+                if method == 'userspace':
+                    return False
+
+                # Don't try this method again for the same file systems.
+                with self.mutex:
+                    if method in self.deviceMethods[device]:
+                        self.deviceMethods[device].remove(method)
+
+                try:
+                    if os.path.lexists(dst):
+                        os.remove(dst)
+                except:
+                    return False
+
+                continue
+
+            with self.mutex:
+                if not method in self.files:
+                    self.files[method] = 0
+                    self.bytes[method] = 0
+
+                self.files[method] += 1
+                self.bytes[method] += size
+
+            return True
+
+        return False
+
+    def stats(self):
+        return [(method, self.files[method], self.bytes[method])
+                for method in self.methods if method in self.files]
+
+
+# Result of a copy or move operation. Evaluates to True if no file failed.
+class CopyResult:
+    def __init__(self, copied=0, skipped=0, failed=0, copiedBytes=0, skippedBytes=0):
+        self.copied = copied
+        self.skipped = skipped
+        self.failed = failed
+        self.copiedBytes = copiedBytes
+        self.skippedBytes = skippedBytes
+        self.elapsed = 0
+
+    def __bool__(self):
+        return self.failed < 1
+
+    def update(self, result):
+        self.copied += result.copied
+        self.skipped += result.skipped
+        self.failed += result.failed
+        self.copiedBytes += result.copiedBytes
+        self.skippedBytes += result.skippedBytes
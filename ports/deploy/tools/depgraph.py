@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Webcamoid, webcam capture application.
+# Copyright (C) 2017  Gonzalo Exequiel Pedone
+#
+# Webcamoid is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Webcamoid is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Webcamoid. If not, see <http://www.gnu.org/licenses/>.
+#
+# Web-Site: http://webcamoid.github.io/
+
+import json
+import os
+import threading
+
+import tools.utils
+
+
+# Graph of the binaries dependencies.
+#
+# Nodes are binaries and libraries, and each edge goes from a binary to a
+# library it imports, labeled with the name used to import it (DT_NEEDED,
+# DLL name or install name). Imports that could not be found are stored as
+# edges to an empty path.
+#
+# The edges of a binary are reused only if the binary, the libraries it was
+# resolved to and the directories searched to resolve them didn't change.
+class DependencyGraph:
+    # Increase this value every time the format of the saved graph changes.
+    version = 3
+
+    def __init__(self):
+        self.context = None
+        self.roots = set()
+        self.edges = {}
+        self.signatures = {}
+        self.hashes = {}
+        self.targets = {}
+        self.searchDirs = {}
+        self.solved = 0
+        self.reused = 0
+        self.reusedByHash = 0
+        self.mutex = threading.Lock()
+
+    @staticmethod
+    def signature(path):
+        try:
+            st = os.stat(path)
+        except:
+            return None
+
+        return st.st_size, st.st_mtime_ns
+
+    @staticmethod
+    def dirMtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except:
+            return -1
+
+    def clear(self):
+        with self.mutex:
+            self.roots = set()
+            self.edges = {}
+            self.signatures = {}
+            self.hashes = {}
+            self.targets = {}
+            self.searchDirs = {}
+
+    def setContext(self, context):
+        # The resolved edges are only valid for the same search paths and
+        # exclude list they were solved with.
+        context = json.dumps(context)
+
+        if context != self.context:
+            self.clear()
+            self.context = context
+
+    def setRoots(self, binaries):
+        with self.mutex:
+            self.roots = set(binaries)
+
+    def isSolved(self, binary):
+        with self.mutex:
+            if not binary in self.edges:
+                return False
+
+            signature = self.signatures[binary]
+            fileHash = self.hashes[binary] if binary in self.hashes else ''
+            targets = self.targets[binary]
+            searchDirs = self.searchDirs[binary]
+
+        # A library was replaced, or one was added to or removed from a
+        # directory that was searched, so the imports could be resolved to
+        # other files now.
+        for dep in targets:
+            if self.signature(dep) != targets[dep]:
+                return False
+
+        for libdir in searchDirs:
+            if self.dirMtime(libdir) != searchDirs[libdir]:
+                return False
+
+        currentSignature = self.signature(binary)
+
+        if currentSignature is None:
+            return False
+
+        if signature == currentSignature:
+            with self.mutex:
+                self.reused += 1
+
+            return True
+
+        # The file was touched, but if the contents are still the same
+        # (i.e. it was reinstalled) the dependencies are still valid.
+        if len(fileHash) < 1 \
+            or fileHash != tools.utils.DeployToolsUtils.sha256sum(binary):
+            return False
+
+        with self.mutex:
+            self.signatures[binary] = currentSignature
+            self.reusedByHash += 1
+
+        return True
+
+    def setDependencies(self, binary, imports, searchDirs=()):
+        signature = self.signature(binary)
+        imports = list(imports)
+        targets = {dep: self.signature(dep) for _, dep in imports if len(dep) > 0}
+        searchDirs = {libdir: self.dirMtime(libdir) for libdir in searchDirs}
+
+        with self.mutex:
+            self.edges[binary] = imports
+            self.signatures[binary] = signature
+            self.targets[binary] = targets
+            self.searchDirs[binary] = searchDirs
+            self.solved += 1
+
+            if binary in self.hashes:
+                del self.hashes[binary]
+
+    def dependencies(self, binary):
+        with self.mutex:
+            if not binary in self.edges:
+                return []
+
+            return [dep for _, dep in self.edges[binary] if len(dep) > 0]
+
+    def reasons(self, lib):
+        reasons = []
+
+        with self.mutex:
+            for binary in self.edges:
+                for name, dep in self.edges[binary]:
+                    if dep == lib:
+                        reasons.append((binary, name))
+
+        return sorted(reasons)
+
+    def reachable(self):
+        # Returns the part of the graph reachable from the binaries found in
+        # the last scan.
+        nodes = set(self.roots)
+        binaries = list(self.roots)
+
+        while len(binaries) > 0:
+            binary = binaries.pop()
+
+            if not binary in self.edges:
+                continue
+
+            for _, dep in self.edges[binary]:
+                if len(dep) > 0 and not dep in nodes:
+                    nodes.add(dep)
+                    binaries.append(dep)
+
+        return nodes
+
+    def unresolved(self):
+        unresolved = {}
+
+        with self.mutex:
+            for binary in self.reachable():
+                if not binary in self.edges:
+                    continue
+
+                for name, dep in self.edges[binary]:
+                    if len(dep) < 1:
+                        if not name in unresolved:
+                            unresolved[name] = []
+
+                        unresolved[name].append(binary)
+
+        return {name: sorted(unresolved[name]) for name in unresolved}
+
+    def toDict(self):
+        with self.mutex:
+            nodes = self.reachable()
+            edges = []
+
+            for binary in nodes:
+                if not binary in self.edges:
+                    continue
+
+                for name, dep in self.edges[binary]:
+                    if len(dep) > 0:
+                        edges.append({'from': binary, 'to': dep, 'import': name})
+
+            return {'nodes': [{'path': node, 'root': node in self.roots}
+                              for node in sorted(nodes)],
+                    'edges': sorted(edges,
+                                    key=lambda edge: (edge['from'], edge['to']))}
+
+    def load(self, path):
+        self.clear()
+
+        try:
+            with open(path) as f:
+                graph = json.load(f)
+
+            if graph['version'] != self.version:
+                return False
+
+            with self.mutex:
+                self.context = graph['context']
+
+                for binary in graph['nodes']:
+                    node = graph['nodes'][binary]
+                    self.edges[binary] = [tuple(edge) for edge in node['imports']]
+                    self.signatures[binary] = tuple(node['signature'])
+                    self.targets[binary] = \
+                        {dep: tuple(signature) if signature else None
+                         for dep, signature in node['targets'].items()}
+                    self.searchDirs[binary] = node['searchDirs']
+
+                    if len(node['hash']) > 0:
+                        self.hashes[binary] = node['hash']
+        except:
+            self.clear()
+
+            return False
+
+        return True
+
+    def save(self, path):
+        # Store the content hash of the scanned binaries, these are
+        # reinstalled on every deploy so the signature alone would be useless.
+        for binary in self.roots:
+            if binary in self.edges and not binary in self.hashes:
+                try:
+                    self.hashes[binary] = tools.utils.DeployToolsUtils.sha256sum(binary)
+                except:
+                    pass
+
+        nodes = {}
+
+        for binary in self.edges:
+            if self.signatures[binary] is None:
+                continue
+
+            nodes[binary] = {'signature': self.signatures[binary],
+                             'hash': self.hashes[binary] if binary in self.hashes else '',
+                             'imports': self.edges[binary],
+                             'targets': self.targets[binary],
+                             'searchDirs': self.searchDirs[binary]}
+
+        dirname = os.path.dirname(path)
+
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        with open(path, 'w') as f:
+            json.dump({'version': self.version,
+                       'context': self.context,
+                       'nodes': nodes}, f)
+
+    def stats(self):
+        return 'Dependency graph: {} binaries solved, ' \
+               '{} reused, {} reused after matching the content hash'.format(self.solved,
+                                                                              self.reused,
+                                                                              self.reusedByHash)
+
+    def writeJson(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.toDict(), f, indent=4)
+
+    def writeDot(self, path):
+        graph = self.toDict()
+
+        with open(path, 'w') as f:
+            f.write('digraph dependencies {\n')
+
+            for node in graph['nodes']:
+                shape = 'box' if node['root'] else 'ellipse'
+                f.write('    {} [shape={}];\n'.format(json.dumps(node['path']),
+                                                      shape))
+
+            for edge in graph['edges']:
+                f.write('    {} -> {} [label={}];\n'.format(json.dumps(edge['from']),
+                                                             json.dumps(edge['to']),
+                                                             json.dumps(edge['import'])))
+
+            f.write('}\n')
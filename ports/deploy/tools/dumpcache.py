@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Webcamoid, webcam capture application.
+# Copyright (C) 2017  Gonzalo Exequiel Pedone
+#
+# Webcamoid is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Webcamoid is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Webcamoid. If not, see <http://www.gnu.org/licenses/>.
+#
+# Web-Site: http://webcamoid.github.io/
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+# Persistent cache of the binaries information returned by
+# DeployToolsBinary.dump(), shared by all the binary formats.
+#
+# Entries are indexed by the real path of the binary and are only valid while
+# the device, inode, size and modification time of the file stays the same.
+class DumpCache:
+    # Increase this value every time the format of the dumps changes.
+    version = 3
+
+    def __init__(self, cacheFile, maxSize=32 * 1024 * 1024):
+        self.cacheFile = cacheFile
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        self.used = {}
+        self.mutex = threading.Lock()
+        self.db = None
+
+        try:
+            cacheDir = os.path.dirname(cacheFile)
+
+            if not os.path.exists(cacheDir):
+                os.makedirs(cacheDir)
+
+            self.db = sqlite3.connect(cacheFile, check_same_thread=False)
+
+            if self.db.execute('PRAGMA user_version').fetchone()[0] != self.version:
+                self.db.execute('DROP TABLE IF EXISTS dumps')
+                self.db.execute('PRAGMA user_version = {}'.format(self.version))
+
+            self.db.execute('CREATE TABLE IF NOT EXISTS dumps ('
+                            'path TEXT NOT NULL, '
+                            'format TEXT NOT NULL, '
+                            'dev INTEGER, '
+                            'ino INTEGER, '
+                            'size INTEGER, '
+                            'mtime INTEGER, '
+                            'data TEXT, '
+                            'used INTEGER, '
+                            'PRIMARY KEY (path, format))')
+            self.db.commit()
+        except:
+            self.db = None
+
+    @staticmethod
+    def fileKey(path):
+        try:
+            realPath = os.path.realpath(path)
+            st = os.stat(realPath)
+        except:
+            return None
+
+        return realPath, st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+    @staticmethod
+    def encode(info):
+        return json.dumps(info,
+                          default=lambda obj: {'__set__': sorted(obj)})
+
+    @staticmethod
+    def decode(data):
+        return json.loads(data,
+                          object_hook=lambda obj: set(obj['__set__']) if '__set__' in obj else obj)
+
+    def get(self, binaryFormat, path):
+        if not self.db:
+            return None
+
+        key = self.fileKey(path)
+
+        if not key:
+            return None
+
+        with self.mutex:
+            row = self.db.execute('SELECT dev, ino, size, mtime, data FROM dumps '
+                                  'WHERE path = ? AND format = ?',
+                                  (key[0], binaryFormat)).fetchone()
+
+            if not row or tuple(row[: 4]) != key[1:]:
+                self.misses += 1
+
+                return None
+
+            self.hits += 1
+            self.used[(key[0], binaryFormat)] = time.time_ns()
+
+        return self.decode(row[4])
+
+    def set(self, binaryFormat, path, info):
+        if not self.db:
+            return
+
+        key = self.fileKey(path)
+
+        if not key:
+            return
+
+        with self.mutex:
+            self.db.execute('INSERT OR REPLACE INTO dumps VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                            (key[0], binaryFormat) + key[1:] + (self.encode(info), time.time_ns()))
+
+    def evict(self):
+        # Remove the least recently used entries until the cache fits in
+        # maxSize.
+        totalSize = self.db.execute('SELECT SUM(LENGTH(data)) FROM dumps').fetchone()[0]
+
+        if not totalSize or totalSize <= self.maxSize:
+            return 0
+
+        evicted = []
+
+        for path, binaryFormat, size in self.db.execute('SELECT path, format, LENGTH(data) FROM dumps '
+                                                        'ORDER BY used ASC').fetchall():
+            if totalSize <= self.maxSize:
+                break
+
+            evicted.append((path, binaryFormat))
+            totalSize -= size
+
+        self.db.executemany('DELETE FROM dumps WHERE path = ? AND format = ?', evicted)
+
+        return len(evicted)
+
+    def close(self):
+        if not self.db:
+            return
+
+        with self.mutex:
+            try:
+                self.db.executemany('UPDATE dumps SET used = ? WHERE path = ? AND format = ?',
+                                    [(self.used[key],) + key for key in self.used])
+                self.evict()
+                self.db.commit()
+            except:
+                pass
+
+            self.db.close()
+            self.db = None
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Webcamoid, webcam capture application.
+# Copyright (C) 2017  Gonzalo Exequiel Pedone
+#
+# Webcamoid is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Webcamoid is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Webcamoid. If not, see <http://www.gnu.org/licenses/>.
+#
+# Web-Site: http://webcamoid.github.io/
+
+import bisect
+import concurrent.futures
+import json
+import os
+import stat
+import threading
+
+import tools.utils
+
+
+# List of the files placed in the staging directory.
+#
+# Each file is recorded when it's placed in the staging directory, with its
+# path (relative to the staging directory), size, permissions, hash and
+# origin. The output of make install is recorded by walking it once, and
+# the files copied or moved by the deploy are recorded by copy() and
+# move(). Files without origin were installed by the build system or
+# written by the deploy scripts. refresh() updates the entries of the files
+# modified or removed after being recorded, without walking the staging
+# directory again.
+class StagingManifest:
+    # Increase this value every time the format of the manifest changes.
+    version = 1
+
+    def __init__(self, rootDir, njobs=4):
+        self.rootDir = rootDir
+        self.njobs = njobs
+        self.recordedDirs = set()
+        self.directories = []
+        self.entries = {}
+        self.origins = []
+        self.previous = {}
+        self.hashed = 0
+        self.reused = 0
+        self.mutex = threading.Lock()
+
+    def relativePath(self, path):
+        path = os.path.relpath(os.path.abspath(path),
+                               os.path.abspath(self.rootDir))
+
+        if path == os.curdir or path.startswith(os.pardir):
+            return ''
+
+        return path
+
+    def record(self, path, origin=''):
+        path = self.relativePath(path)
+
+        if len(path) < 1:
+            return
+
+        try:
+            st = os.lstat(os.path.join(self.rootDir, path))
+        except:
+            return
+
+        if stat.S_ISDIR(st.st_mode):
+            with self.mutex:
+                self.recordedDirs.add(path)
+
+            return
+
+        if len(origin) > 0:
+            origin = os.path.abspath(origin)
+            originPath = self.relativePath(origin)
+
+            # A file moved inside the staging directory keeps its origin.
+            with self.mutex:
+                if originPath in self.entries:
+                    origin = self.entries[originPath]['origin']
+
+        entry = self.fileEntry(path, st, origin)
+
+        with self.mutex:
+            self.entries[path] = entry
+
+    def recordTree(self):
+        # Record all the files in the staging directory, this is only
+        # needed for the files installed by make install.
+        dirs, files = tools.utils.DeployToolsUtils.listTree(self.rootDir)
+
+        with self.mutex:
+            self.recordedDirs.update(dirs)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.njobs) as executor:
+            for f, _ in files:
+                executor.submit(self.record, os.path.join(self.rootDir, f))
+
+    def load(self, path):
+        # Read a previous manifest, the hashes of the files that didn't
+        # change are reused.
+        try:
+            with open(path) as f:
+                manifest = json.load(f)
+
+            if manifest['version'] == self.version \
+                and manifest['root'] == self.rootDir:
+                self.previous = {entry['path']: entry for entry in manifest['files']}
+        except:
+            self.previous = {}
+
+    def fileEntry(self, path, st, origin):
+        entry = {'path': path,
+                 'size': st.st_size,
+                 'mode': stat.S_IMODE(st.st_mode),
+                 'mtime': st.st_mtime_ns,
+                 'hash': '',
+                 'origin': origin}
+        absPath = os.path.join(self.rootDir, path)
+
+        if stat.S_ISLNK(st.st_mode):
+            entry['size'] = 0
+            entry['target'] = os.readlink(absPath)
+
+            return entry
+
+        if path in self.previous:
+            previous = self.previous[path]
+
+            if previous['size'] == entry['size'] \
+                and previous['mtime'] == entry['mtime'] \
+                and len(previous['hash']) > 0:
+                entry['hash'] = previous['hash']
+
+                with self.mutex:
+                    self.reused += 1
+
+                return entry
+
+        try:
+            entry['hash'] = tools.utils.DeployToolsUtils.sha256sum(absPath)
+        except:
+            pass
+
+        with self.mutex:
+            self.hashed += 1
+
+        return entry
+
+    def refreshEntry(self, entry):
+        # Returns the entry of the file as it's now, or None if it was
+        # removed.
+        absPath = os.path.join(self.rootDir, entry['path'])
+
+        try:
+            st = os.lstat(absPath)
+        except:
+            return None
+
+        if stat.S_ISDIR(st.st_mode):
+            return None
+
+        if not stat.S_ISLNK(st.st_mode) \
+            and not 'target' in entry \
+            and st.st_size == entry['size'] \
+            and st.st_mtime_ns == entry['mtime']:
+            entry['mode'] = stat.S_IMODE(st.st_mode)
+
+            return entry
+
+        return self.fileEntry(entry['path'], st, entry['origin'])
+
+    def refresh(self):
+        # Update the files stripped, rewritten or removed after being
+        # recorded.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.njobs) as executor:
+            entries = [entry
+                       for entry in executor.map(self.refreshEntry,
+                                                 list(self.entries.values()))
+                       if entry]
+
+        dirs = set()
+        paths = [d for d in self.recordedDirs
+                 if os.path.isdir(os.path.join(self.rootDir, d))]
+        paths += [os.path.dirname(entry['path']) for entry in entries]
+
+        # Add the parent directories of all the files and directories.
+        for path in paths:
+            while len(path) > 0 and not path in dirs:
+                dirs.add(path)
+                path = os.path.dirname(path)
+
+        self.entries = {entry['path']: entry for entry in entries}
+        self.directories = sorted(dirs)
+        self.origins = sorted(set([entry['origin']
+                                   for entry in entries
+                                   if len(entry['origin']) > 0]))
+
+    def hasOrigin(self, path):
+        # Returns True if path, or a file inside of it, was copied to the
+        # staging directory.
+        path = os.path.abspath(path)
+        i = bisect.bisect_left(self.origins, path)
+
+        if i < len(self.origins) and self.origins[i] == path:
+            return True
+
+        prefix = os.path.join(path, '')
+        i = bisect.bisect_left(self.origins, prefix)
+
+        return i < len(self.origins) and self.origins[i].startswith(prefix)
+
+    def files(self, subdir=''):
+        # Returns the files inside subdir, sorted by path.
+        prefix = os.path.join(subdir, '') if len(subdir) > 0 else ''
+
+        return [self.entries[path]
+                for path in sorted(self.entries)
+                if path.startswith(prefix)]
+
+    def dirs(self, subdir=''):
+        prefix = os.path.join(subdir, '') if len(subdir) > 0 else ''
+
+        return [path for path in self.directories if path.startswith(prefix)]
+
+    def paths(self):
+        # Returns all the directories and files, sorted so every directory
+        # comes before its contents.
+        return sorted(self.directories + list(self.entries))
+
+    def size(self, subdir=''):
+        return sum([entry['size'] for entry in self.files(subdir)])
+
+    def stats(self):
+        return 'Staging manifest: {} files, {} hashed, ' \
+               '{} hashes reused'.format(len(self.entries),
+                                         self.hashed,
+                                         self.reused)
+
+    def writeJson(self, path):
+        dirname = os.path.dirname(path)
+
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        with open(path, 'w') as f:
+            json.dump({'version': self.version,
+                       'root': self.rootDir,
+                       'directories': self.directories,
+                       'files': self.files()},
+                      f,
+                      indent=4)
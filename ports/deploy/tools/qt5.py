@@ -271,7 +271,8 @@ class DeployToolsQt(tools.utils.DeployToolsUtils):
 
                 if os.path.exists(sysModulePath):
                     print('    {} -> {}'.format(sysModulePath, installModulePath))
-                    self.copy(sysModulePath, installModulePath)
+                    result = self.copyTree(sysModulePath, installModulePath)
+                    print('        ' + self.throughput(result))
                     solvedImports.add(imp)
                     self.dependencies.append(os.path.join(sysModulePath, 'qmldir'))
 
@@ -334,7 +335,8 @@ class DeployToolsQt(tools.utils.DeployToolsUtils):
                         continue
 
                     print('    {} -> {}'.format(sysPluginPath, pluginPath))
-                    self.copy(sysPluginPath, pluginPath)
+                    result = self.copyTree(sysPluginPath, pluginPath)
+                    print('        ' + self.throughput(result))
                     plugins.append(plugin)
                     self.dependencies.append(sysPluginPath)
 
@@ -459,6 +461,8 @@ class DeployToolsQt(tools.utils.DeployToolsUtils):
             for path in paths:
                 qtconf.write('{} = {}\n'.format(path, paths[path]))
 
+        self.recordStaged(self.qtConf)
+
     @staticmethod
     def readChangeLog(changeLog, appName, version):
         if os.path.exists(changeLog):
@@ -520,7 +524,7 @@ class DeployToolsQt(tools.utils.DeployToolsUtils):
             licenseOutFile += '.txt'
 
         self.copy(self.licenseFile, os.path.join(metaDir, licenseOutFile))
-        self.copy(self.rootInstallDir, dataDir)
+        self.copyStaged(self.rootInstallDir, dataDir)
 
         configXml = os.path.join(self.installerConfig, 'config.xml')
         appName = packageConf['Package']['appName'].strip()
@@ -642,6 +646,8 @@ class DeployToolsQt(tools.utils.DeployToolsUtils):
             f.write('buildDir=build\n')
             f.write('qt5AndroidDir={}\n'.format(javaDir))
 
+        self.recordStaged(properties)
+
     def createRccBundle(self):
         rcc = os.path.join(os.path.dirname(self.qmake), 'rcc')
         assetsDir = os.path.abspath(os.path.join(self.assetsIntallDir, '..'))
@@ -669,3 +675,4 @@ class DeployToolsQt(tools.utils.DeployToolsUtils):
         process.communicate()
 
         shutil.rmtree(self.assetsIntallDir, True)
+        self.recordStaged(self.assetsIntallDir + '.rcc')
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Webcamoid, webcam capture application.
+# Copyright (C) 2017  Gonzalo Exequiel Pedone
+#
+# Webcamoid is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Webcamoid is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Webcamoid. If not, see <http://www.gnu.org/licenses/>.
+#
+# Web-Site: http://webcamoid.github.io/
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+
+# Cache of stripped binaries.
+#
+# Each entry is indexed by the hash of the unstripped binary and the identity
+# of the tool used to strip it. The least recently used entries are removed
+# when the cache grows beyond maxSize.
+class StripCache:
+    def __init__(self, cacheDir, maxSize=1024 * 1024 * 1024):
+        self.cacheDir = cacheDir
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        self.mutex = threading.Lock()
+
+    @staticmethod
+    def key(fileHash, stripIdentity):
+        return hashlib.sha256('{}\x00{}'.format(fileHash,
+                                                stripIdentity).encode()).hexdigest()
+
+    def entryPath(self, key):
+        return os.path.join(self.cacheDir, key[: 2], key)
+
+    @staticmethod
+    def copyAtomically(src, dst):
+        dstDir = os.path.dirname(dst)
+
+        if not os.path.exists(dstDir):
+            os.makedirs(dstDir, exist_ok=True)
+
+        fd, tmpPath = tempfile.mkstemp(prefix='.' + os.path.basename(dst) + '.',
+                                       dir=dstDir)
+        os.close(fd)
+
+        try:
+            shutil.copyfile(src, tmpPath)
+
+            if os.path.exists(dst):
+                shutil.copymode(dst, tmpPath)
+
+            os.replace(tmpPath, dst)
+        except:
+            os.remove(tmpPath)
+
+            return False
+
+        return True
+
+    def get(self, key, binary):
+        # The cached binary is copied instead of hard linked, the deployed
+        # binaries are modified in place later (permissions, rpaths), and
+        # that would modify the cached copy too.
+        entry = self.entryPath(key)
+
+        if not os.path.exists(entry) or not self.copyAtomically(entry, binary):
+            with self.mutex:
+                self.misses += 1
+
+            return False
+
+        # Mark the entry as recently used.
+        try:
+            os.utime(entry)
+        except:
+            pass
+
+        with self.mutex:
+            self.hits += 1
+
+        return True
+
+    def set(self, key, binary):
+        self.copyAtomically(binary, self.entryPath(key))
+
+    def evict(self):
+        # Remove the least recently used entries until the cache fits in
+        # maxSize.
+        entries = []
+        totalSize = 0
+
+        for root, _, files in os.walk(self.cacheDir):
+            for f in files:
+                path = os.path.join(root, f)
+
+                try:
+                    st = os.stat(path)
+                except:
+                    continue
+
+                entries.append((st.st_mtime_ns, st.st_size, path))
+                totalSize += st.st_size
+
+        evicted = 0
+
+        for _, size, path in sorted(entries):
+            if totalSize <= self.maxSize:
+                break
+
+            try:
+                os.remove(path)
+                totalSize -= size
+                evicted += 1
+            except:
+                pass
+
+        return evicted
+
+    def close(self):
+        if os.path.exists(self.cacheDir):
+            self.evict()
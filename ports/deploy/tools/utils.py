@@ -19,14 +19,21 @@
 #
 # Web-Site: http://webcamoid.github.io/
 
+import concurrent.futures
 import fnmatch
 import hashlib
+import math
 import multiprocessing
 import os
 import platform
 import shutil
 import subprocess # nosec
 import sys
+import tempfile
+import threading
+import time
+
+import tools.copybackend
 
 class DeployToolsUtils:
     def __init__(self):
@@ -56,6 +63,27 @@ class DeployToolsUtils:
         if self.njobs < 4:
             self.njobs = 4
 
+        self.skipUpToDate = False
+
+        # The staging directory of the previous deploy is kept in mirrorDir,
+        # the files that didn't change are moved back from there instead of
+        # being copied again.
+        self.stagingDir = ''
+        self.mirrorDir = ''
+        self.copyTotals = tools.copybackend.CopyResult()
+        self.stagingManifest = None
+
+        # Policy used to check if a file must be copied again: 'size+mtime'
+        # or 'hash'.
+        self.copyPolicy = 'size+mtime'
+
+        if 'DEPLOY_COPY_POLICY' in os.environ \
+            and os.environ['DEPLOY_COPY_POLICY'] in ['size+mtime', 'hash']:
+            self.copyPolicy = os.environ['DEPLOY_COPY_POLICY']
+
+        self.copyMutex = threading.Lock()
+        self.copyBackend = tools.copybackend.CopyBackend()
+
     def detectTargetArch(self, binary=''):
         if binary == '':
             binary = self.mainBinary
@@ -71,31 +99,87 @@ class DeployToolsUtils:
 
         return ''
 
+    def copyResult(self, copied=0, skipped=0, failed=0, size=0):
+        # Create the result of copying a single file and add it to the
+        # totals.
+        result = tools.copybackend.CopyResult(copied,
+                                              skipped,
+                                              failed,
+                                              size if copied else 0,
+                                              size if skipped else 0)
+
+        with self.copyMutex:
+            self.copyTotals.update(result)
+
+        return result
+
+    def recordStaged(self, dst, src=''):
+        if self.stagingManifest:
+            self.stagingManifest.record(dst, src)
+
+    def mirrorPath(self, path):
+        # Returns the path of the copy of path kept from the previous deploy.
+        if len(self.stagingDir) < 1 or len(self.mirrorDir) < 1:
+            return ''
+
+        relpath = os.path.relpath(os.path.abspath(path),
+                                  os.path.abspath(self.stagingDir))
+
+        if relpath == os.curdir or relpath.startswith(os.pardir):
+            return ''
+
+        return os.path.join(self.mirrorDir, relpath)
+
+    def restoreFromMirror(self, src, dst):
+        # Move the copy of src kept from the previous deploy to dst, if it
+        # didn't change. Stripped and rewritten files never match the
+        # original file, so these are always copied again.
+        mirror = self.mirrorPath(dst)
+
+        if len(mirror) < 1 \
+            or not os.path.lexists(mirror) \
+            or not self.isUpToDate(src, mirror):
+            return False
+
+        try:
+            os.rename(mirror, dst)
+        except:
+            return False
+
+        return True
+
+    def keepMirror(self):
+        # Replace the mirror with the current staging directory. The
+        # staging directory is removed if it can't be moved.
+        if len(self.stagingDir) < 1 or not os.path.exists(self.stagingDir):
+            return
+
+        if len(self.mirrorDir) > 0:
+            shutil.rmtree(self.mirrorDir, True)
+
+            try:
+                parent = os.path.dirname(self.mirrorDir)
+
+                if not os.path.exists(parent):
+                    os.makedirs(parent)
+
+                os.rename(self.stagingDir, self.mirrorDir)
+
+                return
+            except:
+                pass
+
+        shutil.rmtree(self.stagingDir, True)
+
     def copy(self, src, dst='.', copyReals=False, overwrite=True):
         if not os.path.exists(src):
-            return False
+            return self.copyResult(failed=1)
 
         if os.path.isdir(src):
             if os.path.isfile(dst):
-                return False
+                return self.copyResult(failed=1)
 
-            for root, dirs, files in os.walk(src):
-                for f in files:
-                    fromF = os.path.join(root, f)
-                    toF = os.path.relpath(fromF, src)
-                    toF = os.path.join(dst, toF)
-                    toF = os.path.normpath(toF)
-                    self.copy(fromF, toF, copyReals, overwrite)
-
-                for d in dirs:
-                    fromD = os.path.join(root, d)
-                    toD = os.path.relpath(fromD, src)
-                    toD = os.path.join(dst, toD)
-
-                    try:
-                        os.makedirs(os.path.normpath(toD))
-                    except:
-                        pass
+            return self.copyTree(src, dst, copyReals, overwrite)
         elif os.path.isfile(src):
             if os.path.isdir(dst):
                 dst = os.path.realpath(dst)
@@ -107,62 +191,301 @@ class DeployToolsUtils:
                 try:
                     os.makedirs(dirname)
                 except:
-                    return False
+                    return self.copyResult(failed=1)
+
+            isLink = os.path.islink(src)
+
+            try:
+                size = os.lstat(src).st_size
+            except:
+                size = 0
 
             if os.path.exists(dst):
                 if not overwrite:
-                    return True
+                    return self.copyResult(skipped=1, size=size)
+
+                # Symlinks copied with copyReals are always recreated, the
+                # file they point to will be skipped if it's unchanged.
+                if self.skipUpToDate \
+                    and not (copyReals and isLink) \
+                    and self.isUpToDate(src, dst):
+                    self.recordStaged(dst, src)
+
+                    return self.copyResult(skipped=1, size=size)
 
                 try:
                     os.remove(dst)
                 except:
-                    return False
+                    return self.copyResult(failed=1)
+
+            if self.skipUpToDate \
+                and not (copyReals and isLink) \
+                and self.restoreFromMirror(src, dst):
+                self.recordStaged(dst, src)
+
+                return self.copyResult(skipped=1, size=size)
 
-            if copyReals and os.path.islink(src):
+            if copyReals and isLink:
                 realpath = os.path.realpath(src)
                 basename = os.path.basename(realpath)
                 os.symlink(os.path.join('.', basename), dst)
-                self.copy(realpath,
-                          os.path.join(dirname, basename),
-                          copyReals,
-                          overwrite)
-            else:
+                self.recordStaged(dst, src)
+                result = self.copy(realpath,
+                                   os.path.join(dirname, basename),
+                                   copyReals,
+                                   overwrite)
+                result.update(self.copyResult(copied=1))
+
+                return result
+            elif self.system != 'windows' and isLink:
                 try:
-                    if self.system == 'windows':
-                        shutil.copy(src, dst)
-                    else:
-                        shutil.copy(src, dst, follow_symlinks=False)
+                    shutil.copy(src, dst, follow_symlinks=False)
                 except:
-                    return False
+                    return self.copyResult(failed=1)
+            elif not self.copyBackend.copy(src, dst):
+                return self.copyResult(failed=1)
+            else:
+                # Keep the modification time of the source, so the size+mtime
+                # policy can tell if the file changed in the next deploy.
+                self.copyTimes(src, dst)
 
-        return True
+            self.recordStaged(dst, src)
+
+            return self.copyResult(copied=1, size=size)
+
+        return tools.copybackend.CopyResult()
+
+    @staticmethod
+    def copyTimes(src, dst):
+        try:
+            st = os.stat(src)
+            os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns))
+        except:
+            pass
+
+    @staticmethod
+    def listTree(path):
+        # Returns the directories and the files inside path, relative to it.
+        # Each file is returned as:
+        #
+        # (relativePath, size)
+        #
+        # Symlinks to directories are listed as directories but, like
+        # os.walk() does, their contents are not listed.
+        dirs = []
+        files = []
+        subdirs = ['']
+
+        while len(subdirs) > 0:
+            subdir = subdirs.pop()
+
+            try:
+                with os.scandir(os.path.join(path, subdir)) as entries:
+                    for entry in entries:
+                        relpath = os.path.join(subdir, entry.name)
+
+                        try:
+                            isDir = entry.is_dir()
+                        except:
+                            isDir = False
+
+                        if isDir:
+                            dirs.append(relpath)
+
+                            if not entry.is_symlink():
+                                subdirs.append(relpath)
+
+                            continue
+
+                        try:
+                            size = entry.stat(follow_symlinks=False).st_size
+                        except:
+                            size = 0
+
+                        files.append((relpath, size))
+            except:
+                pass
+
+        return dirs, files
+
+    def copyTree(self, src, dst, copyReals=False, overwrite=True):
+        # Copy the contents of the directory src into dst.
+        dirs, files = self.listTree(src)
+
+        return self.copyFiles(src, dst, dirs, files, copyReals, overwrite)
+
+    def copyFiles(self, src, dst, dirs, files, copyReals=False, overwrite=True):
+        # Copy the given directories and files from src to dst, as returned
+        # by listTree(). All the directories are created first, and then the
+        # files are copied in parallel.
+        start = time.time()
+
+        for d in dirs:
+            try:
+                os.makedirs(os.path.join(dst, d))
+            except:
+                pass
+
+            self.recordStaged(os.path.join(dst, d))
+
+        def copyFile(f):
+            return self.copy(os.path.join(src, f[0]),
+                             os.path.join(dst, f[0]),
+                             copyReals,
+                             overwrite)
+
+        result = tools.copybackend.CopyResult()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.njobs) as executor:
+            for fileResult in executor.map(copyFile, files):
+                result.update(fileResult)
+
+        result.elapsed = time.time() - start
+
+        return result
+
+    def copyStaged(self, src, dst):
+        # Copy the directory src, inside the staging directory, to dst using
+        # the files listed in the staging manifest. If the staging directory
+        # wasn't scanned yet, the directory is copied as is.
+        manifest = self.stagingManifest
+
+        if not manifest or len(manifest.entries) < 1:
+            return self.copy(src, dst)
+
+        subdir = os.path.relpath(os.path.abspath(src),
+                                 os.path.abspath(manifest.rootDir))
+
+        if subdir.startswith(os.pardir):
+            return self.copy(src, dst)
+
+        if subdir == os.curdir:
+            subdir = ''
+
+        def relpath(path):
+            return os.path.relpath(path, subdir) if len(subdir) > 0 else path
+
+        return self.copyFiles(src,
+                              dst,
+                              [relpath(d) for d in manifest.dirs(subdir)],
+                              [(relpath(entry['path']), entry['size'])
+                               for entry in manifest.files(subdir)])
 
+    def throughput(self, result):
+        elapsed = max(result.elapsed, 1e-6)
+
+        return '{} files, {} in {:.2f} s ({:.1f} files/s, {}/s), ' \
+               '{} unchanged files skipped'.format(result.copied,
+                                                   self.hrSize(result.copiedBytes),
+                                                   elapsed,
+                                                   result.copied / elapsed,
+                                                   self.hrSize(int(result.copiedBytes / elapsed)),
+                                                   result.skipped)
+
+    def isUpToDate(self, src, dst):
+        # Returns True if dst doesn't need to be copied again.
+        if os.path.islink(src) and self.system != 'windows':
+            try:
+                return os.path.islink(dst) and os.readlink(src) == os.readlink(dst)
+            except:
+                return False
+
+        if os.path.islink(dst):
+            return False
+
+        try:
+            srcInfo = os.stat(src)
+            dstInfo = os.stat(dst)
+        except:
+            return False
+
+        if srcInfo.st_size != dstInfo.st_size:
+            return False
+
+        if self.copyPolicy == 'hash':
+            try:
+                return self.sha256sum(src) == self.sha256sum(dst)
+            except:
+                return False
+
+        return srcInfo.st_mtime_ns == dstInfo.st_mtime_ns
+
+    def copySummary(self, result):
+        return '{} files copied ({}), {} unchanged files skipped ({} not rewritten), ' \
+               '{} failed'.format(result.copied,
+                                  self.hrSize(result.copiedBytes),
+                                  result.skipped,
+                                  self.hrSize(result.skippedBytes),
+                                  result.failed)
+
+    @staticmethod
+    def hrSize(size):
+        i = int(math.log(size) // math.log(1024)) if size > 0 else 0
+
+        if i < 1:
+            return '{} B'.format(size)
+
+        units = ['KiB', 'MiB', 'GiB', 'TiB']
+        sizeKiB = size / (1024 ** i)
+
+        return '{:.2f} {}'.format(sizeKiB, units[i - 1])
+
+    @staticmethod
+    def writeFileAtomically(path, data):
+        # Write the new contents to a temporary file in the same directory
+        # and replace the original file with it, so the file is never left
+        # half written.
+        path = os.path.realpath(path)
+        permissions = os.stat(path).st_mode & 0o7777
+        fd, tmpPath = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.',
+                                       dir=os.path.dirname(path))
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+
+            os.chmod(tmpPath, permissions)
+            os.replace(tmpPath, path)
+        except:
+            os.remove(tmpPath)
+
+            return False
+
+        return True
 
     def move(self, src, dst='.', moveReals=False):
         if not os.path.exists(src):
-            return False
+            return tools.copybackend.CopyResult(failed=1)
 
         if os.path.isdir(src):
             if os.path.isfile(dst):
-                return False
+                return tools.copybackend.CopyResult(failed=1)
 
-            for root, dirs, files in os.walk(src):
-                for f in files:
-                    fromF = os.path.join(root, f)
-                    toF = os.path.relpath(fromF, src)
-                    toF = os.path.join(dst, toF)
-                    toF = os.path.normpath(toF)
-                    self.move(fromF, toF, moveReals)
+            start = time.time()
+            dirs, files = self.listTree(src)
 
-                for d in dirs:
-                    fromD = os.path.join(root, d)
-                    toD = os.path.relpath(fromD, src)
-                    toD = os.path.join(dst, toD)
+            for d in dirs:
+                try:
+                    os.makedirs(os.path.join(dst, d))
+                except:
+                    pass
 
-                    try:
-                        os.makedirs(os.path.normpath(toD))
-                    except:
-                        pass
+            def moveFile(f):
+                return self.move(os.path.join(src, f[0]),
+                                 os.path.join(dst, f[0]),
+                                 moveReals)
+
+            result = tools.copybackend.CopyResult()
+
+            # Several links can point to the same file when moving the real
+            # files, move these one by one.
+            with concurrent.futures.ThreadPoolExecutor(max_workers=1 if moveReals else self.njobs) as executor:
+                for fileResult in executor.map(moveFile, files):
+                    result.update(fileResult)
+
+            result.elapsed = time.time() - start
+
+            return result
         elif os.path.isfile(src):
             if os.path.isdir(dst):
                 dst = os.path.realpath(dst)
@@ -174,26 +497,55 @@ class DeployToolsUtils:
                 try:
                     os.makedirs(dirname)
                 except:
-                    return False
+                    return tools.copybackend.CopyResult(failed=1)
+
+            isLink = os.path.islink(src)
+
+            try:
+                size = os.lstat(src).st_size
+            except:
+                size = 0
 
             if os.path.exists(dst):
+                # Leave the destination untouched if it's the same file.
+                if self.skipUpToDate \
+                    and not (moveReals and isLink) \
+                    and self.isUpToDate(src, dst):
+                    try:
+                        os.remove(src)
+                    except:
+                        return tools.copybackend.CopyResult(failed=1)
+
+                    self.recordStaged(dst, src)
+
+                    return tools.copybackend.CopyResult(skipped=1,
+                                                        skippedBytes=size)
+
                 try:
                     os.remove(dst)
                 except:
-                    return False
+                    return tools.copybackend.CopyResult(failed=1)
 
-            if moveReals and os.path.islink(src):
+            if moveReals and isLink:
                 realpath = os.path.realpath(src)
                 basename = os.path.basename(realpath)
                 os.symlink(os.path.join('.', basename), dst)
-                self.move(realpath, os.path.join(dirname, basename), moveReals)
+                self.recordStaged(dst, src)
+                result = self.move(realpath, os.path.join(dirname, basename), moveReals)
+                result.update(tools.copybackend.CopyResult(copied=1))
+
+                return result
             else:
                 try:
                     shutil.move(src, dst)
                 except:
-                    return False
+                    return tools.copybackend.CopyResult(failed=1)
 
-        return True
+            self.recordStaged(dst, src)
+
+            return tools.copybackend.CopyResult(copied=1, copiedBytes=size)
+
+        return tools.copybackend.CopyResult()
 
     def detectMake(self):
         if 'MAKE_PATH' in os.environ:
@@ -226,22 +578,37 @@ class DeployToolsUtils:
         process.communicate()
         os.chdir(previousDir)
 
+        # This is the only time the staging directory is walked, the files
+        # placed after this are recorded one by one.
+        if self.stagingManifest:
+            self.stagingManifest.recordTree()
+
         return process.returncode
 
     @staticmethod
-    def sha256sum(fileName):
-        sha = hashlib.sha256()
-
-        with open(fileName, 'rb') as f:
+    def fileDigests(fileName, algorithms=('sha256',)):
+        # Hash the file with all the algorithms in a single pass. hashlib
+        # releases the GIL while hashing big buffers, so several files can
+        # be hashed in parallel.
+        hashes = [hashlib.new(algorithm) for algorithm in algorithms]
+        data = bytearray(1024 * 1024)
+        view = memoryview(data)
+
+        with open(fileName, 'rb', buffering=0) as f:
             while True:
-                data = f.read(1024)
+                size = f.readinto(data)
 
-                if not data:
+                if not size:
                     break
 
-                sha.update(data)
+                for h in hashes:
+                    h.update(view[: size])
 
-        return sha.hexdigest()
+        return {algorithm: h.hexdigest() for algorithm, h in zip(algorithms, hashes)}
+
+    @staticmethod
+    def sha256sum(fileName):
+        return DeployToolsUtils.fileDigests(fileName)['sha256']
 
     @staticmethod
     def detectMakeFiles(makePath):